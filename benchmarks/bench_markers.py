@@ -0,0 +1,246 @@
+"""
+Marker search: backends and full resolution vs coarse to fine.
+
+    python -m benchmarks.bench_markers --dpi 300 600 --pages 20 --clutter 0 300
+
+ImageAligner._find_markers is timed on synthetic marksheets with each
+marker_backend and marker_search_scale on the same images.
+--clutter draws small dots and strokes (noise, staples, handwriting)
+in each marker range.
+The markers of each backend are checked against its full resolution search,
+and the exit code is 1 if some marker differs by more than --tol px,
+or differs from the contour backend by more than --backend_tol px.
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+from typing import List
+
+import cv2
+import numpy as np
+
+from src.setting_io_ds import load_settings
+from src.image_io import read_image, list_images
+from src.align_images import ImageAligner, MARKER_BACKENDS
+from src.metrics import summarize_seconds
+from benchmarks.synthetic import generate
+
+logger = logging.getLogger("adjust-scan-images")
+
+
+def add_clutter(
+    img: np.ndarray, marker_ranges: tuple, n: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Draw n small dots and strokes in each marker range, apart from the dark pixels.
+
+    Returns
+    -------
+    np.ndarray
+        A new image.
+    """
+    img = img.copy()
+    orig = img.copy()
+    ih, iw = img.shape
+    for x, y, w, h in marker_ranges:
+        x, y = x + iw if x < 0 else x, y + ih if y < 0 else y
+        for _ in range(n):
+            px, py = int(rng.integers(x, x + w)), int(rng.integers(y, y + h))
+            if orig[max(py - 20, 0) : py + 20, max(px - 20, 0) : px + 20].min() < 128:
+                continue
+            # large enough to remain after the Gaussian filter.
+            if rng.random() < 0.7:
+                cv2.circle(img, (px, py), int(rng.integers(3, 6)), 0, -1)
+            else:
+                dx, dy = rng.integers(-12, 13, 2).tolist()
+                cv2.line(img, (px, py), (px + dx, py + dy), 0, 4)
+    return img
+
+
+def bench_markers(
+    paths: dict,
+    dpi: int,
+    backends: List[str],
+    scales: List[int],
+    clutter: int,
+    repeat: int,
+    tol: float,
+    backend_tol: float,
+) -> dict:
+    """
+    Benchmark the marker search with each backend and scale on a dataset.
+
+    Parameters
+    ----------
+    paths : dict
+        The result of benchmarks.synthetic.generate.
+    dpi : int
+        Resolution of the dataset.
+    backends : List[str]
+        marker_backend values.
+    scales : List[int]
+        marker_search_scale values. 1 is the full resolution search.
+    clutter : int
+        The number of the dots and strokes in each marker range.
+    repeat : int
+        The number of times each page is searched.
+    tol : float
+        Tolerance of the marker coords against the full resolution search in px.
+    backend_tol : float
+        Tolerance of the marker coords against the contour backend in px.
+
+    Returns
+    -------
+    dict
+        {"dpi", "clutter", "range_px", "cases": [{"backend", "scale", "p50_ms", ...,
+        "max_diff_px", "contour_diff_px", "ok"}]}.
+    """
+    metadata = load_settings(paths["setting"], (dpi, dpi), None)
+    rng = np.random.default_rng(0)
+    imgs = [
+        add_clutter(read_image(p)[0], metadata["marker_range"], clutter, rng)
+        for p in list_images(paths["img_dir"])
+    ]
+
+    def search(backend, scale):
+        return ImageAligner(
+            dict(metadata, marker_backend=backend, marker_search_scale=scale)
+        )
+
+    def max_diff(found, expected):
+        diff = 0.0
+        for a, b in zip(found, expected):
+            if a is False or b is False:
+                diff = diff if a is b else float("inf")
+            else:
+                diff = max(diff, float(np.abs(a - b).max()))
+        return diff
+
+    contour = [search("contour", 1)._find_markers(img) for img in imgs]
+    cases = []
+    for backend in backends:
+        expected = [search(backend, 1)._find_markers(img) for img in imgs]
+        for scale in scales:
+            aligner = search(backend, scale)
+            seconds = []
+            found = []
+            for img in imgs:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    markers = aligner._find_markers(img)
+                    seconds.append(time.perf_counter() - start)
+                found.append(markers)
+            w, h = metadata["marker_range"][0][2:]
+            case = {
+                "backend": backend,
+                "scale": scale,
+                "effective_scale": aligner._scale_of(w, h),
+                **summarize_seconds(seconds),
+                "max_diff_px": max_diff(found, expected),
+                "contour_diff_px": max_diff(found, contour),
+            }
+            case["ok"] = (
+                case["max_diff_px"] <= tol and case["contour_diff_px"] <= backend_tol
+            )
+            cases.append(case)
+    return {
+        "dpi": dpi,
+        "clutter": clutter,
+        "range_px": metadata["marker_range"][0][2],
+        "cases": cases,
+    }
+
+
+def print_report(report: dict):
+    """
+    Print a report as a table.
+    """
+    print(
+        f"\n=== {report['dpi']} dpi (marker range {report['range_px']} px, "
+        f"clutter {report['clutter']}) ==="
+    )
+    print(
+        f"{'backend':<12}{'scale':<10}{'p50 ms':>10}{'p95 ms':>10}{'speedup':>10}"
+        f"{'diff px':>10}{'vs contour':>12}"
+    )
+    # the speedup against the contour backend at full resolution.
+    base = next(
+        (
+            c
+            for c in report["cases"]
+            if c["backend"] == "contour" and c["effective_scale"] == 1
+        ),
+        None,
+    )
+    for c in report["cases"]:
+        scale = "auto" if c["scale"] == 0 else str(c["scale"])
+        scale += f" ({c['effective_scale']})" if c["scale"] == 0 else ""
+        speedup = base["p50_ms"] / c["p50_ms"] if base else float("nan")
+        mark = "" if c["ok"] else "  <- NG"
+        print(
+            f"{c['backend']:<12}{scale:<10}{c['p50_ms']:>10.2f}{c['p95_ms']:>10.2f}"
+            f"{speedup:>10.2f}{c['max_diff_px']:>10.2g}{c['contour_diff_px']:>12.2g}"
+            f"{mark}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Marker search benchmark.")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[300, 600])
+    parser.add_argument("-n", "--pages", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--backends", nargs="+", default=list(MARKER_BACKENDS), choices=MARKER_BACKENDS
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1, 4, 8, 0],
+        help="marker_search_scale values (0 == auto, 1 == full resolution).",
+    )
+    parser.add_argument(
+        "--clutter",
+        type=int,
+        nargs="+",
+        default=[0, 300],
+        help="The numbers of the dots and strokes in each marker range.",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tol", type=float, default=1e-6)
+    parser.add_argument("--backend_tol", type=float, default=0.5)
+    parser.add_argument("--json", default=None, help="Save the reports as json.")
+    args = parser.parse_args()
+    logger.setLevel(logging.ERROR)
+
+    reports = []
+    for dpi in args.dpi:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = generate(os.path.join(tmp, "data"), args.pages, dpi, args.seed)
+            for clutter in args.clutter:
+                report = bench_markers(
+                    paths,
+                    dpi,
+                    args.backends,
+                    args.scales,
+                    clutter,
+                    args.repeat,
+                    args.tol,
+                    args.backend_tol,
+                )
+                print_report(report)
+                reports.append(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=1)
+    if not all(c["ok"] for r in reports for c in r["cases"]):
+        print("SOME MARKERS DIFFER.")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
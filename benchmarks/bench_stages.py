@@ -0,0 +1,298 @@
+"""
+Per-stage throughput and latency on synthetic marksheets.
+
+    python -m benchmarks.bench_stages --dpi 300 600 --pages 30
+
+The read marks are checked against the ground truth,
+and the exit code is 1 if some page is read wrongly.
+"""
+
+import os
+import csv
+import glob
+import json
+import time
+import logging
+import argparse
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from src import setting_io_ds
+from src.setting_io_ds import load_settings
+from src.image_io import read_image, list_images, ImageSaver
+from src.output_format import OutputFormat
+from src.align_images import ImageAligner
+from src.read_marksheet import MarkReader
+from src.pipeline import pipeline
+from src.metrics import summarize_seconds
+from benchmarks.synthetic import generate
+
+logger = logging.getLogger("adjust-scan-images")
+
+# name -> OutputFormat options
+CODEC_POLICIES = {
+    "png (default)": {"output_format": "png"},
+    "png level 1": {"output_format": "png", "png_compress_level": 1},
+    "png level 9": {"output_format": "png", "png_compress_level": 9},
+    "jpeg q75": {"output_format": "jpeg"},
+    "jpeg q90": {"output_format": "jpeg", "jpeg_quality": 90},
+    "tiff lzw": {"output_format": "tiff", "tiff_compression": "lzw"},
+    "tiff deflate": {"output_format": "tiff", "tiff_compression": "deflate"},
+    "png 1-bit": {"output_format": "png", "output_binary": 1},
+    "tiff group4 1-bit": {
+        "output_format": "tiff",
+        "tiff_compression": "group4",
+        "output_binary": 1,
+    },
+}
+
+
+def summarize(stage: str, seconds: List[float]) -> dict:
+    """
+    Summary of the latencies of a stage.
+    """
+    summary = {"stage": stage, **summarize_seconds(seconds)}
+    summary["per_s"] = len(seconds) / summary["total_s"]
+    return summary
+
+
+def timeit(fn: Callable, *args, **kargs):
+    """
+    Call fn and return (result, seconds).
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kargs)
+    return result, time.perf_counter() - start
+
+
+def accuracy(results: Dict[str, dict], truth: Dict[str, dict]) -> float:
+    """
+    The ratio of the pages whose all categories are read correctly.
+    """
+    ok = sum(
+        all(str(results.get(name, {}).get(k)) == str(v) for k, v in answers.items())
+        for name, answers in truth.items()
+    )
+    return ok / len(truth)
+
+
+def bench_codecs(
+    imgs: List[np.ndarray], dpi: int, work_dir: str, policies: List[str]
+) -> List[dict]:
+    """
+    Encode time and output size of each codec policy.
+
+    Parameters
+    ----------
+    imgs : List[np.ndarray]
+        Aligned images.
+    dpi : int
+        Resolution of the images.
+    work_dir : str
+        The directory where the images are saved.
+    policies : List[str]
+        The names of CODEC_POLICIES.
+
+    Returns
+    -------
+    List[dict]
+        [{"policy", "n", ..., "p50_ms", "mean_bytes"}].
+    """
+    results = []
+    for policy in policies:
+        output_format = OutputFormat(**CODEC_POLICIES[policy])
+        seconds = []
+        sizes = []
+        for i, img in enumerate(imgs):
+            path = os.path.join(work_dir, output_format.filename(f"codec{i}.png"))
+            _, t = timeit(output_format.save, path, img, (dpi, dpi))
+            seconds.append(t)
+            sizes.append(os.path.getsize(path))
+            os.remove(path)
+        results.append(
+            {
+                "policy": policy,
+                **summarize_seconds(seconds),
+                "mean_bytes": float(np.mean(sizes)),
+            }
+        )
+    return results
+
+
+def bench_stages(
+    paths: dict,
+    dpi: int,
+    work_dir: str,
+    pipeline_kargs: dict,
+    codec_policies: Optional[List[str]] = None,
+) -> dict:
+    """
+    Benchmark each stage and the full pipeline on a dataset.
+
+    Parameters
+    ----------
+    paths : dict
+        The result of benchmarks.synthetic.generate.
+    dpi : int
+        Resolution of the dataset.
+    work_dir : str
+        The directory where the images are saved.
+    pipeline_kargs : dict
+        Keyword arguments of pipeline().
+    codec_policies : List[str] | None, optional
+        If given, the aligned images are encoded with these CODEC_POLICIES,
+        by default None.
+
+    Returns
+    -------
+    dict
+        {"dpi", "stages", "accuracy", "codecs"}.
+    """
+    with open(paths["truth"]) as f:
+        truth = json.load(f)
+    timings: Dict[str, List[float]] = {
+        "load_settings (parse)": [],
+        "load_settings (cache)": [],
+        "read_image": [],
+        "ImageAligner.fit": [],
+        "ImageAligner.transform_one": [],
+        "MarkReader.read": [],
+        "ImageSaver.save": [],
+    }
+
+    cache_dir = os.path.join(work_dir, "cache")
+    setting_io_ds._SETTINGS_MEMO.clear()
+    metadata, t = timeit(load_settings, paths["setting"], (dpi, dpi), cache_dir)
+    timings["load_settings (parse)"].append(t)
+    setting_io_ds._SETTINGS_MEMO.clear()
+    _, t = timeit(load_settings, paths["setting"], (dpi, dpi), cache_dir)
+    timings["load_settings (cache)"].append(t)
+
+    (baseimg, _), _ = timeit(read_image, paths["base"])
+    aligner = ImageAligner(metadata)
+    _, t = timeit(aligner.fit, baseimg)
+    timings["ImageAligner.fit"].append(t)
+    mark_reader = MarkReader(metadata)
+    mark_reader.fit(baseimg)
+    image_saver = ImageSaver(os.path.join(work_dir, "stages"))
+
+    results = {}
+    aligned = []
+    for p in list_images(paths["img_dir"]):
+        (img, img_dpi), t = timeit(read_image, p)
+        timings["read_image"].append(t)
+        img, t = timeit(aligner.transform_one, img)
+        timings["ImageAligner.transform_one"].append(t)
+        if codec_policies:
+            aligned.append(img)
+        v, t = timeit(mark_reader.read, img)
+        timings["MarkReader.read"].append(t)
+        results[os.path.basename(p)] = v
+        _, t = timeit(image_saver.save, os.path.basename(p), img, img_dpi)
+        timings["ImageSaver.save"].append(t)
+    image_saver.close()
+    stages = [summarize(k, v) for k, v in timings.items()]
+    codecs = bench_codecs(aligned, dpi, work_dir, codec_policies or [])
+    del aligned
+
+    save_dir = os.path.join(work_dir, "pipeline")
+    os.makedirs(save_dir, exist_ok=True)
+    _, t = timeit(
+        pipeline,
+        paths["img_dir"],
+        paths["setting"],
+        save_dir,
+        paths["base"],
+        **pipeline_kargs,
+    )
+    pipeline_stage = summarize("pipeline", [t])
+    pipeline_stage["per_s"] = len(truth) / t
+    stages.append(pipeline_stage)
+    with open(
+        glob.glob(os.path.join(save_dir, "marksheet_result_*.csv"))[0],
+        encoding="shift_jis",
+    ) as f:
+        pipeline_results = {row["origin_filename"]: row for row in csv.DictReader(f)}
+
+    return {
+        "dpi": dpi,
+        "stages": stages,
+        "codecs": codecs,
+        "accuracy": {
+            "stages": accuracy(results, truth),
+            "pipeline": accuracy(pipeline_results, truth),
+        },
+    }
+
+
+def print_report(report: dict):
+    """
+    Print a report as a table.
+    """
+    print(f"\n=== {report['dpi']} dpi ===")
+    print(
+        f"{'stage':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'img/s':>10}"
+    )
+    for s in report["stages"]:
+        print(
+            f"{s['stage']:<28}{s['n']:>6}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}"
+            f"{s['max_ms']:>10.1f}{s['per_s']:>10.2f}"
+        )
+    if report["codecs"]:
+        print(f"{'codec':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'KiB/page':>12}")
+        for c in report["codecs"]:
+            print(
+                f"{c['policy']:<28}{c['n']:>6}{c['p50_ms']:>10.1f}{c['p95_ms']:>10.1f}"
+                f"{c['mean_bytes'] / 1024:>12.1f}"
+            )
+    print(f"accuracy: {report['accuracy']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmark.")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[300])
+    parser.add_argument("-n", "--pages", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ext", default=".png")
+    parser.add_argument("--setting", default=None, help="Layout source setting.xlsx.")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--codecs",
+        nargs="*",
+        default=None,
+        choices=list(CODEC_POLICIES),
+        help="Encode the aligned images with these policies (all if no names).",
+    )
+    parser.add_argument("--json", default=None, help="Save the reports as json.")
+    args = parser.parse_args()
+    logger.setLevel(logging.ERROR)
+
+    reports = []
+    for dpi in args.dpi:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = generate(
+                os.path.join(tmp, "data"),
+                args.pages,
+                dpi,
+                args.seed,
+                args.ext,
+                args.setting,
+            )
+            codecs = args.codecs
+            if codecs is not None and not codecs:
+                codecs = list(CODEC_POLICIES)
+            report = bench_stages(paths, dpi, tmp, {"workers": args.workers}, codecs)
+        print_report(report)
+        reports.append(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=1)
+    if any(v < 1 for r in reports for v in r["accuracy"].values()):
+        print("SOME PAGES ARE READ WRONGLY.")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Startup time and the imported heavy modules.
+
+    python -m benchmarks.bench_startup --budget_ms 150
+
+Each case runs in a new interpreter, and the best of --repeat runs is reported
+without the interpreter startup itself.
+The exit code is 1 if a case is over its budget or imports a module
+that it must not import.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("numpy", "cv2", "PIL", "openpyxl")
+
+# Print the loaded heavy modules as json after the code.
+_EPILOGUE = f"""
+import sys, json
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))
+"""
+
+# A small single-folder run. argv: img_dir, setting, save_dir, base, cache_dir
+_RUN = """
+import sys, logging
+from src.log_setting import set_logger
+set_logger(logging.ERROR)
+from src.pipeline import pipeline
+pipeline(*sys.argv[1:5], cache_dir=sys.argv[5])
+"""
+
+
+def run_python(code: str, args: Tuple[str, ...] = (), repeat: int = 5) -> dict:
+    """
+    Run code in new interpreters.
+
+    Returns
+    -------
+    dict
+        {"best_ms", "modules"}: the best wall time and the loaded heavy modules.
+    """
+    best = float("inf")
+    modules = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, "-c", code + _EPILOGUE, *args],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        best = min(best, time.perf_counter() - start)
+        modules = json.loads(out.decode().splitlines()[-1])
+    return {"best_ms": best * 1000, "modules": modules}
+
+
+def bench_startup(
+    repeat: int, budget_ms: float, run_budget_ms: Optional[float], pages: int
+) -> list:
+    """
+    Benchmark the cases.
+
+    Returns
+    -------
+    list
+        [{"case", "ms", "budget_ms", "modules", "forbidden", "ok"}].
+    """
+    from benchmarks.synthetic import generate
+
+    interpreter = run_python("pass", repeat=repeat)["best_ms"]
+    cases = []
+
+    def add(case, result, budget, forbidden):
+        ms = result["best_ms"] - interpreter
+        bad = [m for m in result["modules"] if m in forbidden]
+        cases.append(
+            {
+                "case": case,
+                "ms": ms,
+                "budget_ms": budget,
+                "modules": result["modules"],
+                "forbidden": bad,
+                "ok": not bad and (budget is None or ms <= budget),
+            }
+        )
+
+    # until the first prompt
+    add(
+        "import src.main",
+        run_python("import src.main", repeat=repeat),
+        budget_ms,
+        HEAVY_MODULES,
+    )
+    add(
+        "import src.pipeline",
+        run_python("import src.pipeline", repeat=repeat),
+        None,
+        ("cv2", "openpyxl"),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = generate(os.path.join(tmp, "data"), pages, dpi=150)
+        cache_dir = os.path.join(tmp, "cache")
+        args = (paths["img_dir"], paths["setting"], "", paths["base"], cache_dir)
+
+        def run_args(i):
+            save_dir = os.path.join(tmp, f"out{i}")
+            os.makedirs(save_dir)
+            return args[:2] + (save_dir,) + args[3:]
+
+        add(f"cold run ({pages} pages)", run_python(_RUN, run_args(0), 1), None, ())
+        # warm runs use the cached settings and models, so openpyxl is not needed.
+        warm = [run_python(_RUN, run_args(i), 1) for i in range(1, repeat + 1)]
+        add(
+            f"warm run ({pages} pages)",
+            min(warm, key=lambda r: r["best_ms"]),
+            run_budget_ms,
+            ("openpyxl",),
+        )
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget_ms", type=float, default=150, help="Budget of import src.main."
+    )
+    parser.add_argument(
+        "--run_budget_ms", type=float, default=None, help="Budget of the warm run."
+    )
+    parser.add_argument("-n", "--pages", type=int, default=3)
+    parser.add_argument("--json", default=None, help="Save the report as json.")
+    args = parser.parse_args()
+
+    cases = bench_startup(args.repeat, args.budget_ms, args.run_budget_ms, args.pages)
+    print(f"{'case':<24}{'ms':>10}{'budget':>10}  modules")
+    for c in cases:
+        budget = "-" if c["budget_ms"] is None else f"{c['budget_ms']:.0f}"
+        mark = "" if c["ok"] else "  <- NG"
+        print(
+            f"{c['case']:<24}{c['ms']:>10.1f}{budget:>10}  {','.join(c['modules'])}"
+            f"{mark}"
+        )
+        if c["forbidden"]:
+            print(f"{'':<24}must not import: {','.join(c['forbidden'])}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(cases, f, indent=1)
+    if not all(c["ok"] for c in cases):
+        print("OVER THE STARTUP BUDGET.")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
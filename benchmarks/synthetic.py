@@ -0,0 +1,265 @@
+"""
+Synthetic marksheet scans with known answers.
+
+The layout is written in pt like setting.xlsx, and rendered at any dpi.
+"""
+
+import os
+import json
+import argparse
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import cv2
+from PIL import Image
+from openpyxl import Workbook
+from openpyxl.workbook.defined_name import DefinedName
+
+from src.setting_io_ds import MARK_CATEGORIES, read_metadata, read_marksheet_setting
+
+# A4 in pt.
+PAGE_SIZE = (595, 842)
+# (x, y, size) of the markers in pt: topleft, bottomleft, bottomright.
+MARKERS = ((12, 12, 22), (12, 808, 22), (561, 808, 22))
+MARK_VALUES = {
+    "room": tuple("ABCDEF"),
+    "class": tuple(str(i) for i in range(1, 10)),
+    "student_number_10": tuple(str(i) for i in range(10)),
+    "student_number_1": tuple(str(i) for i in range(10)),
+}
+IMAGE_SETTING = {
+    "resize_ratio": 1,
+    "coord_unit": "pt",
+    "is_align": 1,
+    "marker_range": 48,
+    "marker_gaussian_ksize": 15,
+    "marker_gaussian_std": 3,
+    "is_marksheet": 1,
+    "is_marksheet_fit": 1,
+    "sheet_coord_style": "rect",
+    "sheet_score_threshold": 20,
+    "sheet_gaussian_ksize": 5,
+    "sheet_gaussian_std": 1,
+}
+
+
+def default_sheet() -> Dict[str, Dict[str, Tuple[float, float, float, float]]]:
+    """
+    The default marksheet layout in pt: Dict[category, Dict[value, (x1, y1, x2, y2)]].
+    """
+    sheet = {}
+    for i, category in enumerate(MARK_CATEGORIES):
+        y = 150 + 40 * i
+        sheet[category] = {
+            value: (120 + 30 * j, y, 136 + 30 * j, y + 16)
+            for j, value in enumerate(MARK_VALUES[category])
+        }
+    return sheet
+
+
+def write_setting(path: str, sheet: Optional[dict] = None, **image_setting):
+    """
+    Write a setting.xlsx for the layout.
+
+    Parameters
+    ----------
+    path : str
+        The path of the xlsx file.
+    sheet : dict | None, optional
+        Layout in pt, by default default_sheet().
+    image_setting
+        Overwrite IMAGE_SETTING.
+    """
+    sheet = sheet or default_sheet()
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "image_setting"
+    ws.append(["key", "value"])
+    ws.append(["", ""])
+    for key, value in dict(IMAGE_SETTING, **image_setting).items():
+        ws.append([key, value])
+    ms = wb.create_sheet("marksheet")
+    row = 1
+    for category, values in sheet.items():
+        start = row
+        for value, coords in values.items():
+            ms.append([value, *coords])
+            row += 1
+        dn = DefinedName(category, attr_text=f"marksheet!$A${start}:$E${row - 1}")
+        try:
+            wb.defined_names[category] = dn
+        except TypeError:
+            # openpyxl < 3.1
+            wb.defined_names.append(dn)
+    wb.save(path)
+
+
+def read_sheet(setting_path: str) -> dict:
+    """
+    Read the layout in pt from a setting.xlsx.
+    """
+    return read_marksheet_setting(setting_path, 1, pt2px=72)
+
+
+def render(
+    sheet: dict,
+    dpi: int,
+    answers: Optional[dict] = None,
+    rng: Optional[np.random.Generator] = None,
+    angle: float = 0,
+    shift: float = 0,
+    blur: float = 0,
+    noise: float = 0,
+) -> np.ndarray:
+    """
+    Render a marksheet.
+
+    Parameters
+    ----------
+    sheet : dict
+        Layout in pt.
+    dpi : int
+        Resolution.
+    answers : dict | None, optional
+        Dict[category, value] of the filled marks, by default None (blank sheet).
+    rng : np.random.Generator | None, optional
+        Random generator of the jitter.
+    angle : float, optional
+        Maximum rotation in degree, by default 0.
+    shift : float, optional
+        Maximum translation in pt, by default 0.
+    blur : float, optional
+        Standard deviation of the Gaussian blur in px, by default 0.
+    noise : float, optional
+        Standard deviation of the Gaussian noise, by default 0.
+
+    Returns
+    -------
+    np.ndarray
+        A grayscale image.
+    """
+    rng = rng or np.random.default_rng(0)
+    answers = answers or {}
+    s = dpi / 72
+    w, h = int(PAGE_SIZE[0] * s), int(PAGE_SIZE[1] * s)
+    img = np.full((h, w), 255, dtype=np.uint8)
+    for x, y, size in MARKERS:
+        img[int(y * s) : int((y + size) * s), int(x * s) : int((x + size) * s)] = 0
+    for category, values in sheet.items():
+        for value, (x1, y1, x2, y2) in values.items():
+            center = (int((x1 + x2) / 2 * s), int((y1 + y2) / 2 * s))
+            axes = (int((x2 - x1) / 2 * s), int((y2 - y1) / 2 * s))
+            cv2.ellipse(img, center, axes, 0, 0, 360, 0, max(int(s), 1))
+            if answers.get(category) == value:
+                filled = (int(axes[0] * 0.8), int(axes[1] * 0.8))
+                cv2.ellipse(img, center, filled, 0, 0, 360, 40, -1)
+    if angle or shift:
+        M = cv2.getRotationMatrix2D((w / 2, h / 2), rng.uniform(-angle, angle), 1)
+        M[:, 2] += rng.uniform(-shift, shift, 2) * s
+        img = cv2.warpAffine(img, M, (w, h), borderValue=255)
+    if blur:
+        img = cv2.GaussianBlur(img, (0, 0), blur)
+    if noise:
+        noisy = img + rng.normal(0, noise, img.shape)
+        img = np.clip(noisy, 0, 255).astype(np.uint8)
+    return img
+
+
+def random_answers(sheet: dict, rng: np.random.Generator) -> dict:
+    """
+    Choose one value of each category.
+    """
+    return {
+        category: list(values)[rng.integers(len(values))]
+        for category, values in sheet.items()
+    }
+
+
+def generate(
+    out_dir: str,
+    pages: int,
+    dpi: int = 300,
+    seed: int = 0,
+    ext: str = ".png",
+    setting_path: Optional[str] = None,
+    angle: float = 1,
+    shift: float = 5,
+    blur: float = 1,
+    noise: float = 8,
+) -> dict:
+    """
+    Generate a dataset.
+
+    out_dir/setting.xlsx, out_dir/base{ext}, out_dir/imgs/*{ext} and
+    out_dir/truth.json (Dict[filename, answers]) are written.
+
+    Parameters
+    ----------
+    out_dir : str
+        Output directory.
+    pages : int
+        The number of the pages.
+    dpi : int, optional
+        Resolution, by default 300.
+    seed : int, optional
+        Random seed, by default 0.
+    ext : str, optional
+        Image format, by default ".png".
+    setting_path : str | None, optional
+        Use the layout of this setting.xlsx, by default None (default_sheet()).
+    angle, shift, blur, noise : float, optional
+        Jitter. See render().
+
+    Returns
+    -------
+    dict
+        Paths: {"setting", "base", "img_dir", "truth"}.
+    """
+    rng = np.random.default_rng(seed)
+    img_dir = os.path.join(out_dir, "imgs")
+    os.makedirs(img_dir, exist_ok=True)
+    paths = {
+        "setting": os.path.join(out_dir, "setting.xlsx"),
+        "base": os.path.join(out_dir, "base" + ext),
+        "img_dir": img_dir,
+        "truth": os.path.join(out_dir, "truth.json"),
+    }
+    if setting_path:
+        sheet = read_sheet(setting_path)
+        metadata = read_metadata(setting_path)
+        image_setting = {k: v for k, v in metadata.items() if k in IMAGE_SETTING}
+        image_setting["marker_range"] = IMAGE_SETTING["marker_range"]
+        write_setting(paths["setting"], sheet, **image_setting)
+    else:
+        sheet = default_sheet()
+        write_setting(paths["setting"], sheet)
+    Image.fromarray(render(sheet, dpi)).save(paths["base"], dpi=(dpi, dpi))
+    truth = {}
+    for i in range(pages):
+        answers = random_answers(sheet, rng)
+        img = render(sheet, dpi, answers, rng, angle, shift, blur, noise)
+        filename = f"page{i:05}{ext}"
+        Image.fromarray(img).save(os.path.join(img_dir, filename), dpi=(dpi, dpi))
+        truth[filename] = answers
+    with open(paths["truth"], "w") as f:
+        json.dump(truth, f, ensure_ascii=False, indent=1)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic marksheets.")
+    parser.add_argument("out_dir")
+    parser.add_argument("-n", "--pages", type=int, default=20)
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ext", default=".png")
+    parser.add_argument("--setting", default=None, help="Layout source setting.xlsx.")
+    args = parser.parse_args()
+    paths = generate(
+        args.out_dir, args.pages, args.dpi, args.seed, args.ext, args.setting
+    )
+    print(json.dumps(paths, indent=1))
+
+
+if __name__ == "__main__":
+    main()
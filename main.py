@@ -1,4 +1,8 @@
+import multiprocessing
+
 from src import main
 
 if __name__ == "__main__":
+    # needed for the worker processes of the PyInstaller onefile build.
+    multiprocessing.freeze_support()
     main.main()
@@ -1,36 +1,213 @@
-import PIL
-from PIL import Image
+"""
+Resize the images in a folder (and its subfolders).
+
+    python resize/resize.py ./data/raw -o ./data/processed -r 0.5 -j 8
+
+The folder tree is mirrored in the output folder, and the outputs which are
+newer than their sources and have the size of the ratio are skipped
+(use --force to resize them again). The files which cannot be decoded are errors.
+Without arguments, the folders and the ratio are asked interactively.
+"""
+
 import os
-import glob
+import sys
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from PIL import Image
 import tqdm
 
+# The results of resize_one.
+DONE = "done"
+SKIPPED = "skipped"
+ERROR = "error"
+# The modes which Image.reduce supports.
+REDUCE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "I", "F")
 
-def read_images(dirname, rate=1):
+
+def list_images(dirname: str, exclude: Optional[str] = None) -> List[str]:
     """
+    The image files in a folder and its subfolders, sorted.
+
     Parameters
     ----------
-    dirname: name of the directory.
+    dirname : str
+        Folder.
+    exclude : str
+        A folder not to search (the output folder in dirname).
     """
-    pathr = os.path.join(dirname, "**")
-    paths = glob.glob(pathr, recursive=True)
-    paths = [p for p in paths if os.path.isfile(p)]
-    for p in tqdm.tqdm(paths):
-        try:
-            img = Image.open(p)
-        except PIL.UnidentifiedImageError:
-            continue
-        dpi = img.info["dpi"]
-        resized = img.resize((int(img.width * rate), int(img.height * rate)))
-        dpi_resized = (int(dpi[0] * rate), int(dpi[1] * rate))
-        yield p, resized, dpi_resized
+    extensions = set(Image.registered_extensions())
+    exclude = os.path.abspath(exclude) if exclude else None
+    paths = []
+    for root, dirs, files in os.walk(dirname):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != exclude]
+        paths.extend(
+            os.path.join(root, f)
+            for f in files
+            if os.path.splitext(f)[1].lower() in extensions
+        )
+    return sorted(paths)
 
 
-def save_image(path, img, dpi):
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    img.save(path, dpi=dpi)
+def output_path(path: str, dirname: str, after_dirname: str) -> str:
+    """
+    The output path of path, relative to after_dirname as path is to dirname.
+    """
+    return os.path.join(after_dirname, os.path.relpath(path, dirname))
 
 
-def main():
+def resized_size(size: Tuple[int, int], rate: float) -> Tuple[int, int]:
+    """
+    The size (width, height) resized by rate.
+    """
+    return max(int(size[0] * rate), 1), max(int(size[1] * rate), 1)
+
+
+def is_up_to_date(path: str, out_path: str, rate: float) -> bool:
+    """
+    Whether out_path exists, is not older than path and is resized by rate.
+    Only the headers of the images are read.
+    """
+    try:
+        if os.stat(out_path).st_mtime < os.stat(path).st_mtime:
+            return False
+        with Image.open(path) as img:
+            size = resized_size(img.size, rate)
+        with Image.open(out_path) as out:
+            return out.size == size
+    except OSError:
+        # including the images which cannot be opened.
+        return False
+
+
+def resize_image(img: Image.Image, rate: float) -> Image.Image:
+    """
+    Resize an image opened by Image.open.
+
+    Note
+    ----------
+    JPEG images are decoded at a reduced size (Image.draft, DCT scaling) first.
+    If 1 / rate is an integer, the image is reduced by box averaging,
+    which is much faster than resampling at the source resolution.
+    """
+    size = resized_size(img.size, rate)
+    if rate >= 1:
+        return img.resize(size)
+    if img.format == "JPEG":
+        # decode at the smallest scale (1/2, 1/4, 1/8) not smaller than size.
+        img.draft(img.mode, size)
+    factor = round(img.width / size[0])
+    if (
+        img.mode in REDUCE_MODES
+        and factor >= 2
+        and size == (img.width // factor, img.height // factor)
+    ):
+        box = (0, 0, size[0] * factor, size[1] * factor)
+        return img.reduce(factor, box=box)
+    if img.mode not in REDUCE_MODES:
+        # e.g. 1-bit and palette images.
+        return img.resize(size)
+    # reducing_gap reduces by an integer factor before resampling.
+    return img.resize(size, Image.BICUBIC, reducing_gap=3.0)
+
+
+def save_image(path: str, img: Image.Image, dpi: Optional[Tuple[int, int]], fmt: str):
+    """
+    Save an image atomically, so that a broken file is not taken as up to date.
+    """
+    dirname, filename = os.path.split(path)
+    os.makedirs(dirname, exist_ok=True)
+    tmp_path = os.path.join(dirname, f".{filename}.{os.getpid()}.tmp")
+    try:
+        if dpi is None:
+            img.save(tmp_path, format=fmt)
+        else:
+            img.save(tmp_path, format=fmt, dpi=dpi)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def resize_one(args: Tuple[str, str, float, bool]) -> Tuple[str, str]:
+    """
+    Resize one image. The errors are returned, not raised.
+
+    Parameters
+    ----------
+    args : (str, str, float, bool)
+        The source path, the output path, the ratio and whether to overwrite
+        the up-to-date output.
+
+    Returns
+    -------
+    (str, str)
+        The source path and DONE | SKIPPED | ERROR (with the message).
+    """
+    path, out_path, rate, force = args
+    if not force and is_up_to_date(path, out_path, rate):
+        return path, SKIPPED
+    try:
+        with Image.open(path) as img:
+            fmt = img.format
+            dpi = img.info.get("dpi")
+            resized = resize_image(img, rate)
+        if dpi is not None:
+            dpi = (int(dpi[0] * rate), int(dpi[1] * rate))
+        save_image(out_path, resized, dpi, fmt)
+    except (OSError, ValueError) as e:
+        # including the files which cannot be decoded (PIL.UnidentifiedImageError).
+        return path, f"{ERROR}: {e}"
+    return path, DONE
+
+
+def resize_images(
+    dirname: str,
+    after_dirname: str,
+    rate: float,
+    workers: int = 1,
+    force: bool = False,
+    chunksize: int = 16,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Resize the images in dirname and save them in after_dirname.
+
+    Parameters
+    ----------
+    dirname : str
+        Source folder.
+    after_dirname : str
+        Output folder. The folder tree of dirname is mirrored.
+    rate : float
+        Ratio of the size.
+    workers : int
+        The number of processes. 1 resizes in this process.
+    force : bool
+        Resize the images even if the outputs are up to date.
+    chunksize : int
+        The number of images sent to a process at once.
+
+    Yields
+    -------
+    (str, str)
+        The results of resize_one in the order of the paths.
+    """
+    paths = list_images(dirname, exclude=after_dirname)
+    tasks = [(p, output_path(p, dirname, after_dirname), rate, force) for p in paths]
+    if workers <= 1:
+        yield from tqdm.tqdm(map(resize_one, tasks), total=len(tasks))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(resize_one, tasks, chunksize=chunksize)
+        yield from tqdm.tqdm(results, total=len(tasks))
+
+
+def ask_args() -> Tuple[str, str, float]:
+    """
+    Ask the folders and the ratio interactively.
+    """
     while True:
         dirname = input("対象のフォルダ名を相対パスで指定してください。\n例 ./data/raw\n: ")
         if dirname:
@@ -54,11 +231,55 @@ def main():
                 break
             except:
                 print("比率は小数で入力してください。")
+    return dirname, after_dirname, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Resize the images in a folder. Asked interactively without dirname."
+    )
+    parser.add_argument("dirname", nargs="?", help="Source folder.")
+    parser.add_argument(
+        "-o", "--out", default=None, help="Output folder (default: dirname_resized)."
+    )
+    parser.add_argument("-r", "--rate", type=float, default=0.5, help="Ratio.")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="The number of processes (default: the number of CPUs).",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Resize the up-to-date outputs again."
+    )
+    parser.add_argument("--chunksize", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.dirname is None:
+        dirname, after_dirname, rate = ask_args()
+    else:
+        dirname = args.dirname.rstrip("/").rstrip("\\")
+        after_dirname = (args.out or dirname + "_resized").rstrip("/").rstrip("\\")
+        rate = args.rate
+    if rate <= 0:
+        parser.error("The ratio must be positive.")
 
-    for p, img, dpi in read_images(dirname, rate):
-        q = p.replace(dirname, after_dirname)
-        save_image(q, img, dpi)
+    counts = {DONE: 0, SKIPPED: 0, ERROR: 0}
+    for p, result in resize_images(
+        dirname, after_dirname, rate, args.workers, args.force, args.chunksize
+    ):
+        if result.startswith(ERROR):
+            print(f"{p}: {result}", file=sys.stderr)
+            counts[ERROR] += 1
+        else:
+            counts[result] += 1
+    print(f"{counts[DONE]} resized, {counts[SKIPPED]} skipped, {counts[ERROR]} errors.")
+    if counts[ERROR]:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
+    # needed for the worker processes of the PyInstaller onefile build.
+    multiprocessing.freeze_support()
     main()
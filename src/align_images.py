@@ -1,12 +1,19 @@
 import numpy as np
 import cv2
+import json
 import logging
-from typing import Tuple
+from typing import Optional, Tuple
 
 from .errors import MarkerNotFoundError, NotFittedError
+from .imgproc import gaussian_kernel_radius
+from .metrics import NULL_TIMER
 
 logger = logging.getLogger("adjust-scan-images")
 
+# (cx, cy), area, (x, y, w, h) of a blob in a binary image.
+Blob = Tuple[Tuple[float, float], float, Tuple[int, int, int, int]]
+MARKER_BACKENDS = ("contour", "components")
+
 
 class ImageAligner:
     """
@@ -20,8 +27,33 @@ class ImageAligner:
     topleft == (x, y, width, height).
     metadata['marker_gaussian_ksize'] == int.
     metadata['marker_gaussian_std'] == int.
+    metadata['marker_search_scale'] == int (optional, default == 1).
+    metadata['marker_backend'] == 'contour' | 'components' (default == 'contour').
+
+    Only the four marker ranges are blurred and binarized.
+    Each range is padded by the Gaussian kernel radius,
+    so the result is the same as preprocessing the whole image.
+
+    With marker_search_scale > 1, the markers are searched coarse to fine.
+    The dark pixels of the range are found in the range downsampled by
+    marker_search_scale, and only the windows around them are preprocessed at
+    full resolution, largest first, until no other window can have a larger
+    blob. The marker is the same as the full resolution search, or the range is
+    searched at full resolution. 0 chooses the scale from the range size
+    (up to MAX_SEARCH_SCALE), and 1 (default) searches at full resolution only.
+
+    The 'contour' backend takes the contour of the maximum area and its moments.
+    The 'components' backend takes the connected component of the maximum
+    pixel count and its centroid from one cv2.connectedComponentsWithStats call,
+    which does not slow down with many small blobs (noise, staples, handwriting).
     """
 
+    # the shorter side of a downsampled range is at least this (auto scale).
+    MIN_COARSE_SIZE = 32
+    MAX_SEARCH_SCALE = 8
+    # fall back to the full resolution search after this many windows.
+    MAX_REFINE_WINDOWS = 4
+
     def __init__(self, metadata: dict):
         """
         Image aligner constractor.
@@ -38,8 +70,16 @@ class ImageAligner:
         assert (
             len(self.marker_ranges) == 4
         ), "metadata['marker_ranges'] does not satisfy the precise format."
+        self.pad = gaussian_kernel_radius(self.g_ksize, self.g_std)
+        self.search_scale = int(self.metadata.get("marker_search_scale", 1))
+        self.backend: str = self.metadata.get("marker_backend", "contour")
+        assert (
+            self.backend in MARKER_BACKENDS
+        ), f"Unknown marker_backend {self.backend}."
         self.base_markers = None
         self.is_fitted = False
+        # set a StageTimer to measure the stages.
+        self.timer = NULL_TIMER
 
     def _preprocess(self, img: np.ndarray) -> np.ndarray:
         """
@@ -56,55 +96,239 @@ class ImageAligner:
         """
         # Gaussian filter
         blur = cv2.GaussianBlur(img, (self.g_ksize, self.g_ksize), self.g_std)
-        # binary image
-        _, binary = cv2.threshold(blur, 127, 255, cv2.THRESH_BINARY_INV)
+        # binary image (in place of blur)
+        _, binary = cv2.threshold(blur, 127, 255, cv2.THRESH_BINARY_INV, dst=blur)
         logger.debug("ImageAliger: Preprocess ended.")
         return binary
 
-    def __find_one_marker(
-        self, binary_img: np.ndarray
-    ) -> Tuple[Tuple[float, float], float]:
+    @staticmethod
+    def __largest_contour(binary_img: np.ndarray) -> Optional[Blob]:
         """
-        Find single marker.
-
-        Parameters
-        ----------
-        binary_img : np.ndarray
-            binary image.
-
-        Returns
-        -------
-        (cx, cy), max_area
-            marker information.
+        The blob of the maximum contour area.
         """
         # find contours
         contours, _ = cv2.findContours(
             binary_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
         )
         if not contours:
-            return (0, 0), 0
+            return None
         areas = [cv2.contourArea(cnt) for cnt in contours]
         # choose maximum area
         max_idx = np.argmax(areas)
         max_cnt = contours[max_idx]
         max_area = areas[max_idx]
+        rect = cv2.boundingRect(max_cnt)
         # calculate center of gravity
         M = cv2.moments(max_cnt)
         try:
             cx = M["m10"] / M["m00"]
             cy = M["m01"] / M["m00"]
-            return (cx, cy), max_area
+            return (cx, cy), max_area, rect
         except ZeroDivisionError:
+            return (0, 0), 0, rect
+
+    @staticmethod
+    def __largest_component(binary_img: np.ndarray) -> Optional[Blob]:
+        """
+        The blob of the maximum pixel count.
+        All the areas, boxes and centroids are computed in one call.
+        """
+        n, _, stats, centroids = cv2.connectedComponentsWithStats(
+            binary_img, connectivity=8
+        )
+        if n <= 1:
+            return None
+        # label 0 is the background.
+        max_idx = int(np.argmax(stats[1:, cv2.CC_STAT_AREA])) + 1
+        x, y, w, h, area = stats[max_idx].tolist()
+        cx, cy = centroids[max_idx].tolist()
+        return (cx, cy), float(area), (x, y, w, h)
+
+    def __largest_blob(self, binary_img: np.ndarray) -> Optional[Blob]:
+        """
+        The largest blob with the backend.
+
+        Returns
+        -------
+        (cx, cy), area, (x, y, w, h) | None
+            The centroid, the area and the bounding box, or None if there is no blob.
+        """
+        if self.backend == "components":
+            return self.__largest_component(binary_img)
+        return self.__largest_contour(binary_img)
+
+    def __find_one_marker(
+        self, binary_img: np.ndarray
+    ) -> Tuple[Tuple[float, float], float]:
+        """
+        Find single marker.
+
+        Parameters
+        ----------
+        binary_img : np.ndarray
+            binary image.
+
+        Returns
+        -------
+        (cx, cy), max_area
+            marker information.
+        """
+        blob = self.__largest_blob(binary_img)
+        if blob is None:
             return (0, 0), 0
+        return blob[:2]
+
+    def _preprocess_window(
+        self, img: np.ndarray, x1: int, y1: int, x2: int, y2: int
+    ) -> np.ndarray:
+        """
+        Preprocess only the window img[y1:y2, x1:x2].
+
+        Parameters
+        ----------
+        img : np.ndarray
+            An image.
+        x1, y1, x2, y2 : int
+            The top-left and the bottom-right coords of the window.
+
+        Returns
+        -------
+        binary : np.ndarray
+            Binary image of the window.
+        """
+        ih, iw = img.shape
+        # pad with the kernel radius, then the blur inside the window is exact.
+        px1, py1 = max(x1 - self.pad, 0), max(y1 - self.pad, 0)
+        px2, py2 = min(x2 + self.pad, iw), min(y2 + self.pad, ih)
+        with self.timer.stage("marker_preprocess"):
+            binary = self._preprocess(img[py1:py2, px1:px2])
+        return binary[y1 - py1 : y2 - py1, x1 - px1 : x2 - px1]
+
+    def _scale_of(self, w: int, h: int) -> int:
+        """
+        The downsampling scale of a marker range of w x h.
+        """
+        if self.search_scale:
+            # too small to downsample
+            if min(w, h) < self.search_scale * 4:
+                return 1
+            return self.search_scale
+        return max(1, min(min(w, h) // self.MIN_COARSE_SIZE, self.MAX_SEARCH_SCALE))
+
+    def _coarse_components(
+        self, img: np.ndarray, x1: int, y1: int, x2: int, y2: int, scale: int
+    ) -> Tuple[np.ndarray, np.ndarray, int, int]:
+        """
+        The connected components of the coarse ink map of the window.
+
+        A coarse pixel is ink if some pixel of its scale x scale block is dark
+        (<= 127), dilated by the Gaussian kernel radius. A blurred pixel can be
+        dark only near a dark pixel, so every blob of the full resolution
+        binary image is inside one component.
+
+        Returns
+        -------
+        labels, stats, ox, oy
+            The results of cv2.connectedComponentsWithStats
+            and the full resolution coords of the coarse pixel (0, 0).
+        """
+        ih, iw = img.shape
+        r = -(-self.pad // scale)
+        ox, oy = max(x1 - r * scale, 0), max(y1 - r * scale, 0)
+        ex2, ey2 = min(x2 + r * scale, iw), min(y2 + r * scale, ih)
+        cw, ch = -(-(ex2 - ox) // scale), -(-(ey2 - oy) // scale)
+        block = np.full((ch * scale, cw * scale), 255, dtype=img.dtype)
+        block[: ey2 - oy, : ex2 - ox] = img[oy:ey2, ox:ex2]
+        # the minimum of each block (erode, then take the top-left pixels).
+        kernel = np.ones((scale, scale), np.uint8)
+        coarse = cv2.erode(block, kernel, anchor=(0, 0))[::scale, ::scale]
+        ink = np.where(coarse <= 127, np.uint8(255), np.uint8(0))
+        ink = cv2.dilate(ink, np.ones((2 * r + 1, 2 * r + 1), np.uint8))
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+        return labels, stats, ox, oy
+
+    def _find_one_marker_pyramid(
+        self, img: np.ndarray, x1: int, y1: int, x2: int, y2: int, scale: int
+    ) -> Optional[Tuple[Tuple[float, float], float]]:
+        """
+        Find single marker in the window coarse to fine.
 
-    def _find_markers(self, binary_img: np.ndarray) -> np.ndarray:
+        Parameters
+        ----------
+        img : np.ndarray
+            An image.
+        x1, y1, x2, y2 : int
+            The top-left and the bottom-right coords of the window.
+        scale : int
+            The downsampling scale (> 1).
+
+        Returns
+        -------
+        (cx, cy), max_area
+            marker information in the window coords,
+            or None if the full resolution search is needed.
+
+        Note
+        ----------
+        The components of the coarse ink map are searched at full resolution
+        in the descending order of their bounding box areas, each masked to its
+        component, until the area of the largest blob found is larger than
+        the bounding boxes of the rest. No blob can be larger than its box,
+        so the blob is the largest blob of the full resolution search.
+        None on a tie of the areas, or after MAX_REFINE_WINDOWS windows.
+        """
+        with self.timer.stage("marker_coarse"):
+            labels, stats, ox, oy = self._coarse_components(img, x1, y1, x2, y2, scale)
+            windows = []
+            for label in range(1, len(stats)):
+                bx, by, bw, bh = stats[label, :4].tolist()
+                wx1, wy1 = max(ox + bx * scale, x1), max(oy + by * scale, y1)
+                wx2 = min(ox + (bx + bw) * scale, x2)
+                wy2 = min(oy + (by + bh) * scale, y2)
+                if wx1 < wx2 and wy1 < wy2:
+                    windows.append(
+                        ((wx2 - wx1) * (wy2 - wy1), label, wx1, wy1, wx2, wy2)
+                    )
+            windows.sort(reverse=True)
+
+        best = None
+        for i, (bound, label, wx1, wy1, wx2, wy2) in enumerate(windows):
+            if best is not None and bound < best[1]:
+                break
+            if i >= self.MAX_REFINE_WINDOWS:
+                return None
+            binary = self._preprocess_window(img, wx1, wy1, wx2, wy2)
+            with self.timer.stage("marker_search"):
+                # only the pixels of this component.
+                mask = labels[
+                    (wy1 - oy) // scale : -(-(wy2 - oy) // scale),
+                    (wx1 - ox) // scale : -(-(wx2 - ox) // scale),
+                ]
+                mask = np.repeat(np.repeat(mask == label, scale, 0), scale, 1)
+                mx, my = (wx1 - ox) % scale, (wy1 - oy) % scale
+                mask = mask[my : my + wy2 - wy1, mx : mx + wx2 - wx1]
+                binary[~mask] = 0
+                blob = self.__largest_blob(binary)
+            if blob is None:
+                continue
+            (cx, cy), area = blob[:2]
+            if best is not None and area == best[1]:
+                # the full resolution search decides the tie.
+                return None
+            if best is None or area > best[1]:
+                best = (cx + wx1 - x1, cy + wy1 - y1), area
+        if best is None or not best[1]:
+            return None
+        return best
+
+    def _find_markers(self, img: np.ndarray) -> np.ndarray:
         """
         Find markers.
 
         Parameters
         ----------
-        binary_img : np.ndarray
-            A binary image.
+        img : np.ndarray
+            A grayscale image. Only the marker ranges are preprocessed.
 
         Returns
         -------
@@ -113,7 +337,7 @@ class ImageAligner:
         """
         markers = []
         marker_areas = []
-        bh, bw = binary_img.shape
+        bh, bw = img.shape
         for x, y, w, h in self.marker_ranges:
             # If x or y is negative, change positive.
             if x < 0:
@@ -121,8 +345,16 @@ class ImageAligner:
             if y < 0:
                 y += bh
 
-            edge = binary_img[y : min(y + h, bh), x : min(x + w, bw)]
-            (cx, cy), area = self.__find_one_marker(edge)
+            x2, y2 = min(x + w, bw), min(y + h, bh)
+            scale = self._scale_of(x2 - x, y2 - y)
+            found = None
+            if scale > 1:
+                found = self._find_one_marker_pyramid(img, x, y, x2, y2, scale)
+            if found is None:
+                edge = self._preprocess_window(img, x, y, x2, y2)
+                with self.timer.stage("marker_search"):
+                    found = self.__find_one_marker(edge)
+            (cx, cy), area = found
             cx += x
             cy += y
             markers.append((cx, cy))
@@ -142,11 +374,10 @@ class ImageAligner:
         markers = markers[m_idxs]
         return markers
 
-    def _align_image(
-        self, base_markers: list, img_markers: list, img: np.ndarray
-    ) -> np.ndarray:
+    @staticmethod
+    def _affine_matrix(base_markers: list, img_markers: list) -> np.ndarray:
         """
-        Aline images.
+        Affine transform matrix.
 
         Parameters
         ----------
@@ -156,21 +387,40 @@ class ImageAligner:
         img_markers : list = [int, int, int]
             Coordinate of markers of base images.
 
+        Returns
+        -------
+        np.ndarray
+            2x3 affine matrix from the image to the base image.
+        """
+        logger.debug(f"Begin Affine transform:{img_markers} -> {base_markers}")
+        return cv2.getAffineTransform(np.float32(img_markers), np.float32(base_markers))
+
+    def warp(
+        self, img: np.ndarray, M: np.ndarray, dst: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Aline images.
+
+        Parameters
+        ----------
         img : np.ndarray
             An image.
+        M : np.ndarray
+            2x3 affine matrix from estimate().
+        dst : np.ndarray | None, optional
+            The output array of the same shape and dtype as img, by default None.
+            If None, a new array is allocated.
 
         Returns
         -------
         np.ndarray
-            An aligned image.
+            An aligned image (dst if given).
         """
         h, w = img.shape
-        # get Affine transform matrix
-        logger.debug(f"Begin Affine transform:{img_markers} -> {base_markers}")
-        M = cv2.getAffineTransform(np.float32(img_markers), np.float32(base_markers))
         # Affine transform
         # 255 is white.
-        new_img = cv2.warpAffine(img, M, (w, h), borderValue=255)
+        with self.timer.stage("warp"):
+            new_img = cv2.warpAffine(img, M, (w, h), dst=dst, borderValue=255)
         return new_img
 
     def fit(self, img: np.ndarray):
@@ -186,8 +436,7 @@ class ImageAligner:
         ------
         MarkerNotFoundError
         """
-        binary = self._preprocess(img)
-        self.base_markers = self._find_markers(binary)
+        self.base_markers = self._find_markers(img)
         if self.base_markers is False:
             raise MarkerNotFoundError("We cannot find the markers in the base image.")
         self.is_fitted = True
@@ -195,9 +444,9 @@ class ImageAligner:
             f"ImageAligner: Fit is completed, base_markers: {self.base_markers}"
         )
 
-    def transform_one(self, img: np.ndarray) -> np.ndarray:
+    def estimate(self, img: np.ndarray) -> np.ndarray:
         """
-        Transform one image.
+        Estimate the affine matrix of one image without warping it.
 
         Parameters
         ----------
@@ -207,7 +456,7 @@ class ImageAligner:
         Returns
         -------
         np.ndarray
-            An aligned image.
+            2x3 affine matrix from the image to the base image.
 
         Raises
         ------
@@ -216,9 +465,107 @@ class ImageAligner:
         if not self.is_fitted:
             raise NotFittedError("Fit before trasform.")
 
-        binary = self._preprocess(img)
-        markers = self._find_markers(binary)
+        markers = self._find_markers(img)
         if markers is False:
             raise MarkerNotFoundError("We cannot find the markers in the image.")
-        new_img = self._align_image(self.base_markers, markers, img)
-        return new_img
+        return self._affine_matrix(self.base_markers, markers)
+
+    def transform_one(self, img: np.ndarray) -> np.ndarray:
+        """
+        Transform one image.
+
+        Parameters
+        ----------
+        img : np.ndarray
+            One image.
+
+        Returns
+        -------
+        np.ndarray
+            An aligned image.
+
+        Raises
+        ------
+        MarkerNotFoundError
+        """
+        M = self.estimate(img)
+        return self.warp(img, M)
+
+    def _params(self) -> dict:
+        """
+        The effective parameters that the fitted state depends on.
+        """
+        return {
+            "marker_gaussian_ksize": self.g_ksize,
+            "marker_gaussian_std": self.g_std,
+            "marker_range": [list(r) for r in self.marker_ranges],
+            "marker_backend": self.backend,
+        }
+
+    def get_state(self) -> dict:
+        """
+        The fitted state as json serializable data.
+
+        Returns
+        -------
+        dict
+            {"params": effective parameters, "base_markers": markers or None}.
+        """
+        return {
+            "params": self._params(),
+            "base_markers": self.base_markers.tolist() if self.is_fitted else None,
+        }
+
+    def set_state(self, state: dict):
+        """
+        Restore the fitted state from get_state().
+
+        Parameters
+        ----------
+        state : dict
+            The result of get_state().
+
+        Raises
+        ------
+        ValueError
+            If the state was fitted with other parameters.
+        """
+        if state["params"] != json.loads(json.dumps(self._params())):
+            raise ValueError("ImageAligner: The state has other parameters.")
+        if state["base_markers"] is None:
+            self.base_markers = None
+            self.is_fitted = False
+            return
+        self.base_markers = np.array(state["base_markers"], dtype=np.float64)
+        assert self.base_markers.shape == (3, 2), "Invalid base_markers."
+        self.is_fitted = True
+        logger.debug(f"ImageAligner: State loaded, base_markers: {self.base_markers}")
+
+    def save(self, path: str):
+        """
+        Save the fitted state as json.
+
+        Parameters
+        ----------
+        path : str
+            File path.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.get_state(), f)
+
+    def load(self, path: str):
+        """
+        Load the fitted state saved by save().
+
+        Parameters
+        ----------
+        path : str
+            File path.
+
+        Raises
+        ------
+        ValueError
+            If the state was fitted with other parameters.
+        """
+        with open(path, encoding="utf-8") as f:
+            self.set_state(json.load(f))
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import logging
+from typing import List, Optional
+
+from .image_io import list_images
+from .pipeline import PipelineRun
+from .read_args import find_baseimg
+from .log_setting import add_file_log
+
+logger = logging.getLogger("adjust-scan-images")
+
+
+def make_job(
+    img_dir: str,
+    setting: Optional[str] = "setting.xlsx",
+    save_dir: Optional[str] = None,
+    base: Optional[str] = None,
+) -> dict:
+    """
+    Make a job with the same defaults as the interactive mode.
+
+    Parameters
+    ----------
+    img_dir : str
+        The directory of the images.
+    setting : str | None, optional
+        The setting file, by default "setting.xlsx".
+    save_dir : str | None, optional
+        The save directory, by default img_dir + "_processed".
+    base : str | None, optional
+        The base image, by default the first image of img_dir.
+
+    Returns
+    -------
+    dict
+        {"img_dir", "setting", "save_dir", "base"}.
+
+    Raises
+    ------
+    FileNotFoundError
+        If a path does not exist.
+    """
+    if not os.path.isdir(img_dir):
+        raise FileNotFoundError(f"The folder {img_dir} does not exist.")
+    if setting and not os.path.exists(setting):
+        raise FileNotFoundError(f"The setting file {setting} does not exist.")
+    if not save_dir:
+        save_dir = img_dir.rstrip("/\\") + "_processed"
+    if not base:
+        base = find_baseimg(img_dir)
+        if base is None:
+            raise FileNotFoundError(f"There are no images in {img_dir}.")
+    elif not os.path.exists(base):
+        raise FileNotFoundError(f"The base image {base} does not exist.")
+    return {"img_dir": img_dir, "setting": setting, "save_dir": save_dir, "base": base}
+
+
+def load_jobs(path: str) -> List[dict]:
+    """
+    Load a job file.
+
+    Note
+    ----------
+    The job file is json: a list of jobs, or {"jobs": [...]}.
+    A job is {"img_dir": str, "setting": str, "save_dir": str, "base": str},
+    and only "img_dir" is required. See make_job for the defaults.
+    The relative paths are relative to the current directory.
+    The jobs are checked by run_jobs, so an invalid job does not stop the others.
+
+    Parameters
+    ----------
+    path : str
+        The job file.
+
+    Returns
+    -------
+    List[dict]
+        Jobs as written in the file.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["jobs"]
+    jobs = list(data)
+    logger.info(f"{len(jobs)} jobs loaded from {path}.")
+    return jobs
+
+
+def run_jobs(
+    jobs: List[dict],
+    file_log: int = logging.WARN,
+    report_path: Optional[str] = None,
+    **run_kargs,
+) -> dict:
+    """
+    Run the jobs one by one in this process.
+
+    The compiled settings and the fitted models are shared
+    by the jobs with the same setting file and base image.
+    A failed job is logged and the next job is run.
+    An invalid job (see make_job) is logged and reported as "invalid".
+
+    Parameters
+    ----------
+    jobs : List[dict]
+        Jobs. The arguments of make_job.
+    file_log : int, optional
+        The level of the log file of each job, by default logging.WARN.
+    report_path : str | None, optional
+        If given, the report is saved as json, by default None.
+    run_kargs
+        workers, prefetch, save_workers, save_metrics, cache_dir and resume.
+        See pipeline().
+
+    Returns
+    -------
+    dict
+        The throughput report {"jobs": [...], "total": {...}}.
+    """
+    results = []
+    start = time.perf_counter()
+    for i, job in enumerate(jobs, start=1):
+        try:
+            job = make_job(**job)
+        except (TypeError, FileNotFoundError) as e:
+            logger.error(f"Job {i}/{len(jobs)} is invalid and skipped: {job}: {e}")
+            img_dir = job.get("img_dir") if isinstance(job, dict) else None
+            results.append(
+                {
+                    "img_dir": str(img_dir),
+                    "status": "invalid",
+                    "images": 0,
+                    "errors": 0,
+                    "skipped": 0,
+                    "seconds": 0.0,
+                    "images_per_s": 0.0,
+                }
+            )
+            continue
+        logger.info(f"Job {i}/{len(jobs)}: {job}")
+        handler = add_file_log(job["save_dir"], file_log)
+        job_start = time.perf_counter()
+        result = dict(job, status="ok", images=0, errors=0, skipped=0)
+        try:
+            with PipelineRun(
+                job["setting"], job["save_dir"], job["base"], **run_kargs
+            ) as run:
+                paths = tuple(
+                    p for p in list_images(job["img_dir"]) if not run.is_done(p)
+                )
+                result["images"] = run.process(paths)
+            result["errors"] = len(run.error_paths)
+            result["skipped"] = len(run.skipped_paths)
+        except Exception:
+            logger.exception(f"Job {i}/{len(jobs)} failed: {job}")
+            result["status"] = "failed"
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        result["seconds"] = time.perf_counter() - job_start
+        result["images_per_s"] = result["images"] / result["seconds"]
+        results.append(result)
+
+    seconds = time.perf_counter() - start
+    images = sum(r["images"] for r in results)
+    report = {
+        "jobs": results,
+        "total": {
+            "jobs": len(results),
+            "failed": sum(r["status"] != "ok" for r in results),
+            "images": images,
+            "errors": sum(r["errors"] for r in results),
+            "skipped": sum(r["skipped"] for r in results),
+            "seconds": seconds,
+            "images_per_s": images / seconds if seconds else 0,
+        },
+    }
+    summary = "\n".join(
+        f"{r['status']:>6} {r['images']:>6} images {r['errors']:>4} errors "
+        f"{r['seconds']:>8.1f} s {r['images_per_s']:>7.2f} images/s  {r['img_dir']}"
+        for r in results
+    )
+    total = report["total"]
+    logger.info(
+        f"JOBS FINISHED: {total['jobs']} jobs ({total['failed']} failed), "
+        f"{images} images in {seconds:.1f} s, {total['images_per_s']:.2f} images/s.\n"
+        f"{summary}"
+    )
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+        logger.info(f"Report saved at {report_path}")
+    return report
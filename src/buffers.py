@@ -0,0 +1,96 @@
+import threading
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("adjust-scan-images")
+
+
+class BufferPool:
+    """
+    Pool of reusable arrays for the pages of the same size.
+
+    Note
+    ----------
+    get() returns a free array of the shape, or allocates a new one.
+    Only the arrays from get() are taken back by release(), so any array
+    can be passed to release(). The contents of the arrays are not initialized.
+    At most max_free arrays of each shape are kept.
+    This is thread-safe. A pickled pool is a new empty pool
+    (e.g. in a worker process).
+    """
+
+    def __init__(self, max_free: int = 4):
+        """
+        Parameters
+        ----------
+        max_free : int, optional
+            The maximum number of free arrays of each shape, by default 4.
+        """
+        self.max_free = max_free
+        self._free: Dict[Tuple[tuple, str], List[np.ndarray]] = defaultdict(list)
+        # id -> array handed out by get(). The reference keeps the id unique.
+        self._lent: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def get(self, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        """
+        An array of shape and dtype.
+
+        Parameters
+        ----------
+        shape : tuple
+            Shape.
+        dtype : optional
+            dtype, by default np.uint8.
+
+        Returns
+        -------
+        np.ndarray
+            Not initialized.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free[key]
+            if free:
+                arr = free.pop()
+                self.reused += 1
+            else:
+                arr = np.empty(shape, dtype=dtype)
+                self.allocated += 1
+            self._lent[id(arr)] = arr
+        return arr
+
+    def release(self, arr: Optional[np.ndarray]):
+        """
+        Give back an array from get(). The other arrays are ignored.
+
+        Parameters
+        ----------
+        arr : np.ndarray | None
+            The array. Do not use it after this.
+        """
+        if arr is None:
+            return
+        with self._lock:
+            if self._lent.pop(id(arr), None) is None:
+                return
+            free = self._free[(arr.shape, arr.dtype.str)]
+            if len(free) < self.max_free:
+                free.append(arr)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        The numbers of the allocated and reused arrays.
+        """
+        return {"buffers_allocated": self.allocated, "buffers_reused": self.reused}
+
+    def __getstate__(self):
+        return {"max_free": self.max_free}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_free"])
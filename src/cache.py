@@ -0,0 +1,71 @@
+import os
+import json
+import logging
+from typing import Optional
+
+logger = logging.getLogger("adjust-scan-images")
+
+CACHE_DIR_ENV = "ADJUST_SCAN_IMAGES_CACHE"
+
+
+def default_cache_dir() -> str:
+    """
+    The default cache directory.
+
+    Returns
+    -------
+    str
+        $ADJUST_SCAN_IMAGES_CACHE or ~/.cache/adjust-scan-images.
+    """
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(
+        os.path.expanduser("~"), ".cache", "adjust-scan-images"
+    )
+
+
+def read_json_cache(path: str) -> Optional[dict]:
+    """
+    Read a cache file.
+
+    Parameters
+    ----------
+    path : str
+        File path.
+
+    Returns
+    -------
+    dict | None
+        None if the file does not exist or is broken.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Cache {path} is broken (ignored): {e}")
+        return None
+
+
+def write_json_cache(path: str, data: dict):
+    """
+    Write a cache file atomically.
+    Errors are logged and ignored.
+
+    Parameters
+    ----------
+    path : str
+        File path.
+    data : dict
+        Json data.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        # The cache is only an optimization. Not cached if not json serializable.
+        logger.warning(f"Cannot write cache {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,117 @@
+import math
+import numpy as np
+import cv2
+import logging
+from typing import Optional, Tuple
+
+from .metrics import NULL_TIMER
+
+logger = logging.getLogger("adjust-scan-images")
+
+# The classes of a page. Only "form" pages are aligned and read.
+FORM = "form"
+BLANK = "blank"
+NOT_FORM = "not_form"
+BLANK_PAGE_ACTIONS = ("none", "skip", "pass")
+
+
+class PageClassifier:
+    """
+    Classify a page as a form, a blank page or another page before alignment.
+
+    Note
+    ----------
+    metadata['blank_page_action'] == 'none' | 'skip' | 'pass' (default == 'none').
+    metadata['blank_ink_ratio'] == float (default == 0.002).
+    metadata['form_ink_ratio'] == float (default == 0.05).
+
+    The page is downsampled by box averaging to about VIEW_SIZE px, and a pixel
+    is ink if it is darker than the paper (the median) by INK_DELTA.
+    The page is blank if the ratio of ink is less than blank_ink_ratio,
+    except the margin of BORDER_RATIO (scanner shadows).
+    If the page is aligned, the page is not a form if less than 3 marker ranges
+    have the ratio of ink form_ink_ratio, since the markers cannot be found.
+    With 'skip', the blank and not form pages are not saved, and with 'pass',
+    they are saved as they are. Neither are aligned nor read.
+    """
+
+    VIEW_SIZE = 256
+    INK_DELTA = 24
+    BORDER_RATIO = 0.03
+
+    def __init__(self, metadata: dict):
+        """
+        Parameters
+        ----------
+        metadata : dict
+            Image metadata. See Note.
+        """
+        self.action: str = metadata.get("blank_page_action", "none")
+        self.blank_ink_ratio = float(metadata.get("blank_ink_ratio", 0.002))
+        self.form_ink_ratio = float(metadata.get("form_ink_ratio", 0.05))
+        self.marker_ranges: Optional[tuple] = None
+        if metadata["is_align"]:
+            self.marker_ranges = metadata["marker_range"]
+        # set a StageTimer to measure the stages.
+        self.timer = NULL_TIMER
+
+    def _view(self, img: np.ndarray) -> Tuple[np.ndarray, float]:
+        """
+        The downsampled page and its scale.
+        """
+        h, w = img.shape
+        # box averaging by an integer factor is much faster.
+        factor = max(math.ceil(max(h, w) / self.VIEW_SIZE), 1)
+        vh, vw = max(h // factor, 1), max(w // factor, 1)
+        view = cv2.resize(
+            img[: vh * factor, : vw * factor], (vw, vh), interpolation=cv2.INTER_AREA
+        )
+        return view, 1 / factor
+
+    def _ink_in_ranges(self, ink: np.ndarray, scale: float) -> np.ndarray:
+        """
+        The ratios of ink in the marker ranges.
+        """
+        vh, vw = ink.shape
+        ratios = []
+        for x, y, w, h in self.marker_ranges:
+            x, y, w, h = [int(z * scale) for z in (x, y, w, h)]
+            # If x or y is negative, change positive.
+            if x < 0:
+                x += vw
+            if y < 0:
+                y += vh
+            window = ink[max(y, 0) : y + max(h, 1), max(x, 0) : x + max(w, 1)]
+            ratios.append(window.mean() if window.size else 0)
+        return np.array(ratios)
+
+    def classify(self, img: np.ndarray) -> str:
+        """
+        Classify one page.
+
+        Parameters
+        ----------
+        img : np.ndarray
+            A grayscale image.
+
+        Returns
+        -------
+        str
+            FORM | BLANK | NOT_FORM.
+        """
+        with self.timer.stage("classify"):
+            view, scale = self._view(img)
+            paper = int(np.median(view))
+            ink = view < paper - self.INK_DELTA
+            vh, vw = ink.shape
+            by, bx = int(vh * self.BORDER_RATIO), int(vw * self.BORDER_RATIO)
+            ink_ratio = ink[by : vh - by, bx : vw - bx].mean()
+            if ink_ratio < self.blank_ink_ratio:
+                logger.debug(f"PageClassifier: blank, ink {ink_ratio:.4f}")
+                return BLANK
+            if self.marker_ranges is not None:
+                ratios = self._ink_in_ranges(ink, scale)
+                if np.count_nonzero(ratios >= self.form_ink_ratio) < 3:
+                    logger.debug(f"PageClassifier: not form, markers ink {ratios}")
+                    return NOT_FORM
+        return FORM
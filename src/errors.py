@@ -12,3 +12,11 @@ class NotFittedError(Exception):
     """
 
     pass
+
+
+class SettingError(Exception):
+    """
+    An error that raises when the setting is invalid.
+    """
+
+    pass
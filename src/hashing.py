@@ -0,0 +1,41 @@
+import hashlib
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of the content of a file.
+
+    Parameters
+    ----------
+    path : str
+        File path.
+    chunk_size : int, optional
+        Read size, by default 1 MiB.
+
+    Returns
+    -------
+    str
+        Hex digest.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def data_hash(*data) -> str:
+    """
+    SHA-256 of the repr of python data such as settings dicts.
+
+    Parameters
+    ----------
+    data
+        Data whose repr is deterministic.
+
+    Returns
+    -------
+    str
+        Hex digest.
+    """
+    return hashlib.sha256(repr(data).encode("utf-8")).hexdigest()
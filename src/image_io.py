@@ -2,12 +2,195 @@ import numpy as np
 import PIL
 from PIL import Image
 import os
+import re
 import glob
-from typing import Union, Tuple, Iterator, Optional
+import time
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from functools import partial
+from typing import (
+    Union,
+    Tuple,
+    Iterator,
+    Optional,
+    Set,
+    Callable,
+    Sequence,
+    Dict,
+    List,
+)
 import logging
 
+from .parallel import ordered_imap
+from .metrics import PipelineMetrics
+from .buffers import BufferPool
+from .output_format import OutputFormat, OutputVariant
+from .pages import MULTIPAGE_EXT, page_path, split_page, is_pdf
+
 logger = logging.getLogger("adjust-scan-images")
 
+# PDF pages are rendered at this dpi (before resizing).
+PDF_DPI = 300
+# (file name, the temporary paths of the image and its variants)
+# of ImageSaver.write_temp.
+TempFiles = Tuple[str, Tuple[str, ...]]
+# The hidden temporary files of ImageSaver: .{name}.{pid}.{count}.tmp{ext}
+TEMP_FILE_PATTERN = re.compile(r"^\..+\.\d+\.\d+\.tmp(\.[^.]*)?$")
+
+_pdf_warned = False
+
+
+def _import_fitz():
+    """
+    Import PyMuPDF (fitz), which is needed only for PDF input.
+
+    Returns
+    -------
+    module or None
+        None if not installed. The warning is logged once.
+    """
+    global _pdf_warned
+    try:
+        import fitz
+
+        return fitz
+    except ImportError:
+        if not _pdf_warned:
+            logger.warning("PyMuPDF is not installed, so the PDF files are skipped.")
+            _pdf_warned = True
+        return None
+
+
+def count_pages(path: str) -> int:
+    """
+    The number of the pages of a file without decoding them.
+
+    Parameters
+    ----------
+    path : str
+        File path.
+
+    Returns
+    -------
+    int
+        1 for single-page images. 0 if the file cannot be read.
+    """
+    if is_pdf(path):
+        fitz = _import_fitz()
+        if fitz is None:
+            return 0
+        with fitz.open(path) as doc:
+            return doc.page_count
+    try:
+        with Image.open(path) as pilimg:
+            return getattr(pilimg, "n_frames", 1)
+    except PIL.UnidentifiedImageError:
+        return 0
+
+
+def expand_pages(paths: Sequence[str]) -> Tuple[str, ...]:
+    """
+    Replace the multi-page files (TIFF, PDF) with their pages "path#page".
+
+    Parameters
+    ----------
+    paths : Sequence[str]
+        File paths.
+
+    Returns
+    -------
+    Tuple[str, ...]
+        Paths and pages. The files of the other formats are not opened.
+    """
+    expanded = []
+    for p in paths:
+        if os.path.splitext(p)[1].lower() not in MULTIPAGE_EXT:
+            expanded.append(p)
+            continue
+        n = count_pages(p)
+        if n == 1 and not is_pdf(p):
+            expanded.append(p)
+        else:
+            expanded.extend(page_path(p, i) for i in range(1, n + 1))
+    return tuple(expanded)
+
+
+def read_image_dpi(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Read dpi of an image from its header without decoding the pixels.
+
+    Parameters
+    ----------
+    path : str
+        File path.
+
+    Returns
+    -------
+    None or dpi : None or (int, int)
+    """
+    path, page = split_page(path)
+    if is_pdf(path):
+        return (PDF_DPI, PDF_DPI) if _import_fitz() is not None else None
+    try:
+        with Image.open(path) as pilimg:
+            if page is not None:
+                pilimg.seek(page - 1)
+            return pilimg.info["dpi"]
+    except PIL.UnidentifiedImageError:
+        return None
+
+
+def _decode_gray(pilimg: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """
+    Decode an opened image in grayscale and resize it to size.
+
+    The decoder shrinks the image first when possible:
+    JPEG is decoded by DCT scaling directly to grayscale (draft),
+    and an integer factor is reduced by box averaging (reduce).
+    The exact resize is the final step.
+
+    Parameters
+    ----------
+    pilimg : Image.Image
+        An opened but not loaded image.
+    size : (int, int)
+        The output size (width, height), smaller than the image.
+        (draft changes the color conversion of JPEG even at the same size.)
+
+    Returns
+    -------
+    Image.Image
+        The grayscale image.
+    """
+    if pilimg.format == "JPEG":
+        pilimg.draft("L", size)
+    pilimg = pilimg.convert("L")
+    factor = min(pilimg.width // max(size[0], 1), pilimg.height // max(size[1], 1))
+    if factor >= 2:
+        pilimg = pilimg.reduce(factor)
+    if pilimg.size != size:
+        pilimg = pilimg.resize(size)
+    return pilimg
+
+
+def _read_pdf_page(
+    path: str, page: int, resize_ratio: Optional[float] = None
+) -> Union[Tuple[None, None], Tuple[np.ndarray, Tuple[int, int]]]:
+    """
+    Render a page of a PDF in grayscale at PDF_DPI * resize_ratio.
+    """
+    fitz = _import_fitz()
+    if fitz is None:
+        return None, None
+    dpi = PDF_DPI if resize_ratio is None else int(PDF_DPI * resize_ratio)
+    with fitz.open(path) as doc:
+        pix = doc.load_page(page - 1).get_pixmap(
+            dpi=dpi, colorspace=fitz.csGRAY, alpha=False
+        )
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return img[:, : pix.width].copy(), (dpi, dpi)
+
 
 def read_image(
     path: str, resize_ratio: Optional[float] = None
@@ -18,7 +201,8 @@ def read_image(
     Parameters
     ----------
     path : str
-        File path.
+        File path, or a page "path#page" of a multi-page TIFF or PDF.
+        Only the page is decoded.
     resize_ratio : float or None
         Resize ratio. 0 < resize_ratio <= 1.
 
@@ -26,24 +210,38 @@ def read_image(
     -------
     (None, None) or (img, dpi) : None or (np.ndarray, (int, int))
     """
+    path, page = split_page(path)
+    if is_pdf(path):
+        return _read_pdf_page(path, page or 1, resize_ratio)
     try:
-        pilimg = Image.open(path).convert("L")  # read as gray scale
+        with Image.open(path) as pilimg:
+            if page is not None:
+                pilimg.seek(page - 1)
+            dpi = pilimg.info["dpi"]
+            size = pilimg.size
+            if resize_ratio is not None:
+                size = (
+                    int(pilimg.width * resize_ratio),
+                    int(pilimg.height * resize_ratio),
+                )
+                dpi = (int(dpi[0] * resize_ratio), int(dpi[1] * resize_ratio))
+            if size[0] < pilimg.width and size[1] < pilimg.height:
+                pilimg = _decode_gray(pilimg, size)
+            else:
+                # Without shrinking, the pixels are the same as convert("L").
+                pilimg = pilimg.convert("L")  # read as gray scale
+                if pilimg.size != size:
+                    pilimg = pilimg.resize(size)
+            return np.array(pilimg), dpi
     except PIL.UnidentifiedImageError:
         return None, None
-    dpi = pilimg.info["dpi"]
-    if resize_ratio is not None:
-        pilimg = pilimg.resize(
-            (int(pilimg.width * resize_ratio), int(pilimg.height * resize_ratio))
-        )
-        dpi = (int(dpi[0] * resize_ratio), int(dpi[1] * resize_ratio))
-    return np.array(pilimg), dpi
 
 
-def read_images(
-    dirname: str, ext: Optional[str] = None, resize_ratio: Optional[float] = None
-) -> Iterator[Tuple[str, np.ndarray, Tuple[int, int]]]:
+def list_images(
+    dirname: str, ext: Optional[str] = None, pages: bool = True
+) -> Tuple[str, ...]:
     """
-    Read images and return iterator.
+    List the files to process.
 
     Parameters
     ----------
@@ -51,10 +249,13 @@ def read_images(
         Name of the directory.
     ext: str or None
         File's extension such as ".png", ".jpg",...
+    pages: bool
+        If True, the multi-page files are listed as their pages "path#page".
+        See expand_pages.
 
     Returns
     ----------
-    Iterator of (path, image, dpi).
+    Tuple of file paths in the processing order.
     """
     if ext:
         pathr = os.path.join(dirname, "**", "*" + ext)
@@ -66,37 +267,246 @@ def read_images(
     )
     # exclude directory name
     paths = tuple(filter(lambda x: os.path.isfile(x), paths))
+    logger.debug(f"We detected {len(paths)} files in {dirname}.")
+    if pages:
+        paths = expand_pages(paths)
+    return paths
+
+
+def _read_image_item(
+    path: str, resize_ratio: Optional[float] = None
+) -> Tuple[str, Optional[np.ndarray], Optional[Tuple[int, int]]]:
+    """
+    Read image and return (path, image, dpi).
+    """
+    img, dpi = read_image(path, resize_ratio)
+    return path, img, dpi
+
+
+def iter_images(
+    paths: Sequence[str],
+    resize_ratio: Optional[float] = None,
+    prefetch: int = 0,
+    prefetch_workers: Optional[int] = None,
+) -> Iterator[Tuple[str, np.ndarray, Tuple[int, int]]]:
+    """
+    Read the images of paths and return iterator.
+
+    Parameters
+    ----------
+    paths : Sequence[str]
+        File paths in the processing order.
+    resize_ratio : float or None
+        Resize ratio. 0 < resize_ratio <= 1.
+    prefetch : int
+        The number of files decoded ahead in background threads, by default 0.
+        These files are decoded while the caller processes the current image,
+        and this is also the maximum number of decoded images waiting in the queue.
+        If 0, we decode the images one by one when requested.
+    prefetch_workers : int or None
+        The number of decode threads, by default min(prefetch, cpu count).
+
+    Returns
+    ----------
+    Iterator of (path, image, dpi). The files which are not images are skipped.
+    """
     filenum = len(paths)
-    logger.debug(f"We detected {filenum} files in {dirname}.")
 
-    for i, p in enumerate(paths, start=1):
-        logger.info(f"{i}/{filenum};;; Begin processing for {p} {'-'*100}")
-        img, dpi = read_image(p, resize_ratio)
-        if img is None:
-            logger.debug(f"{p} is not an image (skipped).")
-            continue
-        yield p, img, dpi
+    if prefetch > 0:
+        if prefetch_workers is None:
+            prefetch_workers = min(prefetch, os.cpu_count() or 1)
+        logger.debug(
+            f"Prefetch {prefetch} images with {prefetch_workers} decode threads."
+        )
+        executor = ThreadPoolExecutor(max_workers=prefetch_workers)
+        items = ordered_imap(
+            executor,
+            partial(_read_image_item, resize_ratio=resize_ratio),
+            paths,
+            # the window includes the image being processed by the caller.
+            prefetch + 1,
+        )
+    else:
+        executor = None
+        items = (_read_image_item(p, resize_ratio) for p in paths)
+
+    try:
+        for i, (p, img, dpi) in enumerate(items, start=1):
+            logger.info(f"{i}/{filenum};;; Begin processing for {p} {'-'*100}")
+            if img is None:
+                logger.debug(f"{p} is not an image (skipped).")
+                continue
+            yield p, img, dpi
+    finally:
+        if executor is not None:
+            items.close()
+            executor.shutdown()
+
+
+def read_images(
+    dirname: str,
+    ext: Optional[str] = None,
+    resize_ratio: Optional[float] = None,
+    prefetch: int = 0,
+    prefetch_workers: Optional[int] = None,
+    skip: Optional[Callable[[str], bool]] = None,
+) -> Iterator[Tuple[str, np.ndarray, Tuple[int, int]]]:
+    """
+    Read images and return iterator.
+
+    Parameters
+    ----------
+    dirname: str
+        Name of the directory.
+    ext: str or None
+        File's extension such as ".png", ".jpg",...
+    resize_ratio : float or None
+        Resize ratio. 0 < resize_ratio <= 1.
+    prefetch : int
+        The number of files decoded ahead in background threads, by default 0.
+        See iter_images.
+    prefetch_workers : int or None
+        The number of decode threads, by default min(prefetch, cpu count).
+    skip : Callable[[str], bool] or None
+        Paths with skip(path) == True are not read, by default None.
+
+    Returns
+    ----------
+    Iterator of (path, image, dpi).
+    """
+    paths = list_images(dirname, ext)
+    if skip is not None:
+        paths = tuple(p for p in paths if not skip(p))
+    return iter_images(paths, resize_ratio, prefetch, prefetch_workers)
 
 
 class ImageSaver:
     """
     Image saver.
+
+    Note
+    ----------
+    If workers > 0, images are encoded and written by a thread pool.
+    save() still decides the file name synchronously, and blocks while
+    max_pending images are waiting to be written.
+    Call flush() or close() to wait until all the images are written.
+    Errors of the background writes are raised at the next save(), flush() or close().
+    With output_format, the extension of the file names and the codec options
+    are decided by it.
+    The variants are made from the same image and saved in their directories
+    (relative to dirname) by the same writer, before the image is given back.
+    Each file is written to a hidden temporary file and renamed,
+    so an existing file is always complete.
+    write_temp() and commit() split a save into encoding (e.g. in a worker
+    process) and renaming (in this process, where the file names are decided).
     """
 
-    def __init__(self, dirname: str):
+    def __init__(
+        self,
+        dirname: str,
+        workers: int = 0,
+        max_pending: Optional[int] = None,
+        metrics: Optional[PipelineMetrics] = None,
+        pool: Optional[BufferPool] = None,
+        output_format: Optional[OutputFormat] = None,
+        variants: Sequence[OutputVariant] = (),
+    ):
         """
         Parameters
         ----------
         dirname : str
             The directory name where we save the images.
+        workers : int, optional
+            The number of writer threads, by default 0 (write synchronously).
+        max_pending : int | None, optional
+            The maximum number of images waiting to be written,
+            by default 2 * workers.
+        metrics : PipelineMetrics | None, optional
+            If given, the encode/write seconds, the waiting seconds of save()
+            and the written bytes are recorded, by default None.
+        pool : BufferPool | None, optional
+            If given, the images from the pool are given back after written,
+            by default None.
+        output_format : OutputFormat | None, optional
+            The format and the codec options, by default None
+            (the extension of the file name and the defaults of Pillow).
+        variants : Sequence[OutputVariant], optional
+            The derived outputs, by default ().
         """
         self.dirname = dirname
+        self.output_format = output_format
+        self.metrics = metrics
+        self.pool = pool
         self.filenames = set()
         os.makedirs(dirname, exist_ok=True)
+        self.variants = tuple(variants)
+        # variant name -> the file names in the directory of the variant
+        self.variant_filenames: Dict[str, Set[str]] = {}
+        for variant in self.variants:
+            os.makedirs(self._variant_dir(variant), exist_ok=True)
+            self.variant_filenames[variant.name] = set()
+        self._temp_ids = itertools.count()
+        self.workers = workers
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+            self.max_pending = max_pending or 2 * workers
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+            self._lock = threading.Lock()
+            self._pending: Set[Future] = set()
+            self._error: Optional[BaseException] = None
+
+    def _variant_dir(self, variant: OutputVariant) -> str:
+        return os.path.join(self.dirname, variant.dirname)
+
+    def _temp_path(self, path: str) -> str:
+        """
+        A hidden temporary path of path with the same extension.
+        """
+        dirname, filename = os.path.split(path)
+        name, ext = os.path.splitext(filename)
+        tmp_id = f"{os.getpid()}.{next(self._temp_ids)}"
+        return os.path.join(dirname, f".{name}.{tmp_id}.tmp{ext}")
+
+    def _write(self, path: str, img: np.ndarray, dpi: Tuple[int, int]):
+        """
+        Encode and write the main output. The extension decides the format.
+        """
+        if self.output_format is not None:
+            self.output_format.save(path, img, dpi)
+        else:
+            # fromarray shares the memory of img.
+            Image.fromarray(img).save(path, dpi=dpi)
+
+    def _write_atomic(self, path: str, write: Callable[[str], None]):
+        """
+        Write a file to a temporary path, then rename it to path.
+
+        Parameters
+        ----------
+        path : str
+            File path.
+        write : Callable[[str], None]
+            Writes the file to the given path.
+            The temporary path has the same extension as path.
+        """
+        tmp_path = self._temp_path(path)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
-    def _save_image(self, filename: str, img: np.ndarray, dpi: Tuple[int, int]):
+    def _save_image(
+        self,
+        filename: str,
+        img: np.ndarray,
+        dpi: Tuple[int, int],
+        variant_filenames: Sequence[str] = (),
+    ):
         """
-        Save an image.
+        Save an image and its variants.
 
         Parameters
         ----------
@@ -106,12 +516,87 @@ class ImageSaver:
             An image.
         dpi : Tuple[int, int]
             dpi.
+        variant_filenames : Sequence[str], optional
+            The file names of the variants, by default ().
         """
         path = os.path.join(self.dirname, filename)
-        pilimg = Image.fromarray(img)
-        pilimg.save(path, dpi=dpi)
+        paths = []
+        start = time.perf_counter()
+        try:
+            self._write_atomic(path, lambda p: self._write(p, img, dpi))
+            if self.metrics is not None:
+                self.metrics.add_sample("encode_write", time.perf_counter() - start)
+                start = time.perf_counter()
+            for variant, variant_filename in zip(self.variants, variant_filenames):
+                variant_path = os.path.join(
+                    self._variant_dir(variant), variant_filename
+                )
+                variant_img, variant_dpi = variant.make(img, dpi)
+                self._write_atomic(
+                    variant_path,
+                    lambda p: variant.output_format.save(p, variant_img, variant_dpi),
+                )
+                paths.append(variant_path)
+        finally:
+            if self.pool is not None:
+                self.pool.release(img)
+        if self.metrics is not None:
+            if self.variants:
+                self.metrics.add_sample("variants", time.perf_counter() - start)
+            for p in [path] + paths:
+                self.metrics.add_bytes_written(os.path.getsize(p))
+
+    def restore_filenames(self, filenames: Set[str]):
+        """
+        Set the file names saved by a resumed run.
+
+        Parameters
+        ----------
+        filenames : Set[str]
+            The file names of the main output.
+        """
+        self.filenames = set(filenames)
+        for variant in self.variants:
+            self.variant_filenames[variant.name] = {
+                variant.output_format.filename(f) for f in filenames
+            }
 
-    def _retain_identity(self, filename: str) -> str:
+    def release_filename(self, filename: str):
+        """
+        Make a saved file name available again, so that the image replacing it
+        (e.g. of a changed source file) is saved with the same name.
+
+        Parameters
+        ----------
+        filename : str
+            The file name of the main output.
+        """
+        self.filenames.discard(filename)
+        for variant in self.variants:
+            self.variant_filenames[variant.name].discard(
+                variant.output_format.filename(filename)
+            )
+
+    def remove(self, filename: str):
+        """
+        Remove a saved image and its variants.
+
+        Parameters
+        ----------
+        filename : str
+            The file name of the main output.
+        """
+        paths = [os.path.join(self.dirname, filename)] + [
+            os.path.join(self._variant_dir(v), v.output_format.filename(filename))
+            for v in self.variants
+        ]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _retain_identity(
+        self, filename: str, filenames: Optional[Set[str]] = None
+    ) -> str:
         """
         To retain identity.
 
@@ -119,25 +604,173 @@ class ImageSaver:
         ----------
         filename : str
             Original file name.
+        filenames : Set[str] | None, optional
+            The file names already used, by default self.filenames.
 
         Returns
         -------
         str
             Transformed file name.
         """
-        if filename not in self.filenames:
-            self.filenames.add(filename)
+        if filenames is None:
+            filenames = self.filenames
+        if filename not in filenames:
+            filenames.add(filename)
             return filename
         name, ext = os.path.splitext(filename)
         tail = 1
         while True:
             filename = f"{name}-{tail}{ext}"
-            if filename not in self.filenames:
-                self.filenames.add(filename)
+            if filename not in filenames:
+                filenames.add(filename)
                 return filename
             tail += 1
 
-    def save(self, filename: str, img: np.ndarray, dpi: Tuple[int, int]) -> str:
+    def _decide_filenames(self, filename: str) -> Tuple[str, List[str]]:
+        """
+        The saved file names of the image and its variants.
+
+        Parameters
+        ----------
+        filename : str
+            Original file name.
+
+        Returns
+        -------
+        (str, List[str])
+            The file name of the image and the file names of the variants.
+        """
+        if self.output_format is not None:
+            filename = self.output_format.filename(filename)
+        filename_ = self._retain_identity(filename)
+        if filename_ != filename:
+            logger.info(
+                f"The file name changed to retain identity. {filename} -> {filename_}"
+            )
+        variant_filenames = [
+            self._retain_identity(
+                variant.output_format.filename(filename_),
+                self.variant_filenames[variant.name],
+            )
+            for variant in self.variants
+        ]
+        return filename_, variant_filenames
+
+    def write_temp(
+        self, filename: str, img: np.ndarray, dpi: Tuple[int, int]
+    ) -> TempFiles:
+        """
+        Write an image and its variants to temporary files.
+        The files are renamed by commit() of the saver of the same settings.
+
+        Parameters
+        ----------
+        filename : str
+            Original file name.
+        img : np.ndarray
+            An image. This is not given back to the pool.
+        dpi : Tuple[int, int]
+            dpi.
+
+        Returns
+        -------
+        (str, Tuple[str, ...])
+            The file name with the extension of the output format,
+            and the temporary paths of the image and the variants.
+        """
+        if self.output_format is not None:
+            filename = self.output_format.filename(filename)
+        tmp_paths: List[str] = []
+        try:
+            tmp_path = self._temp_path(os.path.join(self.dirname, filename))
+            tmp_paths.append(tmp_path)
+            self._write(tmp_path, img, dpi)
+            for variant in self.variants:
+                variant_path = os.path.join(
+                    self._variant_dir(variant), variant.output_format.filename(filename)
+                )
+                tmp_path = self._temp_path(variant_path)
+                tmp_paths.append(tmp_path)
+                variant_img, variant_dpi = variant.make(img, dpi)
+                variant.output_format.save(tmp_path, variant_img, variant_dpi)
+        except BaseException:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+        return filename, tuple(tmp_paths)
+
+    @staticmethod
+    def discard(written: TempFiles):
+        """
+        Remove the temporary files of write_temp() which are not committed.
+
+        Parameters
+        ----------
+        written : (str, Tuple[str, ...])
+            The result of write_temp().
+        """
+        for tmp_path in written[1]:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def remove_stale_temp_files(self) -> int:
+        """
+        Remove the temporary files left by an interrupted run
+        in dirname and the directories of the variants.
+        Do not call this while another saver writes to the same directories.
+
+        Returns
+        -------
+        int
+            The number of the removed files.
+        """
+        dirnames = [self.dirname] + [self._variant_dir(v) for v in self.variants]
+        n = 0
+        for dirname in dirnames:
+            for filename in os.listdir(dirname):
+                path = os.path.join(dirname, filename)
+                if TEMP_FILE_PATTERN.match(filename) and os.path.isfile(path):
+                    os.remove(path)
+                    n += 1
+        if n:
+            logger.info(f"ImageSaver: {n} temporary files of a stopped run removed.")
+        return n
+
+    def commit(self, written: TempFiles) -> str:
+        """
+        Rename the temporary files of write_temp() to the saved file names.
+        The file names are decided like save(), in the order of the calls.
+
+        Parameters
+        ----------
+        written : (str, Tuple[str, ...])
+            The result of write_temp().
+
+        Returns
+        -------
+        str
+            Saved file name.
+        """
+        filename, tmp_paths = written
+        filename_, variant_filenames = self._decide_filenames(filename)
+        paths = [os.path.join(self.dirname, filename_)] + [
+            os.path.join(self._variant_dir(variant), variant_filename)
+            for variant, variant_filename in zip(self.variants, variant_filenames)
+        ]
+        for tmp_path, path in zip(tmp_paths, paths):
+            os.replace(tmp_path, path)
+            if self.metrics is not None:
+                self.metrics.add_bytes_written(os.path.getsize(path))
+        return filename_
+
+    def save(
+        self,
+        filename: str,
+        img: np.ndarray,
+        dpi: Tuple[int, int],
+        on_saved: Optional[Callable[[], None]] = None,
+    ) -> str:
         """
         Save image.
 
@@ -149,16 +782,102 @@ class ImageSaver:
             An image.
         dpi : Tuple[int, int]
             dpi.
+        on_saved : Callable[[], None] | None, optional
+            Called when the image and its variants are written, by default None.
+            With the writer threads, this is called in a writer thread,
+            and not called if the write fails.
 
         Returns
         -------
         str
             Saved file name.
         """
-        filename_ = self._retain_identity(filename)
-        if filename_ != filename:
-            logger.info(
-                f"The file name changed to retain identity. {filename} -> {filename_}"
-            )
-        self._save_image(filename_, img, dpi)
+        filename_, variant_filenames = self._decide_filenames(filename)
+        if self.executor is None:
+            self._save_image(filename_, img, dpi, variant_filenames)
+            if on_saved is not None:
+                on_saved()
+        else:
+            self._submit(filename_, img, dpi, variant_filenames, on_saved)
         return filename_
+
+    def _submit(
+        self,
+        filename: str,
+        img: np.ndarray,
+        dpi: Tuple[int, int],
+        variant_filenames: Sequence[str] = (),
+        on_saved: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Submit an image to the writer threads.
+        This blocks while max_pending images are waiting to be written.
+        """
+        self._raise_error()
+        start = time.perf_counter()
+        self._slots.acquire()
+        if self.metrics is not None:
+            self.metrics.add_sample("save_wait", time.perf_counter() - start)
+        future = self.executor.submit(
+            self._save_image, filename, img, dpi, variant_filenames
+        )
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._on_saved)
+        if on_saved is not None:
+
+            def callback(f: Future):
+                if not f.cancelled() and f.exception() is None:
+                    on_saved()
+
+            future.add_done_callback(callback)
+
+    def _on_saved(self, future: Future):
+        """
+        Callback of a finished write.
+        """
+        with self._lock:
+            self._pending.discard(future)
+            if not future.cancelled() and future.exception() is not None:
+                if self._error is None:
+                    self._error = future.exception()
+        self._slots.release()
+
+    def _raise_error(self):
+        """
+        Raise the first error of the background writes.
+        """
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            logger.error(f"ImageSaver: Writing an image failed: {error}")
+            raise error
+
+    def flush(self):
+        """
+        Wait until all the submitted images are written.
+        """
+        if self.executor is None:
+            return
+        with self._lock:
+            pending = tuple(self._pending)
+        wait(pending)
+        self._raise_error()
+
+    def close(self):
+        """
+        Write all the submitted images and stop the writer threads.
+        """
+        if self.executor is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
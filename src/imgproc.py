@@ -0,0 +1,23 @@
+import math
+
+
+def gaussian_kernel_radius(ksize: int, std: float) -> int:
+    """
+    The radius of the Gaussian kernel of cv2.GaussianBlur.
+
+    Parameters
+    ----------
+    ksize : int
+        Kernel size. If ksize <= 0, it is computed from std like OpenCV.
+    std : float
+        Standard deviation.
+
+    Returns
+    -------
+    int
+        Radius.
+    """
+    if ksize > 0:
+        return ksize // 2
+    # OpenCV uses 3 * std for 8 bit images and 4 * std for the others.
+    return int(math.ceil(4 * std)) + 1
@@ -60,3 +60,28 @@ def setup_logger(console_mode: int, save_dir: str, file_mode: int):
     logpath = os.path.join(save_dir, f"log_{NOW}.txt")
     set_logger(console_mode, logpath, file_mode)
     logger.info(f"Log saving at {logpath}.")
+
+
+def add_file_log(save_dir: str, file_mode: int) -> FileHandler:
+    """
+    Add a log file to save_dir. Remove the handler when the job finished.
+
+    Parameters
+    ----------
+    save_dir : str
+        The directory where the log is saved.
+    file_mode : int
+        File log level.
+
+    Returns
+    -------
+    FileHandler
+        The added handler.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    logpath = os.path.join(save_dir, f"log_{NOW}.txt")
+    file_handler = FileHandler(logpath)
+    file_handler.setLevel(file_mode)
+    file_handler.setFormatter(Formatter("%(asctime)s-%(levelname)s: %(message)s"))
+    logger.addHandler(file_handler)
+    return file_handler
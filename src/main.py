@@ -1,19 +1,59 @@
+import sys
 import time
 import logging
 
-from .pipeline import pipeline
-from .read_args import read_args
-from .log_setting import setup_logger
+from .read_args import parse_args, read_paths
+from .log_setting import set_logger, setup_logger
 
 logger = logging.getLogger("adjust-scan-images")
 
 
 def main():
-    args, img_dir, metadata_path, save_dir, baseimg_path = read_args()
+    args = parse_args()
+    run_kargs = dict(
+        workers=args.workers,
+        prefetch=args.prefetch,
+        save_workers=args.save_workers,
+        save_metrics=args.metrics,
+        cache_dir=args.cache_dir,
+        resume=args.resume,
+    )
+    if args.jobs:
+        from .batch import load_jobs, run_jobs
+
+        set_logger(args.console_log)
+        report = run_jobs(load_jobs(args.jobs), args.file_log, args.report, **run_kargs)
+        if report["total"]["failed"]:
+            sys.exit(1)
+        return
+    if args.img_dir:
+        from .batch import make_job
+
+        job = make_job(args.img_dir, args.setting, args.save_dir, args.base)
+        img_dir, metadata_path = job["img_dir"], job["setting"]
+        save_dir, baseimg_path = job["save_dir"], job["base"]
+    else:
+        img_dir, metadata_path, save_dir, baseimg_path = read_paths(args.resume)
+    # The pipeline (numpy, PIL, ...) is imported after the paths are read,
+    # so the prompts appear without waiting for the heavy imports.
+    from .pipeline import pipeline
+    from .watch import watch
+
     start = time.time()  # start time
     setup_logger(args.console_log, save_dir, args.file_log)
     try:
-        pipeline(img_dir, metadata_path, save_dir, baseimg_path)
+        if args.watch:
+            watch(
+                img_dir,
+                metadata_path,
+                save_dir,
+                baseimg_path,
+                interval=args.interval,
+                stable_seconds=args.stable_seconds,
+                **run_kargs,
+            )
+        else:
+            pipeline(img_dir, metadata_path, save_dir, baseimg_path, **run_kargs)
         end = time.time()  # end time
         exetime = end - start
         logger.info(f"ALL PROCESSES FINISHED.\n Time: {exetime} s.")
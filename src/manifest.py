@@ -0,0 +1,195 @@
+import os
+import json
+import logging
+from typing import Dict, Optional, Set
+
+from .const import NOW
+from .pages import split_page
+
+logger = logging.getLogger("adjust-scan-images")
+
+MANIFEST_FILENAME = "manifest.jsonl"
+
+
+class ProcessingManifest:
+    """
+    Manifest of the processed pages in save_dir.
+
+    Note
+    ----------
+    save_dir/manifest.jsonl is a json lines file.
+    The first line is the header {"settings_hash": str, "csv_filename": str | None, "created": str}.
+    The other lines are the records
+    {"path": str, "size": int, "mtime": float, "status": str, "save_filename": str}
+    appended and flushed one by one, so that an interrupted run can be resumed.
+
+    A page is done if its record has the same size and mtime as the file,
+    and its saved image exists. A page is recorded only after its image is
+    written (and renamed from a temporary file), so an existing image is complete. The pages of a multi-page file are recorded
+    one by one as "path#page".
+    If the settings hash differs or resume is False,
+    the old manifest is renamed and a new one is started.
+    """
+
+    def __init__(self, save_dir: str, settings_hash: str, resume: bool = True):
+        """
+        Parameters
+        ----------
+        save_dir : str
+            The directory where the manifest is saved.
+        settings_hash : str
+            Hash of the effective settings and the base image.
+        resume : bool, optional
+            Whether the run of the existing manifest is resumed, by default True.
+        """
+        self.save_dir = save_dir
+        self.path = os.path.join(save_dir, MANIFEST_FILENAME)
+        self.settings_hash = settings_hash
+        self.header: Optional[dict] = None
+        self.records: Dict[str, dict] = {}
+        if os.path.exists(self.path):
+            if resume:
+                self._load()
+            else:
+                self._move_old("We start a new run (not resumed)")
+        self.is_resumed = self.header is not None
+        self.f = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        """
+        Load the manifest. Broken lines of an interrupted write are ignored.
+        """
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        records = {}
+        header = None
+        for i, line in enumerate(lines):
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Manifest: line {i + 1} is broken (ignored).")
+                continue
+            if i == 0:
+                header = data
+            else:
+                records[data["path"]] = data
+        if header is None or header.get("settings_hash") != self.settings_hash:
+            self._move_old(
+                "The settings or the base image changed. We start a new run"
+            )
+            return
+        self.header = header
+        self.records = records
+        logger.info(
+            f"Manifest: Resume the run of {header.get('created')}, "
+            f"{len(records)} pages recorded."
+        )
+
+    def _move_old(self, reason: str):
+        """
+        Move the existing manifest to manifest_{NOW}.jsonl.old.
+        """
+        old_path = os.path.join(self.save_dir, f"manifest_{NOW}.jsonl.old")
+        logger.warning(
+            f"Manifest: {reason}, and the old manifest is moved to {old_path}."
+        )
+        os.replace(self.path, old_path)
+
+    def start(self, csv_filename: Optional[str] = None):
+        """
+        Write the header of a new run. This does nothing when resumed.
+
+        Parameters
+        ----------
+        csv_filename : str | None, optional
+            The file name of the marksheet result in save_dir, by default None.
+        """
+        if self.header is not None:
+            return
+        self.header = {
+            "settings_hash": self.settings_hash,
+            "csv_filename": csv_filename,
+            "created": NOW,
+        }
+        self._write(self.header)
+
+    @property
+    def csv_filename(self) -> Optional[str]:
+        """
+        The file name of the marksheet result of the resumed run.
+        """
+        if self.header is None:
+            return None
+        return self.header.get("csv_filename")
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    def record(self, path: str) -> Optional[dict]:
+        """
+        The last record of the page, or None if it has not been processed.
+        """
+        return self.records.get(self._key(path))
+
+    def is_done(self, path: str) -> bool:
+        """
+        Whether the page has been processed with the same file.
+        """
+        record = self.records.get(self._key(path))
+        if record is None:
+            return False
+        stat = os.stat(split_page(path)[0])
+        if record["size"] != stat.st_size or record["mtime"] != stat.st_mtime:
+            return False
+        save_filename = record.get("save_filename")
+        if save_filename and not os.path.exists(
+            os.path.join(self.save_dir, save_filename)
+        ):
+            return False
+        return True
+
+    def save_filenames(self) -> Set[str]:
+        """
+        The saved file names of the done pages.
+        """
+        return {
+            r["save_filename"]
+            for r in self.records.values()
+            if r.get("save_filename")
+            and os.path.exists(os.path.join(self.save_dir, r["save_filename"]))
+        }
+
+    def add(self, path: str, status: str, save_filename: str = ""):
+        """
+        Record a processed page.
+
+        Parameters
+        ----------
+        path : str
+            The source path, or a page "path#page".
+        status : str
+            "ok" | "error" | "blank" | "not_form".
+        save_filename : str, optional
+            The saved file name, by default "".
+        """
+        stat = os.stat(split_page(path)[0])
+        record = {
+            "path": self._key(path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "status": status,
+            "save_filename": save_filename,
+        }
+        self.records[record["path"]] = record
+        self._write(record)
+
+    def _write(self, data: dict):
+        self.f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        self.f.flush()
+
+    def close(self):
+        """
+        Close file.
+        """
+        self.f.close()
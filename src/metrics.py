@@ -0,0 +1,174 @@
+import json
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+logger = logging.getLogger("adjust-scan-images")
+
+
+def summarize_seconds(seconds: List[float]) -> dict:
+    """
+    Summary of latencies.
+
+    Parameters
+    ----------
+    seconds : List[float]
+        Latencies in seconds.
+
+    Returns
+    -------
+    dict
+        n, total_s, mean_ms, p50_ms, p95_ms and max_ms.
+    """
+    s = np.array(seconds, dtype=np.float64)
+    if not len(s):
+        return {"n": 0}
+    return {
+        "n": len(s),
+        "total_s": float(s.sum()),
+        "mean_ms": float(s.mean() * 1000),
+        "p50_ms": float(np.percentile(s, 50) * 1000),
+        "p95_ms": float(np.percentile(s, 95) * 1000),
+        "max_ms": float(s.max() * 1000),
+    }
+
+
+class StageTimer:
+    """
+    Stage timer of one image.
+
+    The seconds of the stages are summed until pop() is called.
+    """
+
+    def __init__(self):
+        self.current: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measure a stage.
+
+        Parameters
+        ----------
+        name : str
+            Stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        """
+        Add seconds to a stage.
+        """
+        self.current[name] = self.current.get(name, 0) + seconds
+
+    def pop(self) -> Dict[str, float]:
+        """
+        Return the seconds of the stages of the current image and reset.
+        """
+        current, self.current = self.current, {}
+        return current
+
+
+class NullTimer:
+    """
+    Stage timer that measures nothing.
+    """
+
+    _context = nullcontext()
+
+    def stage(self, name: str):
+        return self._context
+
+    def add(self, name: str, seconds: float):
+        pass
+
+    def pop(self) -> Dict[str, float]:
+        return {}
+
+
+NULL_TIMER = NullTimer()
+
+
+class PipelineMetrics:
+    """
+    Metrics of a pipeline run.
+
+    Note
+    ----------
+    The samples of a stage are the seconds per image.
+    add_sample() and add_bytes_written() can be called from writer threads.
+    """
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.counts: Counter = Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_sample(self, stage: str, seconds: float):
+        """
+        Add the seconds of a stage of an image.
+        """
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def add_image(self, timings: Dict[str, float]):
+        """
+        Add the seconds of the stages of an image (StageTimer.pop()).
+        """
+        with self._lock:
+            for stage, seconds in timings.items():
+                self.samples[stage].append(seconds)
+
+    def add_bytes_read(self, n: int):
+        with self._lock:
+            self.bytes_read += n
+
+    def add_bytes_written(self, n: int):
+        with self._lock:
+            self.bytes_written += n
+
+    def summary(self) -> dict:
+        """
+        Summary of the run.
+
+        Returns
+        -------
+        dict
+            Counts, throughput, bytes and the latencies of the stages.
+        """
+        wall = time.perf_counter() - self.start
+        processed = self.counts["processed"]
+        with self._lock:
+            stages = {k: summarize_seconds(v) for k, v in self.samples.items()}
+        return {
+            "counts": dict(self.counts),
+            "wall_s": wall,
+            "images_per_s": processed / wall if wall else 0,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "stages": stages,
+        }
+
+    def save(self, path: str):
+        """
+        Save the summary as json.
+        """
+        summary = self.summary()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1)
+        logger.info(
+            f"Metrics saved at {path}: {summary['counts']}, "
+            f"{summary['images_per_s']:.2f} images/s."
+        )
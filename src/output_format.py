@@ -0,0 +1,300 @@
+import os
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .errors import SettingError
+
+logger = logging.getLogger("adjust-scan-images")
+
+# output_format -> extension
+FORMAT_EXT = {"png": ".png", "jpeg": ".jpg", "tiff": ".tif"}
+# tiff_compression -> the compression of Pillow
+TIFF_COMPRESSION = {
+    "none": "raw",
+    "lzw": "tiff_lzw",
+    "deflate": "tiff_adobe_deflate",
+    "group4": "group4",
+}
+JPEG_SUBSAMPLING = ("4:4:4", "4:2:2", "4:2:0")
+# The keys of the settings.
+OPTION_KEYS = (
+    "output_format",
+    "png_compress_level",
+    "jpeg_quality",
+    "jpeg_subsampling",
+    "tiff_compression",
+    "output_binary",
+    "output_binary_threshold",
+)
+EXT_FORMAT = {
+    ".png": "png",
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".tif": "tiff",
+    ".tiff": "tiff",
+}
+
+
+class OutputFormat:
+    """
+    The format and the codec options of the saved images.
+
+    Note
+    ----------
+    metadata['output_format'] == 'same' | 'png' | 'jpeg' | 'tiff' (default == 'same').
+    metadata['png_compress_level'] == int 0-9 (default == 6).
+    metadata['jpeg_quality'] == int 1-95 (default == 75).
+    metadata['jpeg_subsampling'] == '4:4:4' | '4:2:2' | '4:2:0' (default == None).
+    metadata['tiff_compression'] == 'none' | 'lzw' | 'deflate' | 'group4'
+    (default == 'none').
+    metadata['output_binary'] == 0 | 1 (default == 0).
+    metadata['output_binary_threshold'] == int (default == 128).
+
+    With 'same', the extension of the file name is kept.
+    The options are applied to the files of each format,
+    and the defaults are the same as Pillow.
+    If output_binary == 1, the images are binarized (>= threshold is white)
+    and saved as 1-bit images. JPEG cannot be 1-bit, so the binarized images
+    are saved as 8-bit. 'group4' needs output_binary == 1.
+    A lower png_compress_level encodes faster and writes more bytes.
+    """
+
+    def __init__(
+        self,
+        output_format: str = "same",
+        png_compress_level: int = 6,
+        jpeg_quality: int = 75,
+        jpeg_subsampling: Optional[str] = None,
+        tiff_compression: str = "none",
+        output_binary: int = 0,
+        output_binary_threshold: int = 128,
+    ):
+        """
+        Parameters
+        ----------
+        See Note.
+
+        Raises
+        ------
+        SettingError
+            If an option is invalid.
+        """
+        self.output_format = str(output_format).lower()
+        self.png_compress_level = int(png_compress_level)
+        self.jpeg_quality = int(jpeg_quality)
+        self.jpeg_subsampling = jpeg_subsampling
+        self.tiff_compression = str(tiff_compression).lower()
+        self.output_binary = int(output_binary)
+        self.output_binary_threshold = int(output_binary_threshold)
+        self._validate()
+
+    @classmethod
+    def from_metadata(cls, metadata: dict) -> "OutputFormat":
+        """
+        The output format of the settings. The missing keys are the defaults.
+        """
+        return cls(
+            **{k: metadata[k] for k in OPTION_KEYS if metadata.get(k) is not None}
+        )
+
+    def _validate(self):
+        def check(cond: bool, message: str):
+            if not cond:
+                logger.error(f"Invalid setting: {message}")
+                raise SettingError(message)
+
+        check(
+            self.output_format == "same" or self.output_format in FORMAT_EXT,
+            "output_format must be same, png, jpeg or tiff.",
+        )
+        check(0 <= self.png_compress_level <= 9, "png_compress_level must be in 0-9.")
+        check(1 <= self.jpeg_quality <= 95, "jpeg_quality must be in 1-95.")
+        check(
+            self.jpeg_subsampling is None or self.jpeg_subsampling in JPEG_SUBSAMPLING,
+            "jpeg_subsampling must be 4:4:4, 4:2:2 or 4:2:0.",
+        )
+        check(
+            self.tiff_compression in TIFF_COMPRESSION,
+            "tiff_compression must be none, lzw, deflate or group4.",
+        )
+        check(
+            self.tiff_compression != "group4" or self.output_binary,
+            "tiff_compression group4 needs output_binary == 1.",
+        )
+
+    def filename(self, filename: str) -> str:
+        """
+        The file name with the extension of the output format.
+        """
+        if self.output_format == "same":
+            return filename
+        return os.path.splitext(filename)[0] + FORMAT_EXT[self.output_format]
+
+    def _options(self, ext: str, is_binary: bool) -> dict:
+        """
+        The options of Image.save of the extension.
+        """
+        fmt = EXT_FORMAT.get(ext.lower())
+        if fmt == "png":
+            return {"compress_level": self.png_compress_level}
+        if fmt == "jpeg":
+            options = {"quality": self.jpeg_quality}
+            # None keeps the default of Pillow.
+            if self.jpeg_subsampling is not None:
+                options["subsampling"] = self.jpeg_subsampling
+            return options
+        if fmt == "tiff":
+            compression = self.tiff_compression
+            if compression == "group4" and not is_binary:
+                # Group 4 is only for 1-bit images.
+                compression = "lzw"
+            return {"compression": TIFF_COMPRESSION[compression]}
+        return {}
+
+    def to_image(self, img: np.ndarray, ext: str) -> Image.Image:
+        """
+        The image to save. This shares the memory of img unless binarized.
+        """
+        if not self.output_binary:
+            return Image.fromarray(img)
+        binary = Image.fromarray(img >= self.output_binary_threshold)
+        if EXT_FORMAT.get(ext.lower()) == "jpeg":
+            return binary.convert("L")
+        return binary
+
+    def save(self, path: str, img: np.ndarray, dpi: Tuple[int, int]):
+        """
+        Save an image with the options.
+
+        Parameters
+        ----------
+        path : str
+            File path. The extension decides the format.
+        img : np.ndarray
+            An image.
+        dpi : Tuple[int, int]
+            dpi.
+        """
+        ext = os.path.splitext(path)[1]
+        pilimg = self.to_image(img, ext)
+        pilimg.save(path, dpi=dpi, **self._options(ext, pilimg.mode == "1"))
+
+    def describe(self) -> str:
+        """
+        A short description for the logs and the benchmarks.
+        """
+        binary = " 1-bit" if self.output_binary else ""
+        if self.output_format == "same":
+            return f"same{binary}"
+        ext = FORMAT_EXT[self.output_format]
+        options = self._options(ext, bool(self.output_binary))
+        return f"{self.output_format}{binary} {options}"
+
+
+class OutputVariant:
+    """
+    A derived output of the saved images, e.g. smaller copies for a viewer.
+
+    Note
+    ----------
+    A variant is made from the aligned image in memory, and saved in its own
+    directory with the same file name as the main output (and the extension
+    of its output format).
+    setting['name'] == str. The name (and the default directory) of the variant.
+    setting['dir'] == str (optional, default == name). Relative to save_dir.
+    setting['scale'] == float 0 < scale <= 1 (default == 1).
+    setting['max_size'] == int (optional). The maximum width and height (thumbnail).
+    The other keys are the options of OutputFormat (OPTION_KEYS).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dirname: Optional[str] = None,
+        scale: float = 1,
+        max_size: Optional[int] = None,
+        output_format: Optional[OutputFormat] = None,
+    ):
+        """
+        Parameters
+        ----------
+        See Note.
+
+        Raises
+        ------
+        SettingError
+            If an option is invalid.
+        """
+        self.name = str(name)
+        self.dirname = dirname or self.name
+        self.scale = float(scale)
+        self.max_size = int(max_size) if max_size is not None else None
+        self.output_format = output_format or OutputFormat()
+        if not 0 < self.scale <= 1:
+            raise SettingError(f"The scale of the variant {name} must be in (0, 1].")
+        if self.max_size is not None and self.max_size <= 0:
+            raise SettingError(f"The max_size of the variant {name} must be positive.")
+
+    @classmethod
+    def from_setting(cls, setting: dict) -> "OutputVariant":
+        """
+        The variant of a row of the settings. See Note.
+
+        Raises
+        ------
+        SettingError
+            If a key is unknown or an option is invalid.
+        """
+        setting = dict(setting)
+        if "name" not in setting:
+            raise SettingError(f"The variant {setting} has no name.")
+        options = {k: setting.pop(k) for k in OPTION_KEYS if k in setting}
+        unknown = set(setting) - {"name", "dir", "scale", "max_size"}
+        if unknown:
+            raise SettingError(f"Unknown keys of the variant: {sorted(unknown)}")
+        return cls(
+            setting["name"],
+            setting.get("dir"),
+            setting.get("scale", 1),
+            setting.get("max_size"),
+            OutputFormat(**options),
+        )
+
+    def size(self, width: int, height: int) -> Tuple[int, int]:
+        """
+        The size of the variant of an image of width x height.
+        """
+        scale = self.scale
+        if self.max_size is not None:
+            scale = min(scale, self.max_size / max(width, height))
+        return max(int(width * scale), 1), max(int(height * scale), 1)
+
+    def make(
+        self, img: np.ndarray, dpi: Tuple[int, int]
+    ) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """
+        Make the variant of an image.
+
+        Parameters
+        ----------
+        img : np.ndarray
+            The aligned image.
+        dpi : Tuple[int, int]
+            dpi of img.
+
+        Returns
+        -------
+        (np.ndarray, (int, int))
+            The image and its dpi. img itself if the size is the same.
+        """
+        h, w = img.shape[:2]
+        size = self.size(w, h)
+        if size == (w, h):
+            return img, dpi
+        # reducing_gap shrinks by an integer factor first, which is much faster.
+        resized = Image.fromarray(img).resize(size, Image.BICUBIC, reducing_gap=3.0)
+        scale = size[0] / w
+        return np.asarray(resized), (int(dpi[0] * scale), int(dpi[1] * scale))
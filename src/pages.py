@@ -0,0 +1,57 @@
+import os
+from typing import Optional, Tuple
+
+# A page of a multi-page file is identified by "path#page" (page >= 1).
+PAGE_SEP = "#"
+MULTIPAGE_EXT = (".tif", ".tiff", ".pdf")
+PDF_EXT = (".pdf",)
+
+
+def page_path(path: str, page: int) -> str:
+    """
+    The identity of a page of a multi-page file.
+
+    Parameters
+    ----------
+    path : str
+        File path.
+    page : int
+        Page number starting from 1.
+
+    Returns
+    -------
+    str
+        "path#page".
+    """
+    return f"{path}{PAGE_SEP}{page}"
+
+
+def split_page(path: str) -> Tuple[str, Optional[int]]:
+    """
+    Split the identity of a page into the file path and the page number.
+
+    Parameters
+    ----------
+    path : str
+        "path#page" or a file path.
+
+    Returns
+    -------
+    (str, int | None)
+        The file path and the page number, or None if path is not a page.
+    """
+    file_path, sep, page = path.rpartition(PAGE_SEP)
+    if (
+        sep
+        and page.isdigit()
+        and os.path.splitext(file_path)[1].lower() in MULTIPAGE_EXT
+    ):
+        return file_path, int(page)
+    return path, None
+
+
+def is_pdf(path: str) -> bool:
+    """
+    Whether the file is a PDF.
+    """
+    return os.path.splitext(path)[1].lower() in PDF_EXT
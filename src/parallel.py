@@ -0,0 +1,72 @@
+import logging
+from collections import deque
+from concurrent.futures import Executor, Future
+from functools import partial
+from typing import Callable, Deque, Iterable, Iterator, Optional, TypeVar
+
+logger = logging.getLogger("adjust-scan-images")
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def _discard_result(discard: Callable[[R], None], future: Future):
+    """
+    Callback of a future whose result is not yielded.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        discard(future.result())
+    except Exception as e:
+        logger.warning(f"Cannot discard a result: {e!r}")
+
+
+def ordered_imap(
+    executor: Executor,
+    fn: Callable[[T], R],
+    iterable: Iterable[T],
+    window: int,
+    discard: Optional[Callable[[R], None]] = None,
+) -> Iterator[R]:
+    """
+    Map fn over iterable with an executor and yield the results in input order.
+
+    Parameters
+    ----------
+    executor : Executor
+        Thread pool or process pool.
+    fn : Callable[[T], R]
+        Function applied to each item. It must be picklable for a process pool.
+    iterable : Iterable[T]
+        Items.
+    window : int
+        Maximum number of submitted but not yet yielded items.
+        This bounds the memory held by finished results.
+        An item is yielded when window items are submitted, so window - 1 items
+        run while the caller handles it.
+    discard : Callable[[R], None] | None, optional
+        Called with the results which are not yielded because the iterator
+        is stopped (by an error or by the caller), by default None.
+        The running items are not cancelled, so this is called when they finish.
+        Use this to release the resources of the results (e.g. temporary files).
+
+    Returns
+    -------
+    Iterator[R]
+        Results in the same order as iterable.
+    """
+    window = max(window, 1)
+    pending: Deque[Future] = deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # cancel the rest when stopped by an error or by the caller.
+        for future in pending:
+            if not future.cancel() and discard is not None:
+                future.add_done_callback(partial(_discard_result, discard))
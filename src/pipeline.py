@@ -1,103 +1,167 @@
 import os
 import logging
-from typing import Optional, List, Tuple
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import (
+    Optional,
+    List,
+    Tuple,
+    Iterator,
+    Dict,
+    Union,
+    Sequence,
+    Deque,
+    TYPE_CHECKING,
+)
+import numpy as np
 
 from .setting_io import MarksheetResultWriter
-from .setting_io_ds import read_metadata, read_marksheet_setting, decide_save_filename
-from .image_io import read_image, read_images, ImageSaver
-from .align_images import ImageAligner
-from .read_marksheet import MarkReader
+from .setting_io_ds import load_settings, decide_save_filename
+from .image_io import (
+    read_image,
+    read_image_dpi,
+    iter_images,
+    list_images,
+    ImageSaver,
+    TempFiles,
+)
+from .output_format import OutputFormat, OutputVariant
 from .errors import MarkerNotFoundError
+from .parallel import ordered_imap
+from .manifest import ProcessingManifest
+from .hashing import file_hash, data_hash
+from .cache import read_json_cache, write_json_cache
+from .metrics import PipelineMetrics, StageTimer, NullTimer, NULL_TIMER
+from .buffers import BufferPool
+from .log_setting import set_logger
+from .pages import split_page
 from .const import NOW
 
+# cv2 is imported with the models, only when the images are aligned or read.
+if TYPE_CHECKING:
+    from .align_images import ImageAligner
+    from .read_marksheet import MarkReader
+    from .classify_pages import PageClassifier
 
 logger = logging.getLogger("adjust-scan-images")
 
+# (path, processed image, dpi, marksheet values, status, stage seconds,
+#  the temporary files of the image written by a worker process)
+ProcessResult = Tuple[
+    str,
+    Optional[np.ndarray],
+    Optional[Tuple[int, int]],
+    Optional[dict],
+    str,
+    Dict[str, float],
+    Optional[TempFiles],
+]
+# The statuses of a page. The blank and not form pages are not aligned nor read.
+OK = "ok"
+ERROR = "error"
+SKIPPED_STATUSES = ("blank", "not_form")
+# Increment this when the fitted states change with the same settings and base image
+# (e.g. the decoding or the preprocessing of the models).
+MODEL_CACHE_VERSION = 1
 
-def pipeline(
-    img_dir: str, metadata_path: Optional[str], save_dir: str, baseimg_path: str
-):
+
+class ImageProcessor:
     """
-    Process pipeline.
+    Align and read images with the fitted models.
 
-    Parameters
+    Note
     ----------
-    img_dir : str
-        The name of the directory. We read the images in this directory.
-    metadata_path : None | str
-        The path of the metadata.
-    save_dir : str
-        The name of the directory. We save the processed images in this directory.
-    baseimg_path : str
-        The base image for the transformation.
+    If is_save_image is False, the images are not warped.
+    The marks are read by mapping their coords into the original image instead,
+    and process() returns None as the image.
+    With a classifier, the blank and not form pages are neither aligned nor read.
+    They are returned as they are ('pass') or as None ('skip').
     """
 
-    # log for parameters
-    logger.info(f"img_dir: {img_dir}")
-    logger.info(f"metadata_path: {metadata_path}")
-    logger.info(f"save_dir: {save_dir}")
-    logger.info(f"baseimg_path: {baseimg_path}")
-
-    # read metadata
-    # metadata = read_metadata(metadata_path, pt2px = dpi[0])
-    baseimg, dpi = read_image(baseimg_path)
-    metadata = read_metadata(metadata_path, pt2px=dpi[0])
-    resize_ratio: float = metadata["resize_ratio"]
-    is_align: bool = metadata["is_align"]
-    is_marksheet: bool = metadata["is_marksheet"]
-    is_marksheet_fit: bool = metadata["is_marksheet_fit"]
-    coord_unit = metadata["coord_unit"]
-    pt2px: Optional[int] = dpi[0] if coord_unit == "pt" else None
-
-    # read base image
-    logger.debug(f"Begin reading the base image {baseimg_path}")
-    baseimg, dpi = read_image(baseimg_path, resize_ratio=resize_ratio)
-    if baseimg is None:
-        logger.error(f"The file {baseimg_path} is not an image.")
-        raise FileExistsError(f"The file {baseimg_path} is not an image.")
+    def __init__(
+        self,
+        aligner: Optional["ImageAligner"] = None,
+        mark_reader: Optional["MarkReader"] = None,
+        is_save_image: bool = True,
+        timer: Union[StageTimer, NullTimer] = NULL_TIMER,
+        pool: Optional[BufferPool] = None,
+        classifier: Optional["PageClassifier"] = None,
+    ):
+        """
+        Parameters
+        ----------
+        aligner : ImageAligner | None, optional
+            Fitted aligner. If None, we do not align the images.
+        mark_reader : MarkReader | None, optional
+            Mark reader. If None, we do not read the marksheet.
+        is_save_image : bool, optional
+            Whether the aligned images are needed, by default True.
+        timer : StageTimer | NullTimer, optional
+            Stage timer shared with the aligner and the mark reader,
+            by default NULL_TIMER (not measured).
+        pool : BufferPool | None, optional
+            If given, the images are warped into the arrays of the pool,
+            by default None. Release the returned image to the pool after use.
+        classifier : PageClassifier | None, optional
+            If given, the pages are classified before alignment, by default None.
+        """
+        self.aligner = aligner
+        self.mark_reader = mark_reader
+        self.is_save_image = is_save_image
+        self.timer = timer
+        self.pool = pool
+        self.classifier = classifier
+        for model in (aligner, mark_reader, classifier):
+            if model is not None:
+                model.timer = timer
 
-    # marksheet setting
-    if is_marksheet:
-        logger.debug(f"is_marksheet == 1")
-        metadata["sheet"] = read_marksheet_setting(
-            metadata_path, resize_ratio, pt2px=pt2px
-        )
-        mark_reader = MarkReader(metadata)
-        marksheet_result_path = os.path.join(save_dir, f"marksheet_result_{NOW}.csv")
-        logger.info(f"Marksheet result is saved at {marksheet_result_path}")
-        marksheet_result_header = tuple(
-            ["origin_filename", "save_filename"] + list(metadata["sheet"].keys())
-        )
-        marksheet_result_writer = MarksheetResultWriter(
-            marksheet_result_path, marksheet_result_header
-        )
-    else:
-        logger.debug(f"is_marksheet == 0")
+    def process(
+        self, p: str, img: np.ndarray
+    ) -> Tuple[Optional[np.ndarray], Optional[dict], str]:
+        """
+        Align and read one image.
 
-    # fit base image
-    if is_align:
-        aligner = ImageAligner(metadata)
-        aligner.fit(baseimg)
-    if is_marksheet and is_marksheet_fit:
-        mark_reader.fit(baseimg)
+        Parameters
+        ----------
+        p : str
+            The path of the image.
+        img : np.ndarray
+            The image.
 
-    img_iter = read_images(img_dir, resize_ratio=resize_ratio)
-    error_paths: List[Tuple[str, str]] = []
-    image_saver = ImageSaver(save_dir)
-    for p, img, dpi in img_iter:
+        Returns
+        -------
+        (img, v, status) : (np.ndarray | None, dict | None, str)
+            The processed image, the marksheet values and the status
+            ("ok" | "error" | "blank" | "not_form").
+        """
         is_error = False
-        logger.debug(f"Begin processing for {p}")
         filename = os.path.basename(p)
-        if is_align:
+        if self.classifier is not None:
+            page_class = self.classifier.classify(img)
+            if page_class in SKIPPED_STATUSES:
+                action = self.classifier.action
+                logger.info(f"The image '{p}' is {page_class} ({action}).")
+                v = {"origin_filename": filename} if self.mark_reader else None
+                if action != "pass" or not self.is_save_image:
+                    img = None
+                return img, v, page_class
+        affine = None
+        if self.aligner is not None:
             try:
-                img = aligner.transform_one(img)
+                affine = self.aligner.estimate(img)
             except MarkerNotFoundError:
                 logger.error(
                     f"The image '{p}' cannot be aligned since we cannot find markers."
                 )
                 is_error = True
-        if is_marksheet:
-            v = mark_reader.read(img)
+            if affine is not None and self.is_save_image:
+                dst = self.pool.get(img.shape, img.dtype) if self.pool else None
+                img = self.aligner.warp(img, affine, dst=dst)
+                affine = None
+        if self.mark_reader is not None:
+            v = self.mark_reader.read(img, affine=affine)
             nonekey = [k_ for k_, v_ in v.items() if v_ is None]
             if nonekey:
                 logger.warn(f"We cannot find the following marksheet check: {nonekey}")
@@ -105,25 +169,714 @@ def pipeline(
             v["origin_filename"] = filename
         else:
             v = None
+        if not self.is_save_image:
+            img = None
+        return img, v, ERROR if is_error else OK
+
+
+def _iter_processed(
+    paths: Sequence[str],
+    resize_ratio: float,
+    processor: ImageProcessor,
+    prefetch: int = 0,
+) -> Iterator[ProcessResult]:
+    """
+    Process the images one by one in this process.
+    """
+    timer = processor.timer
+    # With prefetch, the images are decoded in the background and we measure the wait.
+    decode_stage = "decode_wait" if prefetch > 0 else "decode"
+    items = iter_images(paths, resize_ratio=resize_ratio, prefetch=prefetch)
+    while True:
+        with timer.stage(decode_stage):
+            item = next(items, None)
+        if item is None:
+            break
+        p, img, dpi = item
+        logger.debug(f"Begin processing for {p}")
+        img, v, status = processor.process(p, img)
+        yield p, img, dpi, v, status, timer.pop(), None
 
-        # Set your customized filename
-        save_filename = decide_save_filename(p, save_dir, v)
-        save_filename = image_saver.save(save_filename, img, dpi)
-        logger.info(f"{p} -> {os.path.join(save_dir, save_filename)} saved.")
-        if is_marksheet:
-            v["save_filename"] = save_filename
-            marksheet_result_writer.write_one_dict(v)
-        if is_error:
-            error_paths.append((filename, save_filename))
-
-    # error summary
-    if error_paths:
-        error_summary = ""
-        for ep in error_paths:
-            error_summary += f"{ep}\n"
-        logger.warn(
-            f"ERROR SUMMARY: The following files occurred some error (original_filename, save_filename).:\n{error_summary}"
+
+# The fitted models of this process. settings hash -> (aligner, mark_reader)
+_models_memo: Dict[str, Tuple[Optional["ImageAligner"], Optional["MarkReader"]]] = {}
+
+# The fitted state of a worker process. This is set once by _init_worker.
+_worker_state: dict = {}
+
+
+def _init_worker(
+    processor: ImageProcessor,
+    resize_ratio: float,
+    log_level: int,
+    saver_args: Optional[tuple] = None,
+):
+    """
+    Initialize a worker process with the fitted state.
+    With saver_args (dirname, output_format, variants), the worker encodes
+    and writes the images to temporary files.
+    """
+    # spawned processes do not inherit the handlers.
+    if not logger.handlers:
+        set_logger(log_level)
+    _worker_state["processor"] = processor
+    _worker_state["resize_ratio"] = resize_ratio
+    _worker_state["saver"] = None
+    if saver_args is not None:
+        dirname, output_format, variants = saver_args
+        _worker_state["saver"] = ImageSaver(
+            dirname, output_format=output_format, variants=variants
         )
 
-    if is_marksheet:
-        marksheet_result_writer.close()
+
+def _process_path(p: str) -> ProcessResult:
+    """
+    Read and process one image in a worker process.
+    """
+    processor: ImageProcessor = _worker_state["processor"]
+    if processor.pool is not None:
+        # The image of the last call has been sent to the main process.
+        processor.pool.release(_worker_state.pop("sent", None))
+    with processor.timer.stage("decode"):
+        img, dpi = read_image(p, _worker_state["resize_ratio"])
+    if img is None:
+        return p, None, None, None, ERROR, processor.timer.pop(), None
+    img, v, status = processor.process(p, img)
+    saver: Optional[ImageSaver] = _worker_state["saver"]
+    written = None
+    if saver is not None and img is not None:
+        # Only the file names are sent to the main process, which renames them.
+        data = None if status in SKIPPED_STATUSES else v
+        save_filename = decide_save_filename(p, saver.dirname, data)
+        with processor.timer.stage("encode_write"):
+            written = saver.write_temp(save_filename, img, dpi)
+        if processor.pool is not None:
+            processor.pool.release(img)
+        img = None
+    _worker_state["sent"] = img
+    return p, img, dpi, v, status, processor.timer.pop(), written
+
+
+def _worker_pool(
+    processor: ImageProcessor,
+    resize_ratio: float,
+    workers: int,
+    image_saver: Optional[ImageSaver] = None,
+) -> ProcessPoolExecutor:
+    """
+    Start the worker processes with the fitted state.
+    With image_saver, the workers encode and write the images like it.
+    """
+    logger.info(f"Begin processing with {workers} worker processes.")
+    saver_args = None
+    if image_saver is not None:
+        saver_args = (
+            image_saver.dirname,
+            image_saver.output_format,
+            image_saver.variants,
+        )
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(processor, resize_ratio, logger.getEffectiveLevel(), saver_args),
+    )
+
+
+def _discard_result(result: ProcessResult):
+    """
+    Remove the temporary files of a result which is not recorded.
+    """
+    written = result[6]
+    if written is not None:
+        ImageSaver.discard(written)
+
+
+def _iter_processed_parallel(
+    paths: Sequence[str],
+    processor: ImageProcessor,
+    executor: ProcessPoolExecutor,
+    workers: int,
+) -> Iterator[ProcessResult]:
+    """
+    Process the images with a process pool. The results are yielded in input order.
+    If stopped (e.g. by an error of a worker), the temporary files of the results
+    not yielded are removed.
+    """
+    filenum = len(paths)
+    results = ordered_imap(
+        executor, _process_path, paths, window=2 * workers, discard=_discard_result
+    )
+    try:
+        for i in range(1, filenum + 1):
+            with processor.timer.stage("result_wait"):
+                p, img, dpi, v, status, timings, written = next(results)
+            # timings of the worker + the waiting time of this process.
+            timings.update(processor.timer.pop())
+            logger.info(f"{i}/{filenum};;; Processed {p} {'-'*100}")
+            if dpi is None:
+                logger.debug(f"{p} is not an image (skipped).")
+                continue
+            yield p, img, dpi, v, status, timings, written
+    finally:
+        results.close()
+
+
+def _fit_models(
+    metadata: dict,
+    baseimg_path: str,
+    settings_hash: str,
+    cache_dir: Optional[str] = None,
+) -> Tuple[Optional["ImageAligner"], Optional["MarkReader"]]:
+    """
+    Build the models and fit them with the base image.
+
+    The models are reused by the runs of this process with the same settings hash.
+    If cache_dir is given, the fitted states are cached in cache_dir,
+    and the base image is not decoded when the states are cached.
+    The key of the cache also has MODEL_CACHE_VERSION.
+
+    Parameters
+    ----------
+    metadata : dict
+        Compiled settings.
+    baseimg_path : str
+        The base image.
+    settings_hash : str
+        The hash of the settings and the content of the base image.
+        This is the key of the cache.
+    cache_dir : str | None, optional
+        The directory of the fitted states, by default None (not cached).
+
+    Returns
+    -------
+    aligner, mark_reader : ImageAligner | None, MarkReader | None
+        None if the stage is not used.
+    """
+    if settings_hash in _models_memo:
+        logger.info("Fitted models reused from the previous run.")
+        return _models_memo[settings_hash]
+    aligner, mark_reader = _build_models(
+        metadata, baseimg_path, settings_hash, cache_dir
+    )
+    _models_memo[settings_hash] = aligner, mark_reader
+    return aligner, mark_reader
+
+
+def _build_models(
+    metadata: dict,
+    baseimg_path: str,
+    settings_hash: str,
+    cache_dir: Optional[str] = None,
+) -> Tuple[Optional["ImageAligner"], Optional["MarkReader"]]:
+    """
+    Build and fit the models, or load the fitted states from cache_dir.
+    """
+    aligner: Optional["ImageAligner"] = None
+    if metadata["is_align"]:
+        from .align_images import ImageAligner
+
+        aligner = ImageAligner(metadata)
+    mark_reader: Optional["MarkReader"] = None
+    if metadata["is_marksheet"]:
+        logger.debug(f"is_marksheet == 1")
+        from .read_marksheet import MarkReader
+
+        mark_reader = MarkReader(metadata)
+    else:
+        logger.debug(f"is_marksheet == 0")
+    is_marksheet_fit = metadata["is_marksheet"] and metadata["is_marksheet_fit"]
+    if aligner is None and not is_marksheet_fit:
+        return aligner, mark_reader
+
+    cache_path: Optional[str] = None
+    if cache_dir:
+        key = data_hash(MODEL_CACHE_VERSION, settings_hash)
+        cache_path = os.path.join(cache_dir, f"models_{key}.json")
+        states = read_json_cache(cache_path)
+        if states is not None:
+            try:
+                if aligner is not None:
+                    aligner.set_state(states["aligner"])
+                if mark_reader is not None:
+                    mark_reader.set_state(states["mark_reader"])
+                logger.info(f"Fitted models loaded from the cache {cache_path}")
+                return aligner, mark_reader
+            except (KeyError, TypeError, ValueError, AssertionError) as e:
+                logger.warning(f"Cache {cache_path} is broken (ignored): {e}")
+
+    # read base image
+    logger.debug(f"Begin reading the base image {baseimg_path}")
+    baseimg, _ = read_image(baseimg_path, resize_ratio=metadata["resize_ratio"])
+    if baseimg is None:
+        logger.error(f"The file {baseimg_path} is not an image.")
+        raise FileExistsError(f"The file {baseimg_path} is not an image.")
+
+    # fit base image
+    if aligner is not None:
+        aligner.fit(baseimg)
+    if is_marksheet_fit:
+        mark_reader.fit(baseimg)
+    if cache_path is not None:
+        write_json_cache(
+            cache_path,
+            {
+                "aligner": aligner.get_state() if aligner is not None else None,
+                "mark_reader": (
+                    mark_reader.get_state() if mark_reader is not None else None
+                ),
+            },
+        )
+    return aligner, mark_reader
+
+
+def _base_hash(baseimg_path: str) -> str:
+    """
+    The content hash of the base image, which can be a page "path#page".
+    """
+    file_path, page = split_page(baseimg_path)
+    if page is None:
+        return file_hash(file_path)
+    return data_hash(file_hash(file_path), page)
+
+
+class PipelineRun:
+    """
+    A run of the pipeline writing to save_dir.
+
+    Note
+    ----------
+    The settings, the fitted models, the marksheet result writer, the manifest,
+    the image saver and the worker processes are kept until close(),
+    so process() can be called many times with new images (e.g. the watch mode).
+    The marksheet result and the manifest are flushed after each image.
+    """
+
+    def __init__(
+        self,
+        metadata_path: Optional[str],
+        save_dir: str,
+        baseimg_path: str,
+        workers: int = 1,
+        prefetch: int = 0,
+        save_workers: int = 0,
+        save_metrics: bool = False,
+        cache_dir: Optional[str] = None,
+        resume: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        See pipeline().
+        """
+        self.save_dir = save_dir
+        self.workers = workers
+        self.prefetch = prefetch
+
+        # read metadata
+        # Only the header of the base image is read here to get dpi.
+        dpi = read_image_dpi(baseimg_path)
+        if dpi is None:
+            logger.error(f"The file {baseimg_path} is not an image.")
+            raise FileExistsError(f"The file {baseimg_path} is not an image.")
+        metadata = load_settings(metadata_path, dpi, cache_dir=cache_dir)
+        self.metadata = metadata
+        self.resize_ratio: float = metadata["resize_ratio"]
+        self.is_marksheet: bool = metadata["is_marksheet"]
+        self.is_save_image: bool = metadata["is_save_image"]
+        settings_hash = data_hash(metadata, _base_hash(baseimg_path))
+
+        # fit base image
+        aligner, mark_reader = _fit_models(
+            metadata, baseimg_path, settings_hash, cache_dir=cache_dir
+        )
+        classifier: Optional["PageClassifier"] = None
+        if metadata.get("blank_page_action", "none") != "none":
+            from .classify_pages import PageClassifier
+
+            classifier = PageClassifier(metadata)
+            logger.info(
+                f"Blank and not form pages: {classifier.action} without alignment."
+            )
+
+        # manifest to resume the run
+        os.makedirs(save_dir, exist_ok=True)
+        self.manifest = ProcessingManifest(save_dir, settings_hash, resume=resume)
+        self.marksheet_result_writer: Optional[MarksheetResultWriter] = None
+        if self.is_marksheet:
+            marksheet_result_filename = self.manifest.csv_filename
+            is_continued = bool(marksheet_result_filename) and os.path.exists(
+                os.path.join(save_dir, marksheet_result_filename)
+            )
+            if not is_continued:
+                marksheet_result_filename = f"marksheet_result_{NOW}.csv"
+            marksheet_result_path = os.path.join(save_dir, marksheet_result_filename)
+            logger.info(f"Marksheet result is saved at {marksheet_result_path}")
+            marksheet_result_header = tuple(
+                ["origin_filename", "save_filename"] + list(metadata["sheet"].keys())
+            )
+            if classifier is not None:
+                marksheet_result_header += ("status",)
+            self.marksheet_result_writer = MarksheetResultWriter(
+                marksheet_result_path,
+                marksheet_result_header,
+                write_header=not is_continued,
+            )
+            self.manifest.start(marksheet_result_filename)
+        else:
+            self.manifest.start()
+
+        # If the images are not saved, they are not warped either.
+        if not self.is_save_image:
+            logger.info("is_save_image == 0: The images are not aligned nor saved.")
+            if metadata.get("variants"):
+                logger.warning("is_save_image == 0: The output variants are not saved.")
+        self.metrics: Optional[PipelineMetrics] = None
+        timer: Union[StageTimer, NullTimer] = NULL_TIMER
+        if save_metrics:
+            self.metrics = PipelineMetrics()
+            timer = StageTimer()
+        # The aligned pages are warped into reused arrays,
+        # which the saver gives back after writing.
+        self.pool: Optional[BufferPool] = None
+        if self.is_save_image and aligner is not None:
+            self.pool = BufferPool(max_free=2 * save_workers + 2)
+        self.processor = ImageProcessor(
+            aligner,
+            mark_reader,
+            is_save_image=self.is_save_image,
+            timer=timer,
+            pool=self.pool,
+            classifier=classifier,
+        )
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+        self.error_paths: List[Tuple[str, str]] = []
+        self.skipped_paths: List[str] = []
+        # (path, marksheet values, status, save_filename, written) in input order.
+        # The results are recorded only after the images are written.
+        self._unrecorded: Deque[
+            Tuple[str, Optional[dict], str, str, threading.Event]
+        ] = deque()
+        self.image_saver: Optional[ImageSaver] = None
+        if self.is_save_image:
+            output_format = OutputFormat.from_metadata(metadata)
+            logger.info(f"Output format: {output_format.describe()}")
+            variants = [
+                OutputVariant.from_setting(v) for v in metadata.get("variants", [])
+            ]
+            for variant in variants:
+                logger.info(
+                    f"Output variant {variant.name}: {variant.dirname}, "
+                    f"scale {variant.scale}, max_size {variant.max_size}, "
+                    f"{variant.output_format.describe()}"
+                )
+            self.image_saver = ImageSaver(
+                save_dir,
+                workers=save_workers,
+                metrics=self.metrics,
+                pool=self.pool,
+                output_format=output_format,
+                variants=variants,
+            )
+            # the names of the images saved by the resumed run.
+            self.image_saver.restore_filenames(self.manifest.save_filenames())
+            self.image_saver.remove_stale_temp_files()
+
+    def is_done(self, path: str) -> bool:
+        """
+        Whether the image has been processed by this run or the resumed run.
+        """
+        return self.manifest.is_done(path)
+
+    def process(self, paths: Sequence[str]) -> int:
+        """
+        Process the images and record the results.
+
+        Parameters
+        ----------
+        paths : Sequence[str]
+            The image paths in the processing order.
+
+        Returns
+        -------
+        int
+            The number of processed images.
+        """
+        if self.image_saver is not None:
+            # The pages processed again replace their previous images.
+            for p in paths:
+                record = self.manifest.record(p)
+                if record is not None and record["save_filename"]:
+                    self.image_saver.release_filename(record["save_filename"])
+        if self.workers > 1:
+            if self.executor is None:
+                self.executor = _worker_pool(
+                    self.processor, self.resize_ratio, self.workers, self.image_saver
+                )
+            processed = _iter_processed_parallel(
+                paths, self.processor, self.executor, self.workers
+            )
+        else:
+            processed = _iter_processed(
+                paths, self.resize_ratio, self.processor, self.prefetch
+            )
+        n = 0
+        try:
+            for result in processed:
+                try:
+                    self._record(*result)
+                except BaseException:
+                    # the files committed by _record are not temporary anymore.
+                    _discard_result(result)
+                    raise
+                n += 1
+        except BrokenProcessPool:
+            # A worker died. The next call starts a new pool.
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            raise
+        return n
+
+    def _record(
+        self,
+        p: str,
+        img: Optional[np.ndarray],
+        dpi: Tuple[int, int],
+        v: Optional[dict],
+        status: str,
+        timings: Dict[str, float],
+        written: Optional[TempFiles] = None,
+    ):
+        """
+        Save the image and write the result of one processed image.
+        The skipped pages (img is None) are recorded without saving.
+        The image written by a worker process (written) is renamed.
+        """
+        save_dir = self.save_dir
+        filename = os.path.basename(p)
+        if self.metrics is not None:
+            self.metrics.add_image(timings)
+            file_path, page = split_page(p)
+            if page is None or page == 1:
+                self.metrics.add_bytes_read(os.path.getsize(file_path))
+            self.metrics.counts["processed"] += 1
+            if status == ERROR:
+                self.metrics.counts["error"] += 1
+            elif status in SKIPPED_STATUSES:
+                self.metrics.counts["skipped"] += 1
+
+        saved = threading.Event()
+        if self.image_saver is not None and written is not None:
+            save_filename = self.image_saver.commit(written)
+            saved.set()
+            logger.info(f"{p} -> {os.path.join(save_dir, save_filename)} saved.")
+        elif self.image_saver is not None and img is not None:
+            # Set your customized filename
+            # The passed pages keep their names.
+            data = None if status in SKIPPED_STATUSES else v
+            save_filename = decide_save_filename(p, save_dir, data)
+            save_filename = self.image_saver.save(
+                save_filename, img, dpi, on_saved=saved.set
+            )
+            logger.info(f"{p} -> {os.path.join(save_dir, save_filename)} saved.")
+        else:
+            save_filename = ""
+            saved.set()
+        self._unrecorded.append((p, v, status, save_filename, saved))
+        self._write_records()
+        if status == ERROR:
+            self.error_paths.append((filename, save_filename))
+        elif status in SKIPPED_STATUSES:
+            self.skipped_paths.append(filename)
+
+    def record_error(self, p: str):
+        """
+        Record a page which raised an error before it was processed
+        (e.g. a broken file). It is not processed again until the file changes.
+        """
+        if self.metrics is not None:
+            self.metrics.counts["processed"] += 1
+            self.metrics.counts["error"] += 1
+        written = threading.Event()
+        written.set()
+        self._unrecorded.append((p, None, ERROR, "", written))
+        self._write_records()
+        self.error_paths.append((os.path.basename(p), ""))
+
+    def _write_records(self, is_flushed: bool = False):
+        """
+        Write the results of the pages whose images are written, in input order.
+        A page is recorded in the manifest only when its image exists,
+        so an interrupted run processes the unwritten pages again.
+
+        Parameters
+        ----------
+        is_flushed : bool, optional
+            Whether all the writes have finished, by default False.
+            If True, the pages whose writes failed are not recorded.
+        """
+        while self._unrecorded:
+            p, v, status, save_filename, written = self._unrecorded[0]
+            if not written.is_set():
+                if not is_flushed:
+                    break
+                self._unrecorded.popleft()
+                logger.error(f"{p}: The image was not written (not recorded).")
+                continue
+            self._unrecorded.popleft()
+            record = self.manifest.record(p)
+            if record is not None:
+                self._remove_previous(p, record, save_filename)
+            if self.marksheet_result_writer is not None and v is not None:
+                v["save_filename"] = save_filename
+                v["status"] = status
+                self.marksheet_result_writer.write_one_dict(v)
+                self.marksheet_result_writer.flush()
+            self.manifest.add(p, status, save_filename)
+
+    def _remove_previous(self, p: str, record: dict, save_filename: str):
+        """
+        Remove the marksheet result and the image of the previous processing
+        of a page processed again (its file changed or its image was removed).
+        """
+        previous_filename = record["save_filename"]
+        logger.info(f"{p} is processed again and replaces {previous_filename!r}.")
+        if self.marksheet_result_writer is not None:
+            self.marksheet_result_writer.remove_row(
+                {
+                    "origin_filename": os.path.basename(p),
+                    "save_filename": previous_filename,
+                }
+            )
+        if (
+            self.image_saver is not None
+            and previous_filename
+            and previous_filename != save_filename
+            and previous_filename not in self.image_saver.filenames
+        ):
+            self.image_saver.remove(previous_filename)
+
+    def flush(self):
+        """
+        Wait until all the images are written, and record their results.
+        """
+        try:
+            if self.image_saver is not None:
+                self.image_saver.flush()
+        finally:
+            self._write_records(is_flushed=True)
+
+    def close(self):
+        """
+        Write all the images and close the files and the worker processes.
+        """
+        try:
+            if self.image_saver is not None:
+                self.image_saver.close()
+        finally:
+            self._write_records(is_flushed=True)
+            self.manifest.close()
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        if self.metrics is not None:
+            if self.pool is not None:
+                self.metrics.counts.update(self.pool.stats())
+            self.metrics.save(os.path.join(self.save_dir, f"metrics_{NOW}.json"))
+
+        if self.skipped_paths:
+            logger.info(
+                f"{len(self.skipped_paths)} blank or not form pages were not aligned "
+                f"({self.processor.classifier.action})."
+            )
+        # error summary
+        if self.error_paths:
+            error_summary = ""
+            for ep in self.error_paths:
+                error_summary += f"{ep}\n"
+            logger.warn(
+                f"ERROR SUMMARY: The following files occurred some error (original_filename, save_filename).:\n{error_summary}"
+            )
+
+        if self.marksheet_result_writer is not None:
+            self.marksheet_result_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def pipeline(
+    img_dir: str,
+    metadata_path: Optional[str],
+    save_dir: str,
+    baseimg_path: str,
+    workers: int = 1,
+    prefetch: int = 0,
+    save_workers: int = 0,
+    save_metrics: bool = False,
+    cache_dir: Optional[str] = None,
+    resume: bool = True,
+):
+    """
+    Process pipeline.
+
+    Parameters
+    ----------
+    img_dir : str
+        The name of the directory. We read the images in this directory.
+    metadata_path : None | str
+        The path of the metadata.
+    save_dir : str
+        The name of the directory. We save the processed images in this directory.
+    baseimg_path : str
+        The base image for the transformation.
+    workers : int, optional
+        The number of worker processes, by default 1.
+        If workers > 1, the images are decoded, aligned, read, encoded and written
+        to temporary files in a process pool. This process only renames the files
+        and writes the results in input order, so the pages are not sent back.
+        The encoding scales with workers, and save_workers is not used.
+    prefetch : int, optional
+        The number of images decoded ahead in background threads, by default 0.
+        This is used only when workers == 1.
+    save_workers : int, optional
+        The number of threads encoding and writing the images, by default 0.
+        If 0, the images are written synchronously. Only used when workers == 1.
+    save_metrics : bool, optional
+        If True, the seconds of the stages of each image are measured,
+        and the summary is saved to save_dir/metrics_{NOW}.json, by default False.
+    cache_dir : str | None, optional
+        The directory where the compiled settings and the fitted models are cached,
+        by default None. If None, the setting file is parsed
+        and the base image is fitted every run.
+    resume : bool, optional
+        Whether the run recorded in save_dir/manifest.jsonl is resumed,
+        by default True. The pages already processed are skipped,
+        and the pages of the changed files are processed again and replace
+        their previous results (the csv row and the image).
+        If False, all the pages are processed into a new marksheet result,
+        and the images of the same names are overwritten.
+    """
+
+    # log for parameters
+    logger.info(f"img_dir: {img_dir}")
+    logger.info(f"metadata_path: {metadata_path}")
+    logger.info(f"save_dir: {save_dir}")
+    logger.info(f"baseimg_path: {baseimg_path}")
+
+    with PipelineRun(
+        metadata_path,
+        save_dir,
+        baseimg_path,
+        workers=workers,
+        prefetch=prefetch,
+        save_workers=save_workers,
+        save_metrics=save_metrics,
+        cache_dir=cache_dir,
+        resume=resume,
+    ) as run:
+        paths = tuple(p for p in list_images(img_dir) if not run.is_done(p))
+        run.process(paths)
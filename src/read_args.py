@@ -3,11 +3,63 @@ import sys
 import os
 import glob
 import logging
+from typing import List, Optional, Tuple
 
+from .cache import default_cache_dir
 
-def read_args():
+IMG_EXT = (
+    ".jpg",
+    ".JPG",
+    ".jpeg",
+    ".JPEG",
+    ".png",
+    ".PNG",
+    ".bmp",
+    ".gif",
+    ".tif",
+    ".tiff",
+)
+
+
+def find_baseimg(img_dir: str) -> Optional[str]:
     """
-    Read argument.
+    The default base image: the first image of img_dir in the lexicographic order.
+
+    Parameters
+    ----------
+    img_dir : str
+        The directory of the images.
+
+    Returns
+    -------
+    str | None
+        None if there are no images.
+    """
+    baseimg_paths = glob.glob(os.path.join(img_dir, "*"))
+    baseimg_paths = tuple(
+        sorted(
+            [p for p in baseimg_paths if os.path.splitext(p)[1] in IMG_EXT],
+            key=lambda x: os.path.splitext(x)[0],
+        )
+    )
+    if not baseimg_paths:
+        return None
+    return baseimg_paths[0]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments.
+
+    Parameters
+    ----------
+    argv : List[str] | None, optional
+        Arguments, by default None (sys.argv).
+
+    Returns
+    -------
+    argparse.Namespace
+        If args.img_dir or args.jobs is given, the paths are not asked interactively.
     """
 
     parser = argparse.ArgumentParser()
@@ -27,8 +79,121 @@ def read_args():
         default=logging.WARN,
         help="Set file log level.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Set the number of worker processes.",
+    )
+    parser.add_argument(
+        "-p",
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Set the number of images decoded ahead in background threads.",
+    )
+    parser.add_argument(
+        "-s",
+        "--save_workers",
+        type=int,
+        default=0,
+        help="Set the number of threads writing the images (with 1 worker process).",
+    )
+    parser.add_argument(
+        "-m",
+        "--metrics",
+        action="store_true",
+        help="Save the per-stage timings and the metrics summary.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=default_cache_dir(),
+        help="Set the directory where the compiled settings are cached.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_const",
+        const=None,
+        dest="cache_dir",
+        help="Parse the setting file without the cache.",
+    )
+    parser.add_argument(
+        "--no_resume",
+        action="store_false",
+        dest="resume",
+        help="Process all the images again instead of resuming the saved run.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep watching the folder and process the new images.",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Set the seconds between the scans of the watched folder.",
+    )
+    parser.add_argument(
+        "--stable_seconds",
+        type=float,
+        default=2.0,
+        help="Set the seconds a new file must be unchanged before processing.",
+    )
+    parser.add_argument(
+        "--img_dir",
+        default=None,
+        help="Set the folder of the images. The paths are not asked interactively.",
+    )
+    parser.add_argument(
+        "--setting",
+        default="setting.xlsx",
+        help="Set the setting file used with --img_dir.",
+    )
+    parser.add_argument(
+        "--save_dir",
+        default=None,
+        help="Set the save folder used with --img_dir, by default IMG_DIR_processed.",
+    )
+    parser.add_argument(
+        "--base",
+        default=None,
+        help="Set the base image used with --img_dir, by default the first image.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=None,
+        help="Run the jobs of a json file in one process. See src/batch.py.",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        help="Save the throughput report of --jobs as json.",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs and args.img_dir:
+        parser.error("--jobs and --img_dir cannot be used together.")
+    if args.jobs and args.watch:
+        parser.error("--jobs and --watch cannot be used together.")
+    return args
+
+
+def read_paths(resume: bool = True) -> Tuple[str, str, str, str]:
+    """
+    Ask the paths interactively.
+
+    Parameters
+    ----------
+    resume : bool, optional
+        Whether the run in the existing save folder is resumed, by default True.
+        This changes the confirmation of an existing save folder.
 
+    Returns
+    -------
+    img_dir, metadata_path, save_dir, baseimg_path : str, str, str, str
+    """
     while True:
         img_dir = input("対象となるフォルダ名を相対パスで指定してください。\n:")
         if img_dir:
@@ -54,48 +219,41 @@ def read_args():
         if not save_dir:
             save_dir = save_dir_default
         if os.path.exists(save_dir):
-            yn = input("既に存在するパスを指定しています。画像データは上書きされますが、よろしいですか？(y/n):")
+            if resume:
+                message = "既に存在するパスを指定しています。処理済みの画像は飛ばして続きから処理し、変更された画像は処理し直して結果を置き換えます (最初から処理し直すには --no_resume を指定してください)。よろしいですか？(y/n):"
+            else:
+                message = "既に存在するパスを指定しています。画像データは上書きされますが、よろしいですか？(y/n):"
+            yn = input(message)
             if yn == "y":
                 break
         else:
             break
 
     baseimg_path_default = "対象フォルダのうち，辞書順でもっとも最初の画像"
-    img_ext = (
-        ".jpg",
-        ".JPG",
-        ".jpeg",
-        ".JPEG",
-        ".png",
-        ".PNG",
-        ".bmp",
-        ".gif",
-        ".tif",
-        ".tiff",
-    )
     while True:
         baseimg_path = input(
             f"位置合わせの基準となる画像のパスを指定してください。位置合わせを行わない場合，単にエンターを押してください。デフォルト:{baseimg_path_default}\n:"
         )
         if not baseimg_path:
-            baseimg_paths = glob.glob(os.path.join(img_dir, "*"))
-            baseimg_paths = tuple(
-                sorted(
-                    [p for p in baseimg_paths if os.path.splitext(p)[1] in img_ext],
-                    key=lambda x: os.path.splitext(x)[0],
-                )
-            )
-            if not baseimg_paths:
-                print(f"{img_dir}に画像{img_ext}が存在しないため，処理を終了します。")
+            baseimg_path = find_baseimg(img_dir)
+            if baseimg_path is None:
+                print(f"{img_dir}に画像{IMG_EXT}が存在しないため，処理を終了します。")
                 sys.exit()
-            baseimg_path = baseimg_paths[0]
             break
-        if not os.path.splitext(baseimg_path)[-1] in img_ext:
-            print(f"{baseimg_path}は画像ではありません。画像は拡張子{img_ext}まで指定してください。")
+        if not os.path.splitext(baseimg_path)[-1] in IMG_EXT:
+            print(f"{baseimg_path}は画像ではありません。画像は拡張子{IMG_EXT}まで指定してください。")
             continue
         if not os.path.exists(baseimg_path):
             print(f"{baseimg_path}が存在しません。正しいパスを指定してください。")
             continue
         break
 
-    return args, img_dir, metadata_path, save_dir, baseimg_path
+    return img_dir, metadata_path, save_dir, baseimg_path
+
+
+def read_args():
+    """
+    Read argument.
+    """
+    args = parse_args()
+    return (args,) + read_paths(args.resume)
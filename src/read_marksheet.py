@@ -1,18 +1,244 @@
+import copy
 import numpy as np
 import cv2
+import json
 import logging
-from typing import Union, Optional
+from typing import Union, Optional, Tuple, List
+
+from .imgproc import gaussian_kernel_radius
+from .metrics import NULL_TIMER
 
 logger = logging.getLogger("adjust-scan-images")
 
 
+class SheetLayout:
+    """
+    Compiled marksheet layout.
+
+    Note
+    ----------
+    The marks are kept in flat arrays. The marks of the i-th category are
+    coords[offsets[i]:offsets[i + 1]] and their values are values[offsets[i]:offsets[i + 1]].
+    Every category must have at least one mark.
+
+    coords == int32 array of (x, y, w, h), shape == (n_marks, 4).
+    regions == [(x1, y1, x2, y2), ...], the merged marks padded by pad.
+    region_idxs == int32 array of the region index of each mark.
+    """
+
+    def __init__(self, sheet: dict, pad: int = 0):
+        """
+        Parameters
+        ----------
+        sheet : dict
+            bbox sheet data: Dict[category, Dict[value, (x, y, w, h)]].
+        pad : int, optional
+            Padding of each mark for preprocess, by default 0.
+        """
+        self.categories = tuple(sheet.keys())
+        counts = [len(values) for values in sheet.values()]
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+        self.values = np.empty(self.offsets[-1], dtype=object)
+        self.values[:] = [value for values in sheet.values() for value in values]
+        self.coords = np.array(
+            [coord for values in sheet.values() for coord in values.values()],
+            dtype=np.int32,
+        ).reshape(-1, 4)
+        self.pad = pad
+        self.regions, self.region_idxs = self._build_regions(self.coords, pad)
+        self._gather_cache: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    @staticmethod
+    def _build_regions(
+        coords: np.ndarray, pad: int
+    ) -> Tuple[List[Tuple[int, int, int, int]], np.ndarray]:
+        """
+        Merge the padded marks into the regions to preprocess.
+
+        Parameters
+        ----------
+        coords : np.ndarray
+            (x, y, w, h) of the marks.
+        pad : int
+            Padding of each mark.
+
+        Returns
+        -------
+        regions, region_idxs : (List[(x1, y1, x2, y2)], np.ndarray)
+            The regions and the region index of each mark.
+        """
+        boxes = [
+            (x - pad, y - pad, x + w + pad, y + h + pad)
+            for x, y, w, h in coords.tolist()
+        ]
+        regions = list(boxes)
+        # merge overlapped regions until there is no overlap.
+        is_merged = True
+        while is_merged:
+            is_merged = False
+            merged: List[Tuple[int, int, int, int]] = []
+            for r in regions:
+                for i, q in enumerate(merged):
+                    if r[0] < q[2] and q[0] < r[2] and r[1] < q[3] and q[1] < r[3]:
+                        merged[i] = (
+                            min(r[0], q[0]),
+                            min(r[1], q[1]),
+                            max(r[2], q[2]),
+                            max(r[3], q[3]),
+                        )
+                        is_merged = True
+                        break
+                else:
+                    merged.append(r)
+            regions = merged
+        region_idxs = np.zeros(len(boxes), dtype=np.int32)
+        for j, (x1, y1, x2, y2) in enumerate(boxes):
+            for i, (rx1, ry1, rx2, ry2) in enumerate(regions):
+                if rx1 <= x1 and ry1 <= y1 and x2 <= rx2 and y2 <= ry2:
+                    region_idxs[j] = i
+                    break
+        return regions, region_idxs
+
+    def transformed(self, M: np.ndarray) -> "SheetLayout":
+        """
+        Map the marks by an affine matrix.
+
+        The center of each mark is mapped by M, and the width and the height
+        are scaled by the scale of M. The marks stay axis-aligned.
+
+        Parameters
+        ----------
+        M : np.ndarray
+            2x3 affine matrix.
+
+        Returns
+        -------
+        SheetLayout
+            The layout in the mapped coords.
+        """
+        layout = copy.copy(self)
+        x, y, w, h = self.coords.astype(np.float64).T
+        cx, cy = x + w / 2, y + h / 2
+        mx = M[0, 0] * cx + M[0, 1] * cy + M[0, 2]
+        my = M[1, 0] * cx + M[1, 1] * cy + M[1, 2]
+        mw = w * np.hypot(M[0, 0], M[1, 0])
+        mh = h * np.hypot(M[0, 1], M[1, 1])
+        layout.coords = np.rint(
+            np.stack((mx - mw / 2, my - mh / 2, mw, mh), axis=1)
+        ).astype(np.int32)
+        layout.regions, layout.region_idxs = self._build_regions(
+            layout.coords, self.pad
+        )
+        layout._gather_cache = {}
+        return layout
+
+    def gather_indices(
+        self, preprocessed: Tuple[Tuple[int, int], List[tuple]]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The corner indices of the marks in the concatenated integral images.
+
+        Parameters
+        ----------
+        preprocessed : ((int, int), List[(int, int, np.ndarray)])
+            The image shape and the preprocessed regions (x, y, patch).
+
+        Returns
+        -------
+        (i00, i01, i10, i11, area) : Tuple[np.ndarray, ...]
+            The flat indices of the top-left, top-right, bottom-left and bottom-right
+            corners, and the area of each mark. They are cached by the image shape.
+        """
+        (ih, iw), patches = preprocessed
+        if (ih, iw) in self._gather_cache:
+            return self._gather_cache[(ih, iw)]
+        px = np.array([p[0] for p in patches], dtype=np.int64)
+        py = np.array([p[1] for p in patches], dtype=np.int64)
+        ph = np.array([p[2].shape[0] for p in patches], dtype=np.int64)
+        pw = np.array([p[2].shape[1] for p in patches], dtype=np.int64)
+        # the integral image of a (h, w) patch has the shape (h + 1, w + 1).
+        sizes = (ph + 1) * (pw + 1)
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+        r = self.region_idxs
+        x, y, w, h = self.coords.astype(np.int64).T
+        x1 = np.clip(x - px[r], 0, pw[r])
+        y1 = np.clip(y - py[r], 0, ph[r])
+        x2 = np.clip(np.minimum(x + w, iw) - px[r], 0, pw[r])
+        y2 = np.clip(np.minimum(y + h, ih) - py[r], 0, ph[r])
+        # empty marks have area 0 and get nan like np.mean.
+        area = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+        stride = pw[r] + 1
+        base = offsets[r]
+        indices = (
+            base + y1 * stride + x1,
+            base + y1 * stride + x2,
+            base + y2 * stride + x1,
+            base + y2 * stride + x2,
+            area,
+        )
+        self._gather_cache[(ih, iw)] = indices
+        return indices
+
+    def decide(
+        self, scores: np.ndarray, threshold: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Choose the value of the maximum score of each category at once.
+
+        Parameters
+        ----------
+        scores : np.ndarray
+            Scores of all the marks.
+        threshold : float | None, optional
+            If the maximum score of a category <= threshold, the value is None,
+            by default None (no threshold).
+
+        Returns
+        -------
+        np.ndarray
+            The chosen values of the categories (dtype == object).
+        """
+        starts = self.offsets[:-1]
+        max_scores = np.maximum.reduceat(scores, starts)
+        # the first index of the maximum like np.argmax (nan is the maximum).
+        is_max = (scores == np.repeat(max_scores, np.diff(self.offsets))) | np.isnan(
+            scores
+        )
+        idxs = np.minimum.reduceat(
+            np.where(is_max, np.arange(len(scores)), len(scores)), starts
+        )
+        chosen = self.values[idxs]
+        if threshold is not None:
+            with np.errstate(invalid="ignore"):
+                chosen[max_scores <= threshold] = None
+        return chosen
+
+    def to_dict(self, array: np.ndarray) -> dict:
+        """
+        Flat array of the marks -> Dict[category, Dict[value, element]].
+        """
+        return {
+            category: dict(
+                zip(
+                    self.values[self.offsets[i] : self.offsets[i + 1]],
+                    array[self.offsets[i] : self.offsets[i + 1]],
+                )
+            )
+            for i, category in enumerate(self.categories)
+        }
+
+
 class MarkReader:
     """
     Mark Sheet Reader.
 
     Note
     ----------
-    IMAGES MUST HAVE BEEN ALREADY ADJUSTED.
+    IMAGES MUST HAVE BEEN ALREADY ADJUSTED, or the affine matrix must be given to read().
     metadata must have 'sheet' key.
     And you can set 'sheet_coord_style', 'sheet_gaussian_ksize', 'sheet_gaussian_std', 'sheet_score_threshold' keys.
 
@@ -31,6 +257,15 @@ class MarkReader:
     metadata['sheet_gaussian_ksize'] == int (default == 0).
     metadata['sheet_gaussian_std'] == int (default == 0).
     metadata['sheet_score_threshold'] == float (default == 0).
+    metadata['sheet_score_backend'] == 'integral' | 'mean' (default == 'integral').
+
+    Only the regions around the marks are blurred.
+    The regions are padded by the Gaussian kernel radius,
+    so the scores are the same as preprocessing the whole image.
+    With the 'integral' backend, the means of all the marks are computed at once
+    from the integral images of the regions.
+    The sheet is compiled to SheetLayout, and all the categories are decided
+    by one segmented reduction.
     """
 
     def __init__(self, metadata: dict):
@@ -55,8 +290,15 @@ class MarkReader:
         self.g_ksize: int = self.metadata.get("sheet_gaussian_ksize", 0)
         self.g_std: int = self.metadata.get("sheet_gaussian_std", 0)
         self.threshold: int = self.metadata.get("sheet_score_threshold", 0)
+        self.pad = gaussian_kernel_radius(self.g_ksize, self.g_std)
+        self.score_backend: str = self.metadata.get("sheet_score_backend", "integral")
+        self.layout = SheetLayout(self.sheet, self.pad)
+        logger.debug(f"MarkReader: Preprocess regions: {self.layout.regions}")
         self.is_fitted = False
         self.base_scores = None
+        self.base_score_vector = None
+        # set a StageTimer to measure the stages.
+        self.timer = NULL_TIMER
 
     @staticmethod
     def rect2bbox(sheet_metadata: dict) -> dict:
@@ -104,7 +346,9 @@ class MarkReader:
             rect_dict[category] = new_values
         return rect_dict
 
-    def _preprocess(self, img: np.ndarray) -> np.ndarray:
+    def _preprocess(
+        self, img: np.ndarray, layout: SheetLayout
+    ) -> Tuple[Tuple[int, int], List[tuple]]:
         """
         Image preprocess to read mark sheet.
 
@@ -112,76 +356,113 @@ class MarkReader:
         ----------
         img : np.ndarray
             An image.
+        layout : SheetLayout
+            The layout of the marks in img.
 
         Returns
         -------
-        np.ndarray
-            The processed image.
+        (ih, iw), patches : ((int, int), List[(int, int, np.ndarray)])
+            The image shape and the processed regions (x, y, patch),
+            where (x, y) is the top-left coord of the patch.
         """
-        blur = cv2.GaussianBlur(img, (self.g_ksize, self.g_ksize), self.g_std)
-        preprocessed = cv2.bitwise_not(blur)
+        ih, iw = img.shape
+        patches = []
+        for x1, y1, x2, y2 in layout.regions:
+            x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, iw), min(y2, ih)
+            roi = img[y1:y2, x1:x2]
+            if roi.size:
+                blur = cv2.GaussianBlur(roi, (self.g_ksize, self.g_ksize), self.g_std)
+                roi = cv2.bitwise_not(blur, dst=blur)
+            patches.append((x1, y1, roi))
         logger.debug("MarkReader: Preprocess ended.")
-        return preprocessed
+        return (ih, iw), patches
 
-    def _one_mark_score(
-        self, img: np.ndarray, coords: dict, base_score: Optional[dict] = None
-    ) -> dict:
+    def _integral_scores(
+        self, preprocessed: Tuple[Tuple[int, int], List[tuple]], layout: SheetLayout
+    ) -> np.ndarray:
         """
-        Read one mark score.
+        Scores of all the marks by the integral images of the patches.
 
         Parameters
         ----------
-        img : np.ndarray
-            An image.
-        coords : dict
-            Coords data: Dict[value, (x, y, w, h)]
-        base_score : Union[dict, None], optional
-            fit score, by default None
+        preprocessed : ((int, int), List[(int, int, np.ndarray)])
+            The result of _preprocess.
+        layout : SheetLayout
+            The layout used by _preprocess.
 
         Returns
         -------
-        dict
-            Dict of scores: Dict[value, float].
+        np.ndarray
+            The mean of each mark, in the order of layout.
         """
-        scores = {}
-        ih, iw = img.shape
-        for value, (x, y, w, h) in coords.items():
-            score = np.mean(img[y : min(y + h, ih), x : min(x + w, iw)])
-            if base_score is not None:
-                score -= base_score[value]
-            scores[value] = score
-        return scores
+        _, patches = preprocessed
+        # float64 sums of uint8 are exact, so the means are the same as np.mean.
+        table = np.concatenate(
+            [
+                (
+                    cv2.integral(patch, sdepth=cv2.CV_64F).ravel()
+                    if patch.size
+                    else np.zeros((patch.shape[0] + 1) * (patch.shape[1] + 1))
+                )
+                for _, _, patch in patches
+            ]
+        )
+        i00, i01, i10, i11, area = layout.gather_indices(preprocessed)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (table[i11] - table[i01] - table[i10] + table[i00]) / area
 
-    def _one_mark(
-        self, img: np.ndarray, coords: dict, base_score: Optional[dict] = None
-    ) -> Union[None, str]:
+    def _mean_scores(
+        self, preprocessed: Tuple[Tuple[int, int], List[tuple]], layout: SheetLayout
+    ) -> np.ndarray:
         """
-        Read one category.
+        Scores of all the marks by np.mean of each mark.
 
         Parameters
         ----------
-        img : np.ndarray
-            An image.
+        preprocessed : ((int, int), List[(int, int, np.ndarray)])
+            The result of _preprocess.
+        layout : SheetLayout
+            The layout used by _preprocess.
 
-        coords : dict
-            The place of marks.
+        Returns
+        -------
+        np.ndarray
+            The mean of each mark, in the order of layout.
+        """
+        (ih, iw), patches = preprocessed
+        scores = np.empty(len(layout))
+        for i, (x, y, w, h) in enumerate(layout.coords.tolist()):
+            px, py, patch = patches[layout.region_idxs[i]]
+            scores[i] = np.mean(
+                patch[y - py : min(y + h, ih) - py, x - px : min(x + w, iw) - px]
+            )
+        return scores
+
+    def _scores(
+        self, preprocessed: Tuple[Tuple[int, int], List[tuple]], layout: SheetLayout
+    ) -> np.ndarray:
+        """
+        Scores of all the marks. If fitted, the base scores are subtracted.
+
+        Parameters
+        ----------
+        preprocessed : ((int, int), List[(int, int, np.ndarray)])
+            The result of _preprocess.
+        layout : SheetLayout
+            The layout used by _preprocess.
 
         Returns
         -------
-        str
-            A value.
-        """
-        score_dict = self._one_mark_score(img, coords, base_score)
-        logger.debug(f"Marksheet scores: {score_dict}")
-        values, scores = tuple(score_dict.keys()), tuple(score_dict.values())
-        max_score = np.max(scores)
-        if self.is_fitted and max_score <= self.threshold:
-            value = None
+        np.ndarray
+            Scores in the order of layout.
+        """
+        if self.score_backend == "mean":
+            scores = self._mean_scores(preprocessed, layout)
         else:
-            idx = np.argmax(scores)
-            value = values[idx]
-        logger.debug(f"Chosen value: {value}")
-        return value
+            scores = self._integral_scores(preprocessed, layout)
+        if self.is_fitted:
+            scores -= self.base_score_vector
+        return scores
 
     def fit(self, img: np.ndarray):
         """
@@ -195,15 +476,20 @@ class MarkReader:
         if not self.is_sheet:
             logger.debug("MarkReader: Fit skipped since there is no marksheet data.")
             return None
-        preprocessed = self._preprocess(img)
-        self.base_scores = {}
-        for category, coords in self.sheet.items():
-            score_dict = self._one_mark_score(preprocessed, coords)
-            self.base_scores[category] = score_dict
+        self.is_fitted = False
+        self.base_score_vector = self._scores(
+            self._preprocess(img, self.layout), self.layout
+        )
+        self.base_scores = self.layout.to_dict(self.base_score_vector)
         logger.debug(f"ImageAligner: Fit is completed, base_scores: {self.base_scores}")
         self.is_fitted = True
 
-    def read(self, img: np.ndarray) -> dict:
+    def read(
+        self,
+        img: np.ndarray,
+        return_scores: bool = False,
+        affine: Optional[np.ndarray] = None,
+    ) -> Union[dict, Tuple[dict, np.ndarray]]:
         """
         Read marks of an image.
 
@@ -211,22 +497,124 @@ class MarkReader:
         ----------
         img : np.ndarray
             An image.
+        return_scores : bool, optional
+            If True, also return the scores of all the marks, by default False.
+            The scores are in the order of self.layout, and the base scores are
+            subtracted if fitted.
+        affine : np.ndarray | None, optional
+            2x3 affine matrix from img to the adjusted image (ImageAligner.estimate),
+            by default None. If given, img need not be adjusted.
+            The marks are mapped into img by the inverse matrix and read there,
+            so the image is not warped.
 
         Returns
         -------
-        dict
-            Values.
+        dict or (dict, np.ndarray)
+            Values, or values and scores.
         """
         if not self.is_sheet:
             logger.debug("MarkReader: Read skipped since there is no marksheet data.")
-            return {}
-        preprocessed = self._preprocess(img)
-        mark = {}
-        for category, coords in self.sheet.items():
-            if self.is_fitted:
-                value = self._one_mark(preprocessed, coords, self.base_scores[category])
-            else:
-                value = self._one_mark(preprocessed, coords)
-            mark[category] = value
+            return ({}, np.empty(0)) if return_scores else {}
+        layout = self.layout
+        if affine is not None:
+            layout = layout.transformed(cv2.invertAffineTransform(affine))
+        with self.timer.stage("sheet_preprocess"):
+            preprocessed = self._preprocess(img, layout)
+        with self.timer.stage("scoring"):
+            scores = self._scores(preprocessed, layout)
+            chosen = self.layout.decide(
+                scores, self.threshold if self.is_fitted else None
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Marksheet scores: {self.layout.to_dict(scores)}")
+        mark = dict(zip(self.layout.categories, chosen.tolist()))
         logger.debug(f"Mark read result: {mark}")
+        if return_scores:
+            return mark, scores
         return mark
+
+    def _params(self) -> dict:
+        """
+        The effective parameters that the fitted state depends on.
+        """
+        return {
+            "sheet_gaussian_ksize": self.g_ksize,
+            "sheet_gaussian_std": self.g_std,
+            "sheet_score_backend": self.score_backend,
+            "categories": list(self.layout.categories),
+            "values": self.layout.values.tolist(),
+            "coords": self.layout.coords.tolist(),
+        }
+
+    def get_state(self) -> dict:
+        """
+        The fitted state as json serializable data.
+
+        Returns
+        -------
+        dict
+            {"params": effective parameters, "base_scores": scores or None},
+            where the scores are in the order of self.layout.
+        """
+        return {
+            "params": self._params(),
+            "base_scores": (
+                self.base_score_vector.tolist() if self.is_fitted else None
+            ),
+        }
+
+    def set_state(self, state: dict):
+        """
+        Restore the fitted state from get_state().
+
+        Parameters
+        ----------
+        state : dict
+            The result of get_state().
+
+        Raises
+        ------
+        ValueError
+            If the state was fitted with other parameters.
+        """
+        if state["params"] != json.loads(json.dumps(self._params())):
+            raise ValueError("MarkReader: The state has other parameters.")
+        if state["base_scores"] is None:
+            self.is_fitted = False
+            self.base_score_vector = None
+            self.base_scores = None
+            return
+        self.base_score_vector = np.array(state["base_scores"], dtype=np.float64)
+        assert len(self.base_score_vector) == len(self.layout), "Invalid base_scores."
+        self.base_scores = self.layout.to_dict(self.base_score_vector)
+        self.is_fitted = True
+        logger.debug(f"MarkReader: State loaded, base_scores: {self.base_scores}")
+
+    def save(self, path: str):
+        """
+        Save the fitted state as json.
+
+        Parameters
+        ----------
+        path : str
+            File path.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.get_state(), f)
+
+    def load(self, path: str):
+        """
+        Load the fitted state saved by save().
+
+        Parameters
+        ----------
+        path : str
+            File path.
+
+        Raises
+        ------
+        ValueError
+            If the state was fitted with other parameters.
+        """
+        with open(path, encoding="utf-8") as f:
+            self.set_state(json.load(f))
@@ -1,5 +1,5 @@
+import os
 import csv
-from openpyxl import load_workbook
 from collections import defaultdict
 import logging
 from typing import Iterable, Optional
@@ -52,6 +52,9 @@ def read_metadata(
     """
     metadata = {}
     if filepath:
+        # openpyxl is imported only when a workbook is parsed.
+        from openpyxl import load_workbook
+
         wb = load_workbook(filepath, read_only=True)
         ws = wb[excel_sheet_name]
         for row in ws.iter_rows(min_row=3):
@@ -123,6 +126,8 @@ def read_marksheet_setting(
     dict
         Marksheet data.
     """
+    from openpyxl import load_workbook
+
     wb = load_workbook(filepath, read_only=True)
     ws = wb[excel_sheet_name]
     marks = defaultdict(dict)
@@ -140,7 +145,7 @@ class MarksheetResultWriter:
     Write the marksheet result to a csv file.
     """
 
-    def __init__(self, filepath: str, header: Iterable[str]):
+    def __init__(self, filepath: str, header: Iterable[str], write_header: bool = True):
         """
         Parameters
         ----------
@@ -148,11 +153,16 @@ class MarksheetResultWriter:
             Csv file path.
         header : Iterable[str]
             Header.
+        write_header : bool, optional
+            If False, the rows are appended to the existing file without the header,
+            by default True.
         """
+        self.filepath = filepath
         self.f = open(filepath, "a", encoding="shift_jis", newline="")
         self.is_open = True
         self.writer = csv.DictWriter(self.f, header, extrasaction="ignore")
-        self.writer.writeheader()
+        if write_header:
+            self.writer.writeheader()
 
     def write_one_dict(self, data: dict):
         """
@@ -165,6 +175,49 @@ class MarksheetResultWriter:
         """
         self.writer.writerow(data)
 
+    def remove_row(self, data: dict) -> bool:
+        """
+        Remove the last written row which has the values of data.
+        The file is rewritten (e.g. to replace a row of a resumed run).
+
+        Parameters
+        ----------
+        data : dict
+            Dict[header, value]. The values are compared as str.
+
+        Returns
+        -------
+        bool
+            Whether a row is removed.
+        """
+        fieldnames = self.writer.fieldnames
+        self.f.close()
+        try:
+            with open(self.filepath, encoding="shift_jis", newline="") as f:
+                rows = list(csv.DictReader(f))
+            for i in reversed(range(len(rows))):
+                if all(rows[i].get(k) == str(v) for k, v in data.items()):
+                    break
+            else:
+                return False
+            del rows[i]
+            tmp_path = f"{self.filepath}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="shift_jis", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(tmp_path, self.filepath)
+            return True
+        finally:
+            self.f = open(self.filepath, "a", encoding="shift_jis", newline="")
+            self.writer = csv.DictWriter(self.f, fieldnames, extrasaction="ignore")
+
+    def flush(self):
+        """
+        Flush the written rows to the file.
+        """
+        self.f.flush()
+
     def close(self):
         """
         Close file.
@@ -1,8 +1,13 @@
-from openpyxl import load_workbook
 import os
+import copy
 from collections import defaultdict
 import logging
-from typing import Iterable, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .cache import read_json_cache, write_json_cache
+from .errors import SettingError
+from .hashing import file_hash, data_hash
+from .pages import split_page, is_pdf
 
 logger = logging.getLogger("adjust-scan-images")
 
@@ -19,10 +24,17 @@ SETTING_KEYS_DEFAULT = {
     "sheet_score_threshold": 0,  # float
     "sheet_gaussian_ksize": 15,  # int
     "sheet_gaussian_std": 3,  # int
+    "is_save_image": 1,  # 0 | 1
 }
 
 MARK_CATEGORIES = ("room", "class", "student_number_10", "student_number_1")
 
+# Increment this when the compiled form of the settings changes.
+SETTINGS_CACHE_VERSION = 2
+
+# compiled settings memo of this process. key -> settings
+_SETTINGS_MEMO: Dict[str, dict] = {}
+
 
 def read_metadata(
     filepath: Optional[str] = None,
@@ -51,6 +63,9 @@ def read_metadata(
     """
     metadata = {}
     if filepath:
+        # openpyxl is imported only when a workbook is parsed.
+        from openpyxl import load_workbook
+
         wb = load_workbook(filepath, read_only=True)
         if excel_sheet_name in wb:
             logger.debug(f"We found the sheet {excel_sheet_name}.")
@@ -81,6 +96,14 @@ def read_metadata(
         (-v, 0, v, v),
     )
     metadata["is_align"] = int(metadata["is_align"])
+    if metadata.get("marker_search_scale") is not None:
+        metadata["marker_search_scale"] = int(metadata["marker_search_scale"])
+    if "blank_page_action" in metadata and metadata["blank_page_action"] is None:
+        # an empty cell is the default.
+        metadata["blank_page_action"] = "none"
+    for key in ("blank_ink_ratio", "form_ink_ratio"):
+        if metadata.get(key) is not None:
+            metadata[key] = float(metadata[key])
     metadata["marker_gaussian_ksize"] = int(
         int(metadata["marker_gaussian_ksize"]) * scale
     )
@@ -92,6 +115,7 @@ def read_metadata(
         int(metadata["sheet_gaussian_ksize"]) * scale
     )
     metadata["sheet_gaussian_std"] = int(int(metadata["sheet_gaussian_std"]) * scale)
+    metadata["is_save_image"] = int(metadata["is_save_image"])
     logger.debug(f"Metadata formatted: {metadata}")
 
     return metadata
@@ -126,6 +150,8 @@ def read_marksheet_setting(
     """
     if not filepath or not categories:
         return {}
+    from openpyxl import load_workbook
+
     wb = load_workbook(filepath, read_only=True, data_only=True)
 
     if not pt2px:
@@ -151,6 +177,240 @@ def read_marksheet_setting(
     return marks
 
 
+def read_output_variants(
+    filepath: Optional[str], excel_sheet_name: str = "output_variants"
+) -> List[dict]:
+    """
+    Read the settings of the derived outputs.
+
+    The first row of the sheet is the header and each row below is one variant,
+    e.g. name | dir | scale | max_size | output_format | jpeg_quality.
+    See OutputVariant. The empty cells are omitted.
+
+    Parameters
+    ----------
+    filepath : str | None
+        Setting file path.
+    excel_sheet_name : str, optional
+        Excel sheet name, by default "output_variants"
+
+    Returns
+    -------
+    List[dict]
+        The variants. Empty if there is not the sheet.
+    """
+    if not filepath:
+        return []
+    from openpyxl import load_workbook
+
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    if excel_sheet_name not in wb:
+        return []
+    rows = wb[excel_sheet_name].iter_rows(values_only=True)
+    header = next(rows, None) or ()
+    variants = []
+    for row in rows:
+        variant = {
+            k: v for k, v in zip(header, row) if k is not None and v not in (None, "")
+        }
+        if variant:
+            variants.append(variant)
+    logger.info(f"Output variants loaded: {variants}")
+    return variants
+
+
+def validate_settings(settings: dict):
+    """
+    Validate the compiled settings.
+
+    Parameters
+    ----------
+    settings : dict
+        Metadata (and "sheet" if is_marksheet).
+
+    Raises
+    ------
+    SettingError
+        If a value is invalid.
+    """
+
+    def check(cond: bool, message: str):
+        if not cond:
+            logger.error(f"Invalid setting: {message}")
+            raise SettingError(message)
+
+    check(settings["resize_ratio"] > 0, "resize_ratio must be positive.")
+    check(settings["coord_unit"] in ("pt", "px"), "coord_unit must be pt or px.")
+    check(
+        settings["sheet_coord_style"] in ("rect", "bbox", "circle"),
+        "sheet_coord_style must be rect, bbox or circle.",
+    )
+    blank_page_action = settings.get("blank_page_action", "none")
+    if blank_page_action != "none":
+        # cv2 is imported only when the pages are classified.
+        from .classify_pages import BLANK_PAGE_ACTIONS
+
+        check(
+            blank_page_action in BLANK_PAGE_ACTIONS,
+            f"blank_page_action must be one of {', '.join(BLANK_PAGE_ACTIONS)}.",
+        )
+    for key in ("blank_ink_ratio", "form_ink_ratio"):
+        check(0 <= settings.get(key, 0) < 1, f"{key} must be in [0, 1).")
+    if settings["is_save_image"]:
+        # raises SettingError
+        from .output_format import OutputFormat, OutputVariant
+
+        OutputFormat.from_metadata(settings)
+        names = [
+            OutputVariant.from_setting(v).name for v in settings.get("variants", [])
+        ]
+        check(len(set(names)) == len(names), "The variant names must be unique.")
+    stages = []
+    if settings["is_align"]:
+        check(
+            settings["marker_range"][0][2] > 0,
+            "marker_range must be positive after resizing.",
+        )
+        scale = settings.get("marker_search_scale", 1)
+        check(
+            isinstance(scale, int) and scale >= 0,
+            "marker_search_scale must be 0 (auto) or a positive integer.",
+        )
+        # cv2 is imported with the aligner anyway.
+        from .align_images import MARKER_BACKENDS
+
+        check(
+            settings.get("marker_backend", "contour") in MARKER_BACKENDS,
+            f"marker_backend must be one of {', '.join(MARKER_BACKENDS)}.",
+        )
+        stages.append("marker")
+    if settings["is_marksheet"]:
+        stages.append("sheet")
+    for stage in stages:
+        ksize = settings[f"{stage}_gaussian_ksize"]
+        std = settings[f"{stage}_gaussian_std"]
+        check(
+            ksize == 0 or (ksize > 0 and ksize % 2 == 1),
+            f"{stage}_gaussian_ksize must be 0 or odd after resizing, but {ksize}.",
+        )
+        check(
+            ksize > 0 or std > 0,
+            f"{stage}_gaussian_ksize or {stage}_gaussian_std must be positive.",
+        )
+    for category, marks in settings.get("sheet", {}).items():
+        for value, coords in marks.items():
+            check(
+                len(coords) == 4 and all(isinstance(z, int) for z in coords),
+                f"The coords of {category}={value} must be 4 integers: {coords}",
+            )
+
+
+def _compile_settings(filepath: Optional[str], dpi: Tuple[int, int]) -> dict:
+    """
+    Parse the setting file and validate it.
+    """
+    settings = read_metadata(filepath, pt2px=dpi[0])
+    if settings["is_marksheet"]:
+        pt2px = dpi[0] if settings["coord_unit"] == "pt" else None
+        settings["sheet"] = read_marksheet_setting(
+            filepath, settings["resize_ratio"], pt2px=pt2px
+        )
+    variants = read_output_variants(filepath)
+    if variants:
+        settings["variants"] = variants
+    validate_settings(settings)
+    return settings
+
+
+def _settings_to_json(settings: dict) -> dict:
+    """
+    Json form of the compiled settings.
+    The sheet is a list to keep the types of the mark values.
+    """
+    data = dict(settings)
+    if "sheet" in data:
+        data["sheet"] = [
+            [category, [[value, coords] for value, coords in marks.items()]]
+            for category, marks in settings["sheet"].items()
+        ]
+    return data
+
+
+def _settings_from_json(data: dict) -> dict:
+    """
+    Restore the compiled settings from the json form.
+    """
+    settings = dict(data)
+    settings["marker_range"] = tuple(tuple(r) for r in data["marker_range"])
+    if "sheet" in data:
+        settings["sheet"] = {
+            category: {value: tuple(coords) for value, coords in marks}
+            for category, marks in data["sheet"]
+        }
+    return settings
+
+
+def load_settings(
+    filepath: Optional[str],
+    dpi: Tuple[int, int],
+    cache_dir: Optional[str] = None,
+) -> dict:
+    """
+    Load the compiled settings: the formatted metadata and,
+    if is_marksheet, the marksheet setting in pixels as settings["sheet"].
+
+    The settings are compiled once and reused from the memo of this process
+    or from cache_dir. The key is the content hash of the setting file and dpi.
+    resize_ratio is determined by the file, so the hash covers it.
+
+    Parameters
+    ----------
+    filepath : str | None
+        Setting file path. If None, the default settings.
+    dpi : Tuple[int, int]
+        dpi of the base image (before resizing).
+    cache_dir : str | None, optional
+        The directory of the compiled settings, by default None (not cached on disk).
+
+    Returns
+    -------
+    dict
+        Settings. This is a copy, so the caller can modify it.
+
+    Raises
+    ------
+    SettingError
+        If a value is invalid.
+    """
+    if not filepath:
+        return _compile_settings(filepath, dpi)
+
+    key = data_hash(SETTINGS_CACHE_VERSION, file_hash(filepath), tuple(dpi))
+    if key in _SETTINGS_MEMO:
+        logger.debug(f"Settings {filepath} reused from the memo.")
+        return copy.deepcopy(_SETTINGS_MEMO[key])
+
+    settings = None
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"settings_{key}.json")
+        data = read_json_cache(cache_path)
+        if data is not None:
+            try:
+                settings = _settings_from_json(data)
+                validate_settings(settings)
+                logger.info(f"Settings loaded from the cache {cache_path}: {settings}")
+            except (KeyError, TypeError, ValueError, IndexError, SettingError) as e:
+                logger.warning(f"Cache {cache_path} is broken (ignored): {e}")
+                settings = None
+    if settings is None:
+        settings = _compile_settings(filepath, dpi)
+        if cache_path is not None:
+            write_json_cache(cache_path, _settings_to_json(settings))
+    _SETTINGS_MEMO[key] = settings
+    return copy.deepcopy(settings)
+
+
 def decide_save_filename(
     read_path: str, save_dir: str, data: Optional[dict] = None
 ) -> str:
@@ -160,7 +420,7 @@ def decide_save_filename(
     Parameters
     ----------
     read_path : str
-        Original file path.
+        Original file path, or a page "path#page" of a multi-page file.
     save_dir: str
         Save directory name.
     data : Union[dict, None], optional
@@ -171,11 +431,17 @@ def decide_save_filename(
     str
         Save file name.
     """
+    read_path, page = split_page(read_path)
     read_filename = os.path.basename(read_path)
     read_dir = os.path.basename(os.path.dirname(read_path))
+    name, ext = os.path.splitext(read_filename)
+    if is_pdf(read_filename):
+        # the pages of PDF are saved as images.
+        ext = ".png"
     if data:
-        _, ext = os.path.splitext(read_filename)
         save_filename = f"{read_dir}-{data.get('room', 'x')}_{data.get('class', 'x')}_{data.get('student_number_10', 'x')}{data.get('student_number_1','x')}{ext}"
+    elif page is not None:
+        save_filename = f"{name}_{page}{ext}"
     else:
         save_filename = read_filename
     return save_filename
@@ -0,0 +1,201 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .image_io import list_images, expand_pages
+from .pipeline import PipelineRun
+
+logger = logging.getLogger("adjust-scan-images")
+
+# Files being written by the scanners. They are renamed when completed.
+PARTIAL_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload", ".filepart")
+
+
+class FolderWatcher:
+    """
+    Detect the files fully written in a directory by polling.
+
+    Note
+    ----------
+    A file is ready when its size and mtime are unchanged for stable_seconds.
+    With the rename protocol (write to "name.jpg.part", then rename to "name.jpg"),
+    stable_seconds can be 0.
+    Hidden files and the files with PARTIAL_SUFFIXES are ignored.
+    A file is detected again if it is overwritten.
+    A ready multi-page file is returned as its pages "path#page".
+    """
+
+    def __init__(self, dirname: str, stable_seconds: float = 2.0):
+        """
+        Parameters
+        ----------
+        dirname : str
+            The directory to watch. The subdirectories are watched too.
+        stable_seconds : float, optional
+            The seconds a file must be unchanged, by default 2.0.
+        """
+        self.dirname = dirname
+        self.stable_seconds = stable_seconds
+        # path -> ((size, mtime), the time when first observed with this stat)
+        self._observed: Dict[str, Tuple[Tuple[int, float], float]] = {}
+        # path -> (size, mtime) detected as ready
+        self._detected: Dict[str, Tuple[int, float]] = {}
+
+    @staticmethod
+    def is_partial(path: str) -> bool:
+        """
+        Whether the file is being written or hidden.
+        """
+        filename = os.path.basename(path)
+        return filename.startswith(".") or filename.lower().endswith(PARTIAL_SUFFIXES)
+
+    def poll(self) -> List[str]:
+        """
+        Scan the directory once.
+
+        Returns
+        -------
+        List[str]
+            The files which became ready since the last poll, in the processing order.
+        """
+        now = time.monotonic()
+        ready = []
+        observed = {}
+        for p in list_images(self.dirname, pages=False):
+            if self.is_partial(p):
+                continue
+            try:
+                st = os.stat(p)
+            except FileNotFoundError:
+                # renamed or removed during the scan
+                continue
+            stat = (st.st_size, st.st_mtime)
+            if self._detected.get(p) == stat:
+                continue
+            last = self._observed.get(p)
+            since = last[1] if last is not None and last[0] == stat else now
+            observed[p] = (stat, since)
+            if st.st_size > 0 and now - since >= self.stable_seconds:
+                ready.append(p)
+                self._detected[p] = stat
+                del observed[p]
+        self._observed = observed
+        pages = []
+        for p in ready:
+            try:
+                pages.extend(expand_pages([p]))
+            except Exception as e:
+                # processed as one file and recorded as an error.
+                logger.error(f"Watch: The pages of {p} cannot be counted: {e!r}")
+                pages.append(p)
+        return pages
+
+
+def process_isolated(run: PipelineRun, paths: Sequence[str]) -> int:
+    """
+    Process the paths, isolating the errors of each file.
+
+    The paths are processed together first. If an error is raised
+    (e.g. a broken file or an image without dpi), the paths not recorded yet
+    are processed one by one, and the paths raising errors are recorded
+    as errors, so they are not processed again until the files change.
+
+    Parameters
+    ----------
+    run : PipelineRun
+        The run.
+    paths : Sequence[str]
+        The paths (pages) to process.
+
+    Returns
+    -------
+    int
+        The number of processed images.
+    """
+    try:
+        n = run.process(paths)
+        run.flush()
+        return n
+    except Exception as e:
+        logger.warning(f"Watch: {e!r}. The images are processed one by one.")
+    try:
+        run.flush()
+    except Exception as e:
+        logger.error(f"Watch: {e!r}")
+    n = 0
+    for p in paths:
+        if run.is_done(p):
+            continue
+        try:
+            n += run.process([p])
+            run.flush()
+        except Exception as e:
+            logger.error(f"Watch: {p} cannot be processed: {e!r}")
+            run.record_error(p)
+    return n
+
+
+def watch(
+    img_dir: str,
+    metadata_path: Optional[str],
+    save_dir: str,
+    baseimg_path: str,
+    interval: float = 1.0,
+    stable_seconds: float = 2.0,
+    stop_event: Optional[threading.Event] = None,
+    max_polls: Optional[int] = None,
+    **run_kargs,
+):
+    """
+    Watch img_dir and process the new images until stopped.
+
+    The settings, the fitted models and the result files are kept open,
+    so a new image is processed within interval + stable_seconds.
+    The results are appended to the marksheet result and the manifest in save_dir,
+    and the images already recorded in the manifest are not processed again.
+    The errors of a file are logged and recorded in the manifest (status "error"),
+    and the watch goes on.
+
+    Parameters
+    ----------
+    img_dir : str
+        The directory to watch.
+    metadata_path : None | str
+        The path of the metadata.
+    save_dir : str
+        The name of the directory. We save the processed images in this directory.
+    baseimg_path : str
+        The base image for the transformation.
+    interval : float, optional
+        The seconds between the polls, by default 1.0.
+    stable_seconds : float, optional
+        See FolderWatcher, by default 2.0.
+    stop_event : threading.Event | None, optional
+        Stop watching when this is set, by default None (until KeyboardInterrupt).
+    max_polls : int | None, optional
+        Stop after this number of polls, by default None (unlimited).
+    run_kargs
+        workers, prefetch, save_workers, save_metrics, cache_dir and resume.
+        See pipeline().
+    """
+    logger.info(f"Watch {img_dir} every {interval} s. Stop with Ctrl+C.")
+    watcher = FolderWatcher(img_dir, stable_seconds)
+    with PipelineRun(metadata_path, save_dir, baseimg_path, **run_kargs) as run:
+        polls = 0
+        try:
+            while stop_event is None or not stop_event.is_set():
+                paths = [p for p in watcher.poll() if not run.is_done(p)]
+                if paths:
+                    n = process_isolated(run, paths)
+                    logger.info(f"Watch: {n} images processed.")
+                polls += 1
+                if max_polls is not None and polls >= max_polls:
+                    break
+                if stop_event is not None:
+                    stop_event.wait(interval)
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("Watch: stopped.")
@@ -0,0 +1,12 @@
+import pytest
+
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture(scope="session")
+def dataset(tmp_path_factory):
+    """
+    Two synthetic marksheet scans with their setting and base image.
+    The files are shared by the tests, so copy them before changing.
+    """
+    return generate(str(tmp_path_factory.mktemp("data")), 2, dpi=100)
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.align_images import ImageAligner, MARKER_BACKENDS
+
+RANGE = 300
+
+
+def make_metadata(backend: str, scale: int) -> dict:
+    return {
+        "marker_gaussian_ksize": 15,
+        "marker_gaussian_std": 3,
+        "marker_range": [
+            (0, 0, RANGE, RANGE),
+            (0, -RANGE, RANGE, RANGE),
+            (-RANGE, -RANGE, RANGE, RANGE),
+            (-RANGE, 0, RANGE, RANGE),
+        ],
+        "marker_backend": backend,
+        "marker_search_scale": scale,
+    }
+
+
+def cluttered_page(rng: np.random.Generator) -> np.ndarray:
+    """
+    A page with a marker and dots, strokes and outlines in each corner.
+    """
+    img = np.full((1200, 900), 255, np.uint8)
+    for cx, cy in [(0, 0), (0, 900), (600, 900), (600, 0)]:
+        if rng.random() < 0.3:
+            # a thin outline, which is the largest contour at full resolution.
+            x, y = cx + int(rng.integers(20, 200)), cy + int(rng.integers(20, 200))
+            cv2.rectangle(img, (x, y), (x + 50, y + 49), 0, 2)
+            x, y = cx + int(rng.integers(20, 260)), cy + int(rng.integers(20, 260))
+            cv2.rectangle(img, (x, y), (x + 15, y + 15), 0, -1)
+        else:
+            s = int(rng.integers(20, 60))
+            x = cx + int(rng.integers(0, 280 - s))
+            y = cy + int(rng.integers(0, 280 - s))
+            cv2.rectangle(img, (x, y), (x + s, y + s), 0, -1)
+        for _ in range(int(rng.integers(0, 300))):
+            px, py = cx + int(rng.integers(0, 300)), cy + int(rng.integers(0, 300))
+            if rng.random() < 0.6:
+                radius = int(rng.integers(1, 8))
+                cv2.circle(img, (px, py), radius, int(rng.integers(0, 140)), -1)
+            else:
+                dx, dy = rng.integers(-30, 31, 2).tolist()
+                width = int(rng.integers(1, 4))
+                cv2.line(img, (px, py), (px + dx, py + dy), 0, width)
+    return img
+
+
+def assert_same_markers(found, expected):
+    if expected is False:
+        assert found is False
+    else:
+        assert found is not False
+        np.testing.assert_allclose(found, expected, atol=1e-9)
+
+
+@pytest.mark.parametrize("backend", MARKER_BACKENDS)
+@pytest.mark.parametrize("scale", [0, 4, 7, 8])
+def test_thin_outline_wins_over_dot(backend, scale):
+    # The outline vanishes in the downsampled range, but its contour is larger.
+    img = np.full((1200, 900), 255, np.uint8)
+    for cx, cy in [(0, 0), (0, 900), (600, 900), (600, 0)]:
+        cv2.rectangle(img, (cx + 40, cy + 40), (cx + 90, cy + 89), 0, 2)
+        cv2.rectangle(img, (cx + 200, cy + 200), (cx + 215, cy + 215), 0, -1)
+    expected = ImageAligner(make_metadata(backend, 1))._find_markers(img)
+    found = ImageAligner(make_metadata(backend, scale))._find_markers(img)
+    assert_same_markers(found, expected)
+
+
+@pytest.mark.parametrize("backend", MARKER_BACKENDS)
+def test_cluttered_corners_same_as_full_resolution(backend):
+    rng = np.random.default_rng(0)
+    full = ImageAligner(make_metadata(backend, 1))
+    pyramids = [ImageAligner(make_metadata(backend, s)) for s in (0, 2, 4, 7, 8)]
+    for _ in range(40):
+        img = cluttered_page(rng)
+        expected = full._find_markers(img)
+        for aligner in pyramids:
+            assert_same_markers(aligner._find_markers(img), expected)
+
+
+def test_default_is_full_resolution():
+    metadata = make_metadata("contour", 1)
+    del metadata["marker_search_scale"]
+    aligner = ImageAligner(metadata)
+    assert aligner._scale_of(RANGE, RANGE) == 1
@@ -0,0 +1,25 @@
+import json
+
+from src.batch import load_jobs, run_jobs
+
+
+def test_invalid_job_is_skipped(dataset, tmp_path):
+    good = {
+        "img_dir": dataset["img_dir"],
+        "setting": dataset["setting"],
+        "base": dataset["base"],
+    }
+    jobs = [
+        dict(good, save_dir=str(tmp_path / "out1")),
+        {"img_dir": str(tmp_path / "missing")},
+        dict(good, sav_dir=str(tmp_path / "typo")),
+        dict(good, save_dir=str(tmp_path / "out2")),
+    ]
+    job_file = tmp_path / "jobs.json"
+    job_file.write_text(json.dumps({"jobs": jobs}), encoding="utf-8")
+
+    report = run_jobs(load_jobs(str(job_file)))
+    statuses = [r["status"] for r in report["jobs"]]
+    assert statuses == ["ok", "invalid", "invalid", "ok"]
+    assert [r["images"] for r in report["jobs"]] == [2, 0, 0, 2]
+    assert report["total"]["failed"] == 2
@@ -0,0 +1,100 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src import image_io
+from src.image_io import ImageSaver, iter_images, read_image
+
+
+def test_prefetch_one_overlaps_decode(monkeypatch):
+    # The next file must be decoded while the caller processes the current one.
+    started = {p: threading.Event() for p in ("a", "b", "c")}
+
+    def read_item(path, resize_ratio):
+        started[path].set()
+        return path, np.zeros((2, 2), np.uint8), (300, 300)
+
+    monkeypatch.setattr(image_io, "_read_image_item", read_item)
+    paths = ["a", "b", "c"]
+    for i, (p, _, _) in enumerate(iter_images(paths, prefetch=1)):
+        assert p == paths[i]
+        if i + 1 < len(paths):
+            next_path = paths[i + 1]
+            assert started[next_path].wait(timeout=5), f"{next_path} not prefetched"
+
+
+def test_without_prefetch_decodes_on_request(monkeypatch):
+    decoded = []
+
+    def read_item(path, resize_ratio):
+        decoded.append(path)
+        return path, np.zeros((2, 2), np.uint8), (300, 300)
+
+    monkeypatch.setattr(image_io, "_read_image_item", read_item)
+    for p, _, _ in iter_images(["a", "b"], prefetch=0):
+        assert decoded[-1] == p
+
+
+def test_saver_calls_on_saved_after_the_file_is_complete(tmp_path):
+    saved = threading.Event()
+    img = np.full((20, 30), 200, np.uint8)
+    with ImageSaver(str(tmp_path), workers=1) as saver:
+        filename = saver.save("a.png", img, (300, 300), on_saved=saved.set)
+        saver.flush()
+        assert saved.is_set()
+    assert os.listdir(tmp_path) == [filename]
+    np.testing.assert_array_equal(np.asarray(Image.open(tmp_path / filename)), img)
+
+
+def test_saver_failed_write_leaves_no_file(tmp_path):
+    saved = threading.Event()
+    saver = ImageSaver(str(tmp_path), workers=1)
+    # Pillow cannot write this extension.
+    saver.save("a.unknown", np.zeros((4, 4), np.uint8), (300, 300), saved.set)
+    with pytest.raises(ValueError):
+        saver.close()
+    assert not saved.is_set()
+    assert os.listdir(tmp_path) == []
+
+
+def open_files() -> list:
+    files = []
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            files.append(os.readlink(os.path.join("/proc/self/fd", fd)))
+        except OSError:
+            # closed meanwhile (e.g. by the threads of the other tests).
+            pass
+    return files
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+@pytest.mark.parametrize("resize_ratio", [None, 0.5])
+def test_read_image_closes_the_file(tmp_path, resize_ratio):
+    path = str(tmp_path / "nodpi.png")
+    Image.fromarray(np.zeros((20, 20), np.uint8)).save(path)
+    errors = []
+    for _ in range(5):
+        try:
+            read_image(path, resize_ratio)
+        except KeyError as e:
+            # the traceback keeps the frame of read_image alive.
+            errors.append(e)
+    assert len(errors) == 5
+    assert path not in open_files()
+
+
+@pytest.mark.parametrize("resize_ratio", [None, 1.0])
+def test_read_image_without_resizing_keeps_jpeg_pixels(tmp_path, resize_ratio):
+    rng = np.random.default_rng(0)
+    color = rng.integers(0, 256, (64, 48, 3), dtype=np.uint8)
+    path = str(tmp_path / "color.jpg")
+    Image.fromarray(color).save(path, dpi=(300, 300), quality=90)
+    img, dpi = read_image(path, resize_ratio)
+    with Image.open(path) as pilimg:
+        expected = np.asarray(pilimg.convert("L"))
+    np.testing.assert_array_equal(img, expected)
+    assert dpi == (300, 300)
@@ -0,0 +1,181 @@
+import os
+import csv
+import glob
+import shutil
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src import pipeline as pipeline_module
+from src.image_io import TEMP_FILE_PATTERN, ImageSaver, list_images
+from src.pipeline import PipelineRun, pipeline
+
+
+def test_page_is_recorded_after_its_image_is_written(dataset, tmp_path, monkeypatch):
+    release = threading.Event()
+    save_image = ImageSaver._save_image
+
+    def slow_save_image(self, *args, **kwargs):
+        assert release.wait(timeout=10)
+        return save_image(self, *args, **kwargs)
+
+    monkeypatch.setattr(ImageSaver, "_save_image", slow_save_image)
+    save_dir = str(tmp_path)
+    paths = list_images(dataset["img_dir"])
+    with PipelineRun(
+        dataset["setting"], save_dir, dataset["base"], save_workers=1
+    ) as run:
+        run.process(paths)
+        # queued but not written: not recorded yet.
+        assert not run.manifest.records
+        release.set()
+        run.flush()
+        assert all(run.is_done(p) for p in paths)
+    saved = [f for f in os.listdir(save_dir) if f.endswith(".png")]
+    assert len(saved) == len(paths)
+
+
+def test_save_dir_is_created(dataset, tmp_path):
+    save_dir = tmp_path / "new" / "out"
+    pipeline(dataset["img_dir"], dataset["setting"], str(save_dir), dataset["base"])
+    saved = list_images(str(save_dir), ".png")
+    assert len(saved) == len(list_images(dataset["img_dir"]))
+
+
+def run_pipeline(dataset, save_dir, **run_kargs):
+    paths = list_images(dataset["img_dir"])
+    with PipelineRun(dataset["setting"], save_dir, dataset["base"], **run_kargs) as run:
+        run.process(paths)
+        return {p: run.manifest.records[os.path.abspath(p)] for p in paths}
+
+
+def test_workers_write_the_same_images(dataset, tmp_path):
+    serial_dir, parallel_dir = str(tmp_path / "serial"), str(tmp_path / "parallel")
+    os.makedirs(serial_dir)
+    os.makedirs(parallel_dir)
+    serial = run_pipeline(dataset, serial_dir)
+    parallel = run_pipeline(dataset, parallel_dir, workers=2)
+    for p, record in serial.items():
+        assert parallel[p]["status"] == record["status"]
+        filename = record["save_filename"]
+        assert parallel[p]["save_filename"] == filename
+        with open(os.path.join(serial_dir, filename), "rb") as f1, open(
+            os.path.join(parallel_dir, filename), "rb"
+        ) as f2:
+            assert f1.read() == f2.read()
+    # no temporary files are left.
+    assert not [f for f in os.listdir(parallel_dir) if f.startswith(".")]
+
+
+def temp_files(dirname: str) -> list:
+    return [f for f in os.listdir(dirname) if TEMP_FILE_PATTERN.match(f)]
+
+
+def test_failing_worker_leaves_no_temporary_files(dataset, tmp_path):
+    img_dir, save_dir = tmp_path / "in", tmp_path / "out"
+    img_dir.mkdir()
+    save_dir.mkdir()
+    for filename in os.listdir(dataset["img_dir"]):
+        shutil.copy(os.path.join(dataset["img_dir"], filename), img_dir / filename)
+    # the first page raises in a worker while the others are written.
+    Image.fromarray(np.full((50, 50), 255, np.uint8)).save(img_dir / "a_nodpi.png")
+    with pytest.raises(KeyError):
+        pipeline(str(img_dir), dataset["setting"], str(save_dir), dataset["base"], 2)
+    assert not temp_files(str(save_dir))
+
+
+def test_stale_temporary_files_are_removed(dataset, tmp_path):
+    stale = tmp_path / ".imgs-A_1_00.1234.0.tmp.png"
+    stale.write_bytes(b"\0")
+    kept = tmp_path / "notes.tmp.txt"
+    kept.write_bytes(b"\0")
+    with PipelineRun(dataset["setting"], str(tmp_path), dataset["base"]):
+        pass
+    assert not stale.exists()
+    assert kept.exists()
+
+
+def read_csv(save_dir: str) -> list:
+    (path,) = glob.glob(os.path.join(save_dir, "marksheet_result_*.csv"))
+    with open(path, encoding="shift_jis", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.fixture
+def copied_dataset(dataset, tmp_path):
+    img_dir = tmp_path / "in"
+    shutil.copytree(dataset["img_dir"], img_dir)
+    return dict(dataset, img_dir=str(img_dir))
+
+
+def test_changed_source_replaces_its_result(copied_dataset, tmp_path):
+    dataset, save_dir = copied_dataset, str(tmp_path / "out")
+    run_pipeline(dataset, save_dir)
+    first, second = list_images(dataset["img_dir"])
+    rows = {r["origin_filename"]: r for r in read_csv(save_dir)}
+    previous_filename = rows[os.path.basename(first)]["save_filename"]
+    # the first file is rescanned with the marks of the second.
+    shutil.copy(second, first)
+    os.utime(first, (1, 1))
+    records = run_pipeline(dataset, save_dir)
+
+    rows = read_csv(save_dir)
+    assert sorted(r["origin_filename"] for r in rows) == sorted(
+        os.path.basename(p) for p in (first, second)
+    )
+    new_filename = records[first]["save_filename"]
+    assert {r["save_filename"] for r in rows} == {
+        new_filename,
+        records[second]["save_filename"],
+    }
+    assert new_filename != previous_filename
+    assert not os.path.exists(os.path.join(save_dir, previous_filename))
+    assert os.path.exists(os.path.join(save_dir, new_filename))
+
+
+def test_touched_source_keeps_its_file_name(copied_dataset, tmp_path):
+    dataset, save_dir = copied_dataset, str(tmp_path / "out")
+    before = run_pipeline(dataset, save_dir)
+    first = list_images(dataset["img_dir"])[0]
+    os.utime(first, (1, 1))
+    after = run_pipeline(dataset, save_dir)
+    assert after[first]["save_filename"] == before[first]["save_filename"]
+    assert len(read_csv(save_dir)) == len(before)
+    saved = list_images(save_dir, ".png")
+    assert len(saved) == len(before)
+
+
+def test_no_resume_processes_all_pages_again(dataset, tmp_path):
+    save_dir = str(tmp_path)
+    paths = list_images(dataset["img_dir"])
+    run_pipeline(dataset, save_dir)
+    with PipelineRun(
+        dataset["setting"], save_dir, dataset["base"], resume=False
+    ) as run:
+        assert not any(run.is_done(p) for p in paths)
+        assert run.process(paths) == len(paths)
+    assert glob.glob(os.path.join(save_dir, "manifest_*.jsonl.old"))
+    # the images are overwritten.
+    assert len(list_images(save_dir, ".png")) == len(paths)
+
+
+def test_model_cache_key_has_the_version(dataset, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+
+    def cached_models() -> set:
+        # not reused from the memo of this process.
+        monkeypatch.setattr(pipeline_module, "_models_memo", {})
+        with PipelineRun(
+            dataset["setting"], str(tmp_path), dataset["base"], cache_dir=cache_dir
+        ):
+            pass
+        return set(glob.glob(os.path.join(cache_dir, "models_*.json")))
+
+    first = cached_models()
+    assert len(first) == 1
+    assert cached_models() == first
+    version = pipeline_module.MODEL_CACHE_VERSION
+    monkeypatch.setattr(pipeline_module, "MODEL_CACHE_VERSION", version + 1)
+    assert len(cached_models()) == 2
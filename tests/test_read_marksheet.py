@@ -0,0 +1,148 @@
+import warnings
+
+import cv2
+import numpy as np
+import pytest
+
+from src.read_marksheet import MarkReader
+
+KSIZE, STD = 5, 1
+# bbox (x, y, w, h). The last category is partly and wholly outside the image.
+SHEET = {
+    "room": {v: (20 + 30 * i, 20, 12, 12) for i, v in enumerate("ABCDEF")},
+    "class": {str(v): (20 + 30 * i, 60, 12, 12) for i, v in enumerate(range(1, 10))},
+    "number": {str(v): (20 + 30 * i, 100, 12, 12) for i, v in enumerate(range(10))},
+    "edge": {
+        "in": (200, 140, 12, 12),
+        "cut": (292, 140, 12, 12),
+        "out": (320, 140, 8, 8),
+    },
+}
+SHAPE = (160, 300)
+
+
+def reference_read(img, base_img, threshold):
+    """
+    The reading of the baseline: np.mean of each mark of the whole preprocessed
+    image, np.argmax of each category and the threshold only when fitted.
+    """
+
+    def preprocess(img):
+        return cv2.bitwise_not(cv2.GaussianBlur(img, (KSIZE, KSIZE), STD))
+
+    def mark_scores(preprocessed, coords):
+        ih, iw = preprocessed.shape
+        with warnings.catch_warnings():
+            # the marks outside the image are nan.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return {
+                value: np.mean(preprocessed[y : min(y + h, ih), x : min(x + w, iw)])
+                for value, (x, y, w, h) in coords.items()
+            }
+
+    base = None
+    if base_img is not None:
+        preprocessed = preprocess(base_img)
+        base = {c: mark_scores(preprocessed, coords) for c, coords in SHEET.items()}
+    preprocessed = preprocess(img)
+    mark, all_scores = {}, []
+    for category, coords in SHEET.items():
+        score_dict = mark_scores(preprocessed, coords)
+        if base is not None:
+            score_dict = {v: s - base[category][v] for v, s in score_dict.items()}
+        values, scores = tuple(score_dict.keys()), tuple(score_dict.values())
+        all_scores.extend(scores)
+        if base is not None and np.max(scores) <= threshold:
+            mark[category] = None
+        else:
+            mark[category] = values[np.argmax(scores)]
+    return mark, np.array(all_scores)
+
+
+def fill(img, coords, value, level):
+    x, y, w, h = coords[value]
+    img[y : y + h, x : x + w] = level
+
+
+def random_page(rng):
+    img = np.full(SHAPE, 255, np.uint8)
+    for category, coords in SHEET.items():
+        case = rng.integers(4)
+        values = list(coords)
+        if case == 0:
+            # no mark.
+            continue
+        level = int(rng.integers(0, 250))
+        first, second = rng.choice(len(values), 2, replace=False)
+        fill(img, coords, values[first], level)
+        if case == 1:
+            # a tie: the same mark twice.
+            fill(img, coords, values[second], level)
+        elif case == 2:
+            # a fainter second mark.
+            fill(img, coords, values[second], min(level + 40, 255))
+    # dust between the marks.
+    for _ in range(int(rng.integers(0, 20))):
+        x, y = int(rng.integers(0, SHAPE[1])), int(rng.integers(0, SHAPE[0]))
+        cv2.circle(img, (x, y), 1, int(rng.integers(0, 255)), -1)
+    return img
+
+
+def make_reader(backend, threshold):
+    return MarkReader(
+        {
+            "sheet": SHEET,
+            "sheet_coord_style": "bbox",
+            "sheet_gaussian_ksize": KSIZE,
+            "sheet_gaussian_std": STD,
+            "sheet_score_threshold": threshold,
+            "sheet_score_backend": backend,
+        }
+    )
+
+
+# np.mean of the marks outside the image (the "mean" backend).
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("backend", ["integral", "mean"])
+@pytest.mark.parametrize("is_fitted", [False, True])
+@pytest.mark.parametrize("threshold", [0, 30])
+def test_read_same_as_reference(backend, is_fitted, threshold):
+    rng = np.random.default_rng(threshold)
+    base_img = None
+    reader = make_reader(backend, threshold)
+    if is_fitted:
+        base_img = random_page(rng) // 2 + 127
+        reader.fit(base_img)
+    for _ in range(50):
+        img = random_page(rng)
+        expected_mark, expected_scores = reference_read(img, base_img, threshold)
+        mark, scores = reader.read(img, return_scores=True)
+        np.testing.assert_array_equal(scores, expected_scores)
+        assert mark == expected_mark
+
+
+def test_ties_and_no_marks():
+    img = np.full(SHAPE, 255, np.uint8)
+    fill(img, SHEET["room"], "C", 0)
+    fill(img, SHEET["room"], "E", 0)
+    fill(img, SHEET["number"], "7", 240)
+    reader = make_reader("integral", 30)
+    reader.fit(np.full(SHAPE, 255, np.uint8))
+    mark = reader.read(img)
+    # the first of the tie, no mark and a mark below the threshold.
+    assert mark["room"] == "C"
+    assert mark["class"] is None
+    assert mark["number"] is None
+    # nan of the mark outside the image is the maximum like np.argmax.
+    assert mark["edge"] == "out"
+    assert reference_read(img, np.full(SHAPE, 255, np.uint8), 30)[0] == mark
+
+
+def test_score_equal_to_threshold_is_no_mark():
+    blank = np.full(SHAPE, 255, np.uint8)
+    reader = make_reader("integral", 0)
+    reader.fit(blank)
+    # all the scores are 0 after subtracting the base scores (nan outside).
+    mark = reader.read(blank)
+    assert mark == {"room": None, "class": None, "number": None, "edge": "out"}
+    assert reference_read(blank, blank, 0)[0] == mark
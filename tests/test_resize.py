@@ -0,0 +1,32 @@
+import numpy as np
+from PIL import Image
+
+from resize.resize import DONE, ERROR, SKIPPED, resize_images
+
+
+def run(src, dst, rate):
+    return {p: r.split(":")[0] for p, r in resize_images(str(src), str(dst), rate)}
+
+
+def test_other_rate_is_resized_again(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    Image.fromarray(np.zeros((40, 60), np.uint8)).save(src / "a.png")
+    assert set(run(src, dst, 0.5).values()) == {DONE}
+    assert set(run(src, dst, 0.5).values()) == {SKIPPED}
+    assert set(run(src, dst, 0.25).values()) == {DONE}
+    with Image.open(dst / "a.png") as img:
+        assert img.size == (15, 10)
+
+
+def test_undecodable_file_is_an_error(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    Image.fromarray(np.zeros((40, 60), np.uint8)).save(src / "a.png")
+    data = (src / "a.png").read_bytes()
+    (src / "truncated.png").write_bytes(data[: len(data) // 2])
+    (src / "broken.png").write_bytes(b"not an image")
+    results = run(src, dst, 0.5)
+    assert results[str(src / "a.png")] == DONE
+    assert results[str(src / "truncated.png")] == ERROR
+    assert results[str(src / "broken.png")] == ERROR
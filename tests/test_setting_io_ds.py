@@ -0,0 +1,19 @@
+import pytest
+
+from benchmarks.synthetic import write_setting
+from src.errors import SettingError
+from src.setting_io_ds import load_settings
+
+
+def test_empty_blank_page_action_is_none(tmp_path):
+    path = str(tmp_path / "setting.xlsx")
+    write_setting(path, blank_page_action=None)
+    settings = load_settings(path, (300, 300))
+    assert settings["blank_page_action"] == "none"
+
+
+def test_invalid_blank_page_action_is_rejected(tmp_path):
+    path = str(tmp_path / "setting.xlsx")
+    write_setting(path, blank_page_action="drop")
+    with pytest.raises(SettingError):
+        load_settings(path, (300, 300))
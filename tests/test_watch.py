@@ -0,0 +1,83 @@
+import os
+import json
+import shutil
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.manifest import MANIFEST_FILENAME
+from src.watch import watch
+
+
+def read_records(save_dir: str) -> dict:
+    with open(os.path.join(save_dir, MANIFEST_FILENAME), encoding="utf-8") as f:
+        records = [json.loads(line) for line in f.read().splitlines()[1:]]
+    return {os.path.basename(r["path"]): r for r in records}
+
+
+@pytest.mark.parametrize("run_kargs", [{}, {"workers": 2, "save_workers": 1}])
+def test_watch_goes_on_after_broken_files(dataset, tmp_path, run_kargs):
+    img_dir, save_dir = tmp_path / "in", tmp_path / "out"
+    img_dir.mkdir()
+    save_dir.mkdir()
+    good, second = sorted(os.listdir(dataset["img_dir"]))
+    shutil.copy(os.path.join(dataset["img_dir"], good), img_dir / good)
+    # truncated while copying, and an image without dpi.
+    with open(os.path.join(dataset["img_dir"], second), "rb") as f:
+        (img_dir / "broken.png").write_bytes(f.read()[:2000])
+    Image.fromarray(np.full((50, 50), 255, np.uint8)).save(img_dir / "nodpi.png")
+    # the rename protocol: not processed until renamed.
+    shutil.copy(os.path.join(dataset["img_dir"], second), img_dir / "scan.png.part")
+
+    watch(
+        str(img_dir),
+        dataset["setting"],
+        str(save_dir),
+        dataset["base"],
+        interval=0,
+        stable_seconds=0,
+        max_polls=2,
+        **run_kargs,
+    )
+    records = read_records(str(save_dir))
+    assert records[good]["status"] == "ok"
+    assert os.path.exists(save_dir / records[good]["save_filename"])
+    assert records["broken.png"]["status"] == "error"
+    assert records["nodpi.png"]["status"] == "error"
+    assert "scan.png.part" not in records
+
+
+def test_watch_waits_for_files_being_written(dataset, tmp_path):
+    img_dir, save_dir = tmp_path / "in", tmp_path / "out"
+    img_dir.mkdir()
+    save_dir.mkdir()
+    good = sorted(os.listdir(dataset["img_dir"]))[0]
+    shutil.copy(os.path.join(dataset["img_dir"], good), img_dir / good)
+    growing = img_dir / "growing.png"
+    growing.write_bytes(b"\x89PNG")
+    stop = threading.Event()
+
+    def write_slowly():
+        while not stop.wait(0.02):
+            with open(growing, "ab") as f:
+                f.write(b"\0" * 100)
+
+    writer = threading.Thread(target=write_slowly)
+    writer.start()
+    try:
+        watch(
+            str(img_dir),
+            dataset["setting"],
+            str(save_dir),
+            dataset["base"],
+            interval=0.2,
+            stable_seconds=0.5,
+            max_polls=6,
+        )
+    finally:
+        stop.set()
+        writer.join()
+    records = read_records(str(save_dir))
+    assert list(records) == [good]